@@ -0,0 +1,230 @@
+"""Analítica de inventario vectorizada: clasificación ABC, rotación, cobertura, reposición y pronóstico.
+
+Las líneas de venta del rango y el estado de los productos se leen una sola vez y se
+calculan con operaciones de NumPy/pandas sobre columnas completas (sin bucles por fila),
+así cientos de miles de líneas se procesan en décimas de segundo.
+
+Lo usa la API en GET /reportes/analitica (cacheado por versión de datos como el resto de
+reportes) y `mantenimiento.py pronostico`. Requiere numpy y pandas: pip install pandas
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+try:
+    import numpy as np
+    import pandas as pd
+except Exception:
+    np = pd = None
+
+# Covering: idx_detalle_ganancias (fecha_venta, id_producto, cantidad, precio_unitario, costo_unitario)
+SQL_LINEAS = (
+    "SELECT id_producto, fecha_venta, cantidad, precio_unitario, costo_unitario FROM Detalle_Ventas "
+    "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s "
+    "UNION ALL SELECT id_producto, fecha_venta, cantidad, precio_unitario, costo_unitario FROM Detalle_Ventas_Archivo "
+    "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s"
+)
+SQL_PRODUCTOS = "SELECT id_producto, nombre, stock, stock_minimo, precio_compra FROM Productos"
+
+COLUMNAS_LINEAS = ['id_producto', 'fecha_venta', 'cantidad', 'precio_unitario', 'costo_unitario']
+COLUMNAS_PRODUCTOS = ['id_producto', 'nombre', 'stock', 'stock_minimo', 'precio_compra']
+
+# Límites de la clasificación ABC sobre la participación acumulada en los ingresos
+LIMITE_A = 0.80
+LIMITE_B = 0.95
+
+
+def disponible() -> bool:
+    return pd is not None
+
+
+def cargar(conn, desde, hasta):
+    """Lee las líneas de venta de [desde, hasta] y los productos. Retorna (lineas, productos)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(SQL_LINEAS, {'desde': desde, 'hasta': hasta})
+        lineas = pd.DataFrame.from_records(cur.fetchall(), columns=COLUMNAS_LINEAS)
+        cur.execute(SQL_PRODUCTOS)
+        productos = pd.DataFrame.from_records(cur.fetchall(), columns=COLUMNAS_PRODUCTOS)
+    finally:
+        cur.close()
+    return lineas, productos
+
+
+def calcular(lineas, productos, dias: int, lead_time: float = 7, dias_revision: float = 14, z: float = 1.65):
+    """Indicadores por producto (un DataFrame ordenado por ingresos, de mayor a menor).
+
+    dias: días del periodo analizado (incluidos los días sin ventas).
+    lead_time: días que tarda en llegar un pedido; dias_revision: cada cuántos días se repone;
+    z: factor del nivel de servicio para el stock de seguridad (1.65 ~ 95 %).
+    """
+    dias = max(1, int(dias))
+    # Los DECIMAL de MariaDB llegan como Decimal (y una consulta vacía como object): a float64 de una vez
+    df = productos.astype({'id_producto': 'int64', 'stock': 'float64', 'stock_minimo': 'float64',
+                           'precio_compra': 'float64'}).set_index('id_producto')
+    lineas = lineas.astype({'id_producto': 'int64', 'cantidad': 'float64', 'precio_unitario': 'float64',
+                            'costo_unitario': 'float64'})
+    cantidad = lineas['cantidad']
+    por_producto = lineas['id_producto']
+
+    df['unidades'] = cantidad.groupby(por_producto).sum()
+    df['ingresos'] = (cantidad * lineas['precio_unitario']).groupby(por_producto).sum()
+    df['costo_ventas'] = (cantidad * lineas['costo_unitario']).groupby(por_producto).sum()
+    # Variabilidad de la demanda diaria: suma de cuadrados de las ventas de cada día
+    diarias = cantidad.groupby([por_producto, lineas['fecha_venta']]).sum()
+    df['suma_cuadrados'] = (diarias * diarias).groupby(level=0).sum()
+    df[['unidades', 'ingresos', 'costo_ventas', 'suma_cuadrados']] = \
+        df[['unidades', 'ingresos', 'costo_ventas', 'suma_cuadrados']].fillna(0.0)
+
+    # ABC (Pareto) por ingresos: A hasta el 80 % acumulado, B hasta el 95 %, C el resto
+    df = df.sort_values('ingresos', ascending=False, kind='stable')
+    total = df['ingresos'].sum()
+    participacion = df['ingresos'] / total if total > 0 else df['ingresos'] * 0.0
+    acumulado_previo = participacion.cumsum() - participacion
+    df['participacion'] = participacion
+    df['clase'] = np.where(df['ingresos'] <= 0, 'C',
+                           np.where(acumulado_previo < LIMITE_A, 'A', np.where(acumulado_previo < LIMITE_B, 'B', 'C')))
+
+    demanda = df['unidades'] / dias
+    sigma = np.sqrt(np.maximum(df['suma_cuadrados'] / dias - demanda * demanda, 0.0))
+    valor_inventario = df['stock'] * df['precio_compra']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['rotacion_anual'] = np.where(valor_inventario > 0, df['costo_ventas'] * (365.0 / dias) / valor_inventario, np.nan)
+        df['dias_cobertura'] = np.where(demanda > 0, df['stock'] / demanda, np.nan)
+    df['demanda_diaria'] = demanda
+    df['punto_reorden'] = demanda * lead_time + z * sigma * np.sqrt(lead_time)
+    nivel_objetivo = df['punto_reorden'] + demanda * dias_revision
+    df['cantidad_sugerida'] = np.where(df['stock'] <= df['punto_reorden'],
+                                       np.ceil(np.maximum(nivel_objetivo - df['stock'], 0.0)), 0.0)
+    return df.reset_index()
+
+
+COLUMNAS_RESULTADO = ['id_producto', 'nombre', 'clase', 'unidades', 'ingresos', 'participacion', 'rotacion_anual',
+                      'dias_cobertura', 'stock', 'demanda_diaria', 'punto_reorden', 'cantidad_sugerida']
+REDONDEO = {'ingresos': 2, 'participacion': 4, 'rotacion_anual': 2, 'dias_cobertura': 1,
+            'demanda_diaria': 3, 'punto_reorden': 1}
+ENTEROS = ('id_producto', 'unidades', 'stock', 'cantidad_sugerida')
+
+
+def a_tabla(df) -> dict:
+    """DataFrame de calcular() -> {'columns': [...], 'rows': [[...]]} con tipos nativos (NaN -> None)."""
+    out = df[COLUMNAS_RESULTADO].round(REDONDEO)
+    for col in ENTEROS:
+        out[col] = out[col].astype('int64')
+    out = out.rename(columns={'nombre': 'producto'}).astype(object)
+    out = out.where(out.notna(), None)
+    return {'columns': list(out.columns), 'rows': out.to_numpy().tolist()}
+
+
+def analizar(conn, desde, hasta, **parametros) -> dict:
+    """Carga y calcula los indicadores del periodo [desde, hasta] (date o 'YYYY-MM-DD')."""
+    if not disponible():
+        raise RuntimeError('numpy/pandas no están instalados en el servidor: pip install pandas')
+    dias = (pd.Timestamp(hasta) - pd.Timestamp(desde)).days + 1
+    lineas, productos = cargar(conn, desde, hasta)
+    return a_tabla(calcular(lineas, productos, dias, **parametros))
+
+
+# --- Pronóstico de demanda (suavizado exponencial simple) ---
+
+# Ventas diarias por producto de [desde, hasta): ya agregadas en el servidor (una fila por producto y día)
+SQL_VENTAS_DIARIAS = (
+    "SELECT id_producto, fecha_venta, SUM(cantidad) FROM Detalle_Ventas "
+    "WHERE fecha_venta >= %(desde)s AND fecha_venta < %(hasta)s GROUP BY id_producto, fecha_venta "
+    "UNION ALL SELECT id_producto, fecha_venta, SUM(cantidad) FROM Detalle_Ventas_Archivo "
+    "WHERE fecha_venta >= %(desde)s AND fecha_venta < %(hasta)s GROUP BY id_producto, fecha_venta"
+)
+SQL_IDS_PRODUCTOS = "SELECT id_producto FROM Productos ORDER BY id_producto"
+SQL_GUARDAR_PRONOSTICO = (
+    "REPLACE INTO Pronosticos_Demanda (id_producto, fecha_calculo, demanda_diaria, desviacion, stock_minimo_sugerido) "
+    "VALUES (%s, %s, %s, %s, %s)"
+)
+
+# Días iniciales con los que se arranca el nivel y el error de cada serie
+DIAS_ARRANQUE = 7
+# Desviación estándar ~ 1.25 x error absoluto medio (errores aproximadamente normales)
+FACTOR_MAD = 1.25
+
+
+def matriz_diaria(ventas, ids, desde, dias: int):
+    """Matriz productos x días (float64) con las unidades vendidas; ventas: (id_producto, fecha, cantidad)."""
+    matriz = np.zeros((len(ids), dias))
+    if len(ventas):
+        filas = pd.Index(ids).get_indexer(ventas.iloc[:, 0].astype('int64'))
+        columnas = (pd.to_datetime(ventas.iloc[:, 1]) - pd.Timestamp(desde)).dt.days.to_numpy()
+        ok = (filas >= 0) & (columnas >= 0) & (columnas < dias)
+        # add.at acumula si un producto y día aparece dos veces (tabla viva y archivo)
+        np.add.at(matriz, (filas[ok], columnas[ok]), ventas.iloc[:, 2].astype('float64').to_numpy()[ok])
+    return matriz
+
+
+def suavizar(matriz, alpha: float):
+    """Suavizado exponencial simple de cada fila. Retorna (nivel final, error absoluto medio suavizado).
+
+    El bucle es sobre los días; cada paso opera sobre todos los productos a la vez, así el
+    costo crece linealmente con la cantidad de productos.
+    """
+    arranque = matriz[:, :DIAS_ARRANQUE]
+    nivel = arranque.mean(axis=1) if arranque.shape[1] else np.zeros(len(matriz))
+    mad = np.abs(arranque - nivel[:, None]).mean(axis=1) if arranque.shape[1] else np.zeros(len(matriz))
+    for t in range(matriz.shape[1]):
+        x = matriz[:, t]
+        mad = alpha * np.abs(x - nivel) + (1 - alpha) * mad
+        nivel = alpha * x + (1 - alpha) * nivel
+    return nivel, mad
+
+
+def suavizar_en_paralelo(matriz, alpha: float, procesos: int = 1, bloque: int = 50000):
+    """suavizar() repartiendo bloques de productos entre `procesos` procesos (1 = en este proceso).
+
+    Con menos de `bloque` productos se calcula en este proceso: arrancar el pool cuesta más
+    que el cálculo (~25 ms por cada 10.000 productos y 180 días).
+    """
+    if procesos <= 1 or len(matriz) <= bloque:
+        return suavizar(matriz, alpha)
+    partes = np.array_split(matriz, max(procesos, -(-len(matriz) // bloque)))
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        resultados = list(pool.map(suavizar, partes, repeat(alpha)))
+    return np.concatenate([r[0] for r in resultados]), np.concatenate([r[1] for r in resultados])
+
+
+def pronosticar(matriz, alpha: float = 0.3, lead_time: float = 7, z: float = 1.65, procesos: int = 1):
+    """Pronóstico por producto: (demanda diaria, desviación diaria, stock_minimo sugerido).
+
+    El stock mínimo sugerido es el punto de reorden: demanda del plazo de entrega más el
+    stock de seguridad (z x desviación x raíz del plazo), redondeado hacia arriba.
+    """
+    nivel, mad = suavizar_en_paralelo(matriz, alpha, procesos)
+    desviacion = FACTOR_MAD * mad
+    sugerido = np.ceil(np.round(nivel * lead_time + z * desviacion * np.sqrt(lead_time), 6)).astype('int64')
+    return nivel, desviacion, sugerido
+
+
+def cargar_historial(conn, desde, hasta):
+    """(ids de productos, matriz productos x días) con las ventas diarias de [desde, hasta)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(SQL_IDS_PRODUCTOS)
+        ids = [int(r[0]) for r in cur.fetchall()]
+        cur.execute(SQL_VENTAS_DIARIAS, {'desde': desde, 'hasta': hasta})
+        ventas = pd.DataFrame.from_records(cur.fetchall(), columns=['id_producto', 'fecha_venta', 'cantidad'])
+    finally:
+        cur.close()
+    dias = (pd.Timestamp(hasta) - pd.Timestamp(desde)).days
+    return ids, matriz_diaria(ventas, ids, desde, dias)
+
+
+def guardar_pronostico(conn, ids, demanda, desviacion, sugerido, fecha, lote: int = 1000) -> int:
+    """Escribe el pronóstico en Pronosticos_Demanda por lotes (executemany) en una transacción."""
+    filas = list(zip(ids, repeat(fecha), np.round(demanda, 4).tolist(), np.round(desviacion, 4).tolist(),
+                     sugerido.tolist()))
+    cur = conn.cursor()
+    try:
+        for i in range(0, len(filas), lote):
+            cur.executemany(SQL_GUARDAR_PRONOSTICO, filas[i:i + lote])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(filas)
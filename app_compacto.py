@@ -1,5 +1,16 @@
 import os
 import time
+import hashlib
+import hmac
+import json
+import math
+import queue
+import random
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 try:
     import mariadb as mariadb_driver
@@ -10,13 +21,17 @@ except Exception:
     except Exception:
         mariadb_driver = None
 
-# Map common exception types for compatibility between mariadb and pymysql
+import sqlite_backend
+import analitica
+
+# Map common exception types for compatibility between mariadb, pymysql and sqlite3
+# (tuplas: `except DBError` captura los errores de cualquiera de los backends)
 if mariadb_driver is not None:
-    DBError = getattr(mariadb_driver, 'Error', Exception)
-    IntegrityError = getattr(mariadb_driver, 'IntegrityError', Exception)
+    DBError = (getattr(mariadb_driver, 'Error', Exception), sqlite_backend.Error)
+    IntegrityError = (getattr(mariadb_driver, 'IntegrityError', Exception), sqlite_backend.IntegrityError)
 else:
-    DBError = Exception
-    IntegrityError = Exception
+    DBError = (sqlite_backend.Error,)
+    IntegrityError = (sqlite_backend.IntegrityError,)
 
 try:
     from dotenv import load_dotenv
@@ -24,9 +39,14 @@ except Exception:
     # Si python-dotenv no está instalado, definimos un no-op y avisamos.
     def load_dotenv(*args, **kwargs):
         print("Aviso: python-dotenv no está instalado; se usarán variables de entorno del sistema.")
-from flask import Flask, jsonify, request
+try:
+    import msgpack
+except Exception:
+    # Formato binario opcional para reportes (?format=msgpack)
+    msgpack = None
+from flask import Flask, Response, jsonify, request, g, has_request_context, stream_with_context
 from flask_bcrypt import Bcrypt
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -36,11 +56,21 @@ load_dotenv()
 class DatabaseConnectionError(Exception):
     pass
 
-def create_connection(host: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None, database: Optional[str] = None, connect_timeout: int = 5):
+def db_backend() -> str:
+    """Motor configurado en DB_BACKEND: 'mariadb' (por defecto) o 'sqlite' (archivo local DB_SQLITE_PATH)."""
+    return os.getenv('DB_BACKEND', 'mariadb').strip().lower()
+
+def create_connection(host: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None, database: Optional[str] = None, connect_timeout: int = 5, port: Optional[int] = None):
     """
     Crea y retorna una conexión a la base de datos MariaDB.
     Lee de variables de entorno si los argumentos son None.
+    Con DB_BACKEND=sqlite abre el archivo DB_SQLITE_PATH (creando el esquema si está vacío).
     """
+    if db_backend() == 'sqlite':
+        try:
+            return sqlite_backend.connect(os.getenv('DB_SQLITE_PATH', 'inventario.sqlite3'), timeout=connect_timeout)
+        except (sqlite_backend.Error, OSError) as e:
+            raise DatabaseConnectionError(str(e))
     host = host or os.getenv('DB_HOST', '127.0.0.1')
     if host == 'localhost':
         host = '127.0.0.1'
@@ -52,23 +82,393 @@ def create_connection(host: Optional[str] = None, user: Optional[str] = None, pa
         if mariadb_driver is None:
             raise DatabaseConnectionError('No se encontró ningún driver de MariaDB/MySQL (mariadb o pymysql).')
         # mariadb and pymysql have slightly different APIs but both accept these common params
-        conn = mariadb_driver.connect(
+        params = dict(
             user=user,
             password=password,
             host=host,
             database=database,
             connect_timeout=connect_timeout
         )
+        if port:
+            params['port'] = port
+        conn = mariadb_driver.connect(**params)
         return conn
     except DBError as e:
         raise DatabaseConnectionError(str(e))
 
-def get_connection(retries: int = 1, delay: float = 0.5) -> Optional[object]:
-    """Obtiene una conexión, con reintentos simples."""
+class PoolExhaustedError(DatabaseConnectionError):
+    pass
+
+
+# --- Sentencias preparadas ---
+
+# Consultas frecuentes (lecturas por PK y la transacción de venta). Con el driver mariadb
+# se preparan con el protocolo binario una vez por conexión del pool y se reutilizan: el
+# servidor no vuelve a parsear ni planificar el SQL en cada petición.
+QUERY_REGISTRY = {
+    'producto_por_id': 'SELECT id_producto AS id, codigo, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor FROM Productos WHERE id_producto = %s',
+    # Lo que guardan los índices en memoria (existencias mínimas y códigos) de un producto
+    'producto_indices': 'SELECT nombre, stock, stock_minimo, codigo, precio_venta FROM Productos WHERE id_producto = %s',
+    'producto_bloquear_stock': 'SELECT stock, precio_compra, id_proveedor FROM Productos WHERE id_producto = %s FOR UPDATE',
+    'producto_descontar_stock': 'UPDATE Productos SET stock = stock - %s WHERE id_producto = %s',
+    # La fecha (clave de partición) se copia de la venta; si la venta no existe no se inserta nada.
+    # costo_unitario guarda el precio de compra vigente al vender (para calcular la ganancia real).
+    'detalle_venta_insertar': 'INSERT INTO Detalle_Ventas (id_venta, fecha_venta, id_producto, cantidad, precio_unitario, costo_unitario) '
+                              'SELECT id_venta, fecha_venta, %s, %s, %s, %s FROM Ventas WHERE id_venta = %s',
+    'producto_sumar_stock': 'UPDATE Productos SET stock = stock + %s WHERE id_producto = %s',
+    'detalle_compra_insertar': 'INSERT INTO Detalle_Compras (id_compra, id_producto, cantidad, precio_compra) '
+                               'SELECT id_compra, %s, %s, %s FROM Compras WHERE id_compra = %s',
+    # Kardex: una fila por cada cambio de stock, en la misma transacción que el cambio
+    'movimiento_insertar': 'INSERT INTO Movimientos_Stock (id_producto, fecha, tipo, cantidad, referencia) VALUES (%s, %s, %s, %s, %s)',
+    # Valoración: totales por proveedor (0 = sin proveedor) ajustados en la transacción del cambio
+    'valoracion_ajustar': 'UPDATE Valoracion_Inventario SET unidades = unidades + %s, valor = valor + %s WHERE id_proveedor = %s',
+    'valoracion_crear': 'INSERT IGNORE INTO Valoracion_Inventario (id_proveedor, unidades, valor) VALUES (%s, 0, 0)',
+    # Resumen de ventas por día, hora y producto para el tablero (misma transacción que la venta)
+    'venta_fecha': 'SELECT fecha_venta FROM Ventas WHERE id_venta = %s',
+    'ventas_hora_ajustar': 'UPDATE Ventas_Por_Hora SET unidades = unidades + %s, importe = importe + %s '
+                           'WHERE fecha = %s AND hora = %s AND id_producto = %s',
+    'ventas_hora_crear': 'INSERT IGNORE INTO Ventas_Por_Hora (fecha, hora, id_producto, unidades, importe) VALUES (%s, %s, %s, 0, 0)',
+    # Claves de las ventas completas (POST /ventas/completa): reenviar una venta nunca la duplica
+    'venta_clave_buscar': 'SELECT id_venta FROM Ventas_Claves WHERE clave = %s',
+    'venta_clave_registrar': 'INSERT INTO Ventas_Claves (clave, id_venta, creada) VALUES (%s, %s, %s)',
+    'cliente_por_id': 'SELECT id_cliente AS id, nombre, direccion, telefono, email FROM Clientes WHERE id_cliente = %s',
+    'proveedor_por_id': 'SELECT id_proveedor AS id, nombre, direccion, telefono, email FROM Proveedores WHERE id_proveedor = %s',
+}
+
+
+def supports_prepared() -> bool:
+    """True si el driver admite cursores preparados del lado del servidor (mariadb, no pymysql).
+
+    sqlite3 ya reutiliza sus sentencias compiladas por conexión, sin cursores aparte.
+    """
+    return getattr(mariadb_driver, '__name__', '') == 'mariadb' and db_backend() != 'sqlite'
+
+
+class StatementCursor:
+    """Cursor preparado que vive en la conexión del pool: close() no lo cierra para reutilizarlo."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._cursor, name)
+
+    def close(self):
+        pass
+
+
+def execute_registered(conn, name: str, params=()):
+    """Ejecuta la sentencia `name` de QUERY_REGISTRY y retorna el cursor con su resultado.
+
+    Si la conexión viene del pool y el driver lo permite se reutiliza su cursor preparado;
+    si no, se usa un cursor normal. En ambos casos el llamador cierra el cursor como siempre.
+    """
+    prepared = getattr(conn, 'prepared_cursor', None)
+    cur = prepared(name) if prepared is not None else None
+    if cur is None:
+        cur = conn.cursor()
+    cur.execute(QUERY_REGISTRY[name], params)
+    return cur
+
+
+class PooledConnection:
+    """Conexión prestada por el pool: close() la devuelve al pool en lugar de cerrarla.
+
+    El resto de atributos (cursor, commit, rollback...) se delegan en la conexión real.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._raw, name)
+
+    def prepared_cursor(self, name: str):
+        """Cursor preparado de la sentencia `name` para esta conexión (None si el driver no los admite)."""
+        return self._pool.prepared_cursor(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    def __del__(self):
+        # Red de seguridad para rutas que no cierran la conexión en caso de error
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Pool de conexiones acotado a `max_size`.
+
+    Al devolver una conexión se hace rollback para no reutilizar transacciones (ni
+    snapshots REPEATABLE READ) abiertas. Las conexiones ociosas más de `max_idle`
+    segundos se comprueban con ping antes de prestarlas.
+    """
+
+    def __init__(self, factory, max_size: int = 10, timeout: float = 5, max_idle: float = 30, prepared: Optional[bool] = None):
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.prepared = supports_prepared() if prepared is None else prepared
+        # id(conexión real) -> {nombre de sentencia: StatementCursor}
+        self._statements = {}
+        self._idle = []
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition(threading.RLock())
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    raw, last_used = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f'Pool de conexiones agotado ({self.max_size} en uso)')
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+        try:
+            if raw is not None and time.monotonic() - last_used > self.max_idle and not self._ping(raw):
+                self._discard(raw)
+                raw = None
+            if raw is None:
+                raw = self.factory()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        keep = True
+        try:
+            raw.rollback()
+        except Exception:
+            keep = False
+            self._discard(raw)
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'max': self.max_size, 'en_uso': self._in_use, 'libres': len(self._idle), 'esperando': self._waiting}
+
+    @staticmethod
+    def _ping(raw) -> bool:
+        try:
+            raw.ping()
+            return True
+        except Exception:
+            return False
+
+    def prepared_cursor(self, raw, name: str):
+        if not self.prepared:
+            return None
+        # Sólo el hilo que tiene prestada la conexión usa sus sentencias
+        with self._cond:
+            statements = self._statements.setdefault(id(raw), {})
+        cur = statements.get(name)
+        if cur is None:
+            cur = statements[name] = StatementCursor(raw.cursor(prepared=True))
+        return cur
+
+    def _discard(self, raw):
+        with self._cond:
+            self._statements.pop(id(raw), None)
+        self._close_quietly(raw)
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[ConnectionPool]:
+    """Pool global (DB_POOL_SIZE conexiones, 10 por defecto). DB_POOL_SIZE=0 lo desactiva."""
+    global _pool
+    size = int(os.getenv('DB_POOL_SIZE', 10))
+    if size <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(create_connection, max_size=size, timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)))
+        return _pool
+
+
+class ReplicaSet:
+    """Réplicas de lectura (DB_REPLICA_HOSTS), cada una con su propio pool.
+
+    El retraso de cada réplica (Seconds_Behind_Master) se comprueba como mucho cada
+    `check_interval` segundos, en el hilo que pide la conexión. Una réplica caída, con la
+    replicación detenida o con más de `max_lag` segundos de retraso no recibe lecturas.
+    """
+
+    def __init__(self, hosts, pool_factory, max_lag: float = 5, check_interval: float = 2):
+        self.hosts = list(hosts)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._pools = {h: pool_factory(h) for h in self.hosts}
+        self._state = {h: {'ok': False, 'lag': None, 'comprobado': 0.0, 'comprobando': False, 'error': None}
+                       for h in self.hosts}
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self) -> Optional[PooledConnection]:
+        """Conexión a una réplica disponible y al día (retraso <= max_lag); None si no hay."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.hosts)
+        for i in range(len(self.hosts)):
+            host = self.hosts[(start + i) % len(self.hosts)]
+            state = self._check(host)
+            if not state['ok']:
+                continue
+            try:
+                # Sin esperar: si el pool de la réplica está lleno se prueba la siguiente (o la primaria)
+                return self._pools[host].acquire(timeout=0)
+            except PoolExhaustedError:
+                continue
+            except DatabaseConnectionError as e:
+                self._mark_down(host, e)
+        return None
+
+    def status(self) -> list:
+        with self._lock:
+            return [{'host': h, 'ok': st['ok'], 'lag': st['lag'], 'error': st['error']} for h, st in self._state.items()]
+
+    def _check(self, host) -> dict:
+        now = time.time()
+        with self._lock:
+            state = self._state[host]
+            if state['comprobando'] or now - state['comprobado'] < self.check_interval:
+                return dict(state)
+            state['comprobando'] = True
+        conn = None
+        try:
+            conn = self._pools[host].acquire(timeout=1)
+            cur = conn.cursor()
+            cur.execute('SHOW SLAVE STATUS')
+            row = cur.fetchone()
+            columns = [d[0] for d in cur.description or []]
+            cur.close()
+            # Sin filas: el servidor no es una réplica clásica (p.ej. Galera), no hay retraso que medir
+            lag = row[columns.index('Seconds_Behind_Master')] if row is not None else 0
+            if lag is None:
+                raise DatabaseConnectionError('replicación detenida')
+            lag = float(lag)
+            with self._lock:
+                state.update(ok=lag <= self.max_lag, lag=lag, error=None, comprobado=now, comprobando=False)
+        except Exception as e:
+            self._mark_down(host, e)
+        finally:
+            if conn is not None:
+                conn.close()
+        with self._lock:
+            return dict(state)
+
+    def _mark_down(self, host, error):
+        with self._lock:
+            self._state[host].update(ok=False, error=str(error), comprobado=time.time(), comprobando=False)
+
+
+class RecentWriters:
+    """Clientes que escribieron hace menos de `window` segundos (lectura de sus propias escrituras)."""
+
+    def __init__(self, window: float = 5, max_entries: int = 10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, client):
+        with self._lock:
+            self._entries.pop(client, None)
+            self._entries[client] = time.monotonic() + self.window
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def contains(self, client) -> bool:
+        with self._lock:
+            expira = self._entries.get(client)
+            if expira is None:
+                return False
+            if expira <= time.monotonic():
+                del self._entries[client]
+                return False
+            return True
+
+
+_replicas = None
+
+
+def get_replicas() -> Optional[ReplicaSet]:
+    """Réplicas configuradas en DB_REPLICA_HOSTS ("host1,host2:3307"); None si no hay."""
+    global _replicas
+    if _replicas is not None:
+        return _replicas
+    hosts = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+    if not hosts:
+        return None
+    with _pool_lock:
+        if _replicas is None:
+            size = max(1, int(os.getenv('DB_REPLICA_POOL_SIZE', os.getenv('DB_POOL_SIZE', 10))))
+            timeout = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+            def pool_factory(address):
+                host, _, port = address.partition(':')
+                return ConnectionPool(lambda: create_connection(host=host, port=int(port) if port else None), max_size=size, timeout=timeout)
+
+            _replicas = ReplicaSet(hosts, pool_factory, max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+                                   check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2)))
+        return _replicas
+
+
+def get_connection(retries: int = 1, delay: float = 0.5, read_only: bool = False) -> Optional[object]:
+    """Obtiene una conexión (del pool si está activo), con reintentos simples.
+
+    Con read_only=True se usa una réplica si hay alguna disponible; si no, la primaria.
+    """
+    if read_only:
+        replicas = get_replicas()
+        conn = replicas.acquire() if replicas is not None else None
+        if conn is not None:
+            return conn
     last_exc = None
     for attempt in range(1, max(1, retries) + 1):
         try:
-            return create_connection()
+            pool = get_pool()
+            return pool.acquire() if pool is not None else create_connection()
         except DatabaseConnectionError as e:
             last_exc = e
             if attempt < retries:
@@ -76,11 +476,1038 @@ def get_connection(retries: int = 1, delay: float = 0.5) -> Optional[object]:
                 time.sleep(delay)
     raise DatabaseConnectionError(f"No se pudo conectar a la base de datos después de {retries} intentos: {last_exc}")
 
+
+def check_readiness(timeout: float = 1.0) -> dict:
+    """Comprueba que se puede obtener una conexión y ejecutar una consulta.
+
+    Retorna un dict con status ('ready' o 'unavailable'), latencia de la consulta y el
+    estado del pool. Lo usan /ready y launcher.py.
+    """
+    pool = get_pool()
+    info = {'status': 'ready', 'db': 'ok'}
+    start = time.perf_counter()
+    conn = None
+    try:
+        conn = pool.acquire(timeout=timeout) if pool is not None else create_connection(connect_timeout=max(1, int(timeout)))
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        cur.close()
+    except Exception as e:
+        info.update(status='unavailable', db='error', error=str(e))
+    finally:
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    info['db_latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    if pool is not None:
+        stats = pool.stats()
+        stats['saturado'] = stats['esperando'] > 0 or (stats['en_uso'] >= stats['max'] and not stats['libres'])
+        info['pool'] = stats
+    replicas = get_replicas()
+    if replicas is not None:
+        # Informativo: sin réplicas las lecturas van a la primaria, la API sigue lista
+        info['replicas'] = replicas.status()
+    return info
+
+
+def serve(app, host: str = '127.0.0.1', port: int = 5000, on_listening=None):
+    """Sirve la app con el servidor de werkzeug (multihilo, sin reloader).
+
+    El socket queda escuchando antes de llamar a `on_listening`, así quien arranca la API
+    puede recibir la señal de listo sin sondear.
+    """
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    if on_listening is not None:
+        on_listening()
+    server.serve_forever()
+
+# --- Idempotencia ---
+
+class IdempotencyStore:
+    """Caché en memoria (con TTL) de las respuestas a POST con cabecera Idempotency-Key.
+
+    La primera petición con una clave se ejecuta y su respuesta queda guardada; los
+    reintentos con la misma clave reciben la respuesta guardada sin volver a tocar la
+    base de datos. Mientras la primera petición sigue en curso, los duplicados reciben
+    un 409 para que el cliente reintente más tarde.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # clave -> dict(expira, huella, respuesta); respuesta es None mientras está en curso
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        for key in [k for k, e in self._entries.items() if e['expira'] <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def begin(self, key: str, fingerprint: str):
+        """Registra el inicio de una petición.
+
+        Retorna (estado, respuesta) donde estado es 'nuevo', 'repetido', 'en_curso' o
+        'distinto' (misma clave con otro cuerpo).
+        """
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'expira': now + self.ttl, 'huella': fingerprint, 'respuesta': None}
+                return 'nuevo', None
+            if entry['huella'] != fingerprint:
+                return 'distinto', None
+            if entry['respuesta'] is None:
+                return 'en_curso', None
+            return 'repetido', entry['respuesta']
+
+    def complete(self, key: str, status: int, body: bytes, mimetype: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['respuesta'] = (status, body, mimetype)
+
+    def release(self, key: str):
+        """Olvida una clave en curso (p.ej. si la petición falló con 5xx) para permitir reintentos."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['respuesta'] is None:
+                del self._entries[key]
+
+# --- Limitación de tráfico y descarte de carga ---
+
+class RateLimiter:
+    """Buckets de tokens por clave (cliente, cliente+ruta, ...).
+
+    Cada clave acumula hasta `burst` tokens a razón de `rate` por segundo; cada petición
+    consume uno. Las claves inactivas más antiguas se descartan por encima de `max_keys`.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        # clave -> [tokens, última actualización]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key) -> float:
+        """Consume un token. Retorna 0 si se permite o los segundos hasta que haya uno disponible."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate if self.rate > 0 else 60.0
+
+
+def make_rate_limiter(env_name: str, default: tuple) -> Optional[RateLimiter]:
+    """RateLimiter configurado con la variable `env_name` ("tasa,ráfaga"); "0" lo desactiva."""
+    value = os.getenv(env_name)
+    if value is None:
+        rate, burst = default
+    else:
+        parts = [float(v) for v in value.split(',')]
+        rate, burst = parts[0], (parts[1] if len(parts) > 1 else parts[0])
+    if rate <= 0:
+        return None
+    return RateLimiter(rate, burst)
+
+
+class ConcurrencyLimiter:
+    """Número máximo de peticiones simultáneas; las que exceden el límite se rechazan sin esperar."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_use >= self.limit:
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+# --- Perfilado de peticiones (opt-in) ---
+
+def collapsed_stacks(stats, max_depth: int = 64, min_share: float = 0.001) -> list:
+    """Pilas colapsadas ("a;b;c microsegundos", formato de flamegraph.pl/speedscope) de un pstats.Stats.
+
+    cProfile guarda el grafo llamador -> llamado, no pilas completas: el tiempo de cada
+    función se reparte entre sus llamadores en proporción al tiempo acumulado de cada
+    arista. Las recursiones se cortan en la primera repetición y las ramas por debajo de
+    `min_share` del total se descartan.
+    """
+    entries = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [(func, entry[3]) for func, entry in entries.items() if not entry[4]]
+    min_time = sum(ct for _, ct in roots) * min_share
+
+    def label(func):
+        filename, line, name = func
+        return name if filename == '~' else f"{name} ({os.path.basename(filename)}:{line})"
+
+    totals = {}
+
+    def walk(func, ct, path, seen):
+        _, _, tt, total_ct, _ = entries[func]
+        share = ct / total_ct if total_ct else 0.0
+        path = f"{path};{label(func)}" if path else label(func)
+        own = tt * share
+        children = callees.get(func, ()) if len(seen) < max_depth else ()
+        for child, edge_ct in children:
+            if child in seen:
+                continue
+            if edge_ct * share < min_time:
+                # Lo que no se desglosa cuenta como tiempo propio del llamador
+                own += edge_ct * share
+                continue
+            walk(child, edge_ct * share, path, seen | {child})
+        if own > 0:
+            totals[path] = totals.get(path, 0.0) + own
+
+    for func, ct in roots:
+        if ct >= min_time:
+            walk(func, ct, '', {func})
+    return [f"{path} {round(t * 1e6)}" for path, t in sorted(totals.items()) if round(t * 1e6) > 0]
+
+
+class RequestProfiler:
+    """Middleware WSGI que ejecuta peticiones bajo cProfile y guarda el resultado en `directory`.
+
+    Se perfila una petición si trae la cabecera X-Profile (o ?profile=) con el token de
+    administrador, o al azar con probabilidad `sample_rate`. Por cada una se escriben
+    <id>.prof (pstats, snakeviz...) y <id>.folded (pilas colapsadas para un flame graph), y la
+    respuesta lleva el id en X-Profile-Id. Se conservan los últimos `keep` perfiles.
+
+    Sólo se perfila una petición a la vez: cProfile no admite dos perfiles activos y así el
+    coste queda acotado; si hay otra en curso, la nueva se atiende sin perfilar. En las
+    respuestas en streaming (exportaciones, SSE) se mide hasta que empieza el envío.
+    """
+
+    def __init__(self, wsgi_app, directory: str, token: Optional[str] = None, sample_rate: float = 0.0, keep: int = 200):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def wants_profile(self, environ) -> bool:
+        if self.token:
+            from urllib.parse import parse_qs
+            supplied = environ.get('HTTP_X_PROFILE') or parse_qs(environ.get('QUERY_STRING', '')).get('profile', [''])[0]
+            if supplied and hmac.compare_digest(supplied.encode(), self.token.encode()):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self.wants_profile(environ) or not self._lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        import cProfile
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        def start_with_id(status, headers, exc_info=None):
+            headers.append(('X-Profile-Id', profile_id))
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                return self.wsgi_app(environ, start_with_id)
+            finally:
+                profiler.disable()
+                self.save(profile_id, profiler, environ)
+        finally:
+            self._lock.release()
+
+    def save(self, profile_id: str, profiler, environ):
+        import pstats
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, profile_id)
+            profiler.dump_stats(base + '.prof')
+            with open(base + '.folded', 'w', encoding='utf-8') as fh:
+                fh.write(f"# {environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}\n")
+                fh.writelines(line + '\n' for line in collapsed_stacks(pstats.Stats(profiler)))
+            self.prune()
+        except Exception as e:
+            # Un fallo al guardar el perfil nunca debe romper la petición
+            print(f"Aviso: no se pudo guardar el perfil {profile_id}: {e}")
+
+    def prune(self):
+        perfiles = sorted(f for f in os.listdir(self.directory) if f.endswith('.prof'))
+        for nombre in perfiles[:max(0, len(perfiles) - self.keep)]:
+            for ext in ('.prof', '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, nombre[:-5] + ext))
+                except OSError:
+                    pass
+
+
+def make_request_profiler(wsgi_app) -> Optional[RequestProfiler]:
+    """RequestProfiler según PROFILE_TOKEN / PROFILE_SAMPLE_RATE; None (sin envolver la app) si ninguno está activo."""
+    token = os.getenv('PROFILE_TOKEN') or None
+    sample_rate = min(max(float(os.getenv('PROFILE_SAMPLE_RATE', 0)), 0.0), 1.0)
+    if token is None and sample_rate == 0:
+        return None
+    return RequestProfiler(wsgi_app, os.getenv('PROFILE_DIR', 'perfiles'), token=token,
+                           sample_rate=sample_rate, keep=int(os.getenv('PROFILE_KEEP', 200)))
+
+# --- Índice de existencias mínimas ---
+
+class LowStockIndex:
+    """Conjunto mantenido en memoria de productos con stock <= stock_minimo.
+
+    Se carga una vez con un recorrido de Productos y después se actualiza producto a
+    producto en cada escritura que cambia stock o stock_minimo. Los cambios se publican
+    a los suscriptores (Server-Sent Events) como eventos 'alerta' (el producto entra o
+    sigue bajo mínimo) y 'normalizado' (el producto sale del conjunto).
+
+    Una recarga empieza con `begin_load()`: las actualizaciones que llegan mientras se leen
+    las filas se anotan y `load()` las vuelve a aplicar sobre ellas, así una escritura
+    confirmada durante la recarga nunca queda pisada por una fila leída antes.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # Productos actualizados durante la carga en curso (None: no hay carga en curso)
+        self._touched = None
+        # invalidate() durante una carga: su resultado no deja el índice como cargado
+        self._stale = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def active(self) -> bool:
+        """True si hay que aplicar las actualizaciones (índice cargado o carga en curso)."""
+        return self._loaded or self._touched is not None
+
+    def begin_load(self):
+        with self._lock:
+            self._touched = set()
+            self._stale = False
+
+    def abort_load(self):
+        with self._lock:
+            self._touched = None
+
+    def load(self, rows):
+        """Carga completa a partir de filas (id, nombre, stock, stock_minimo).
+
+        Los productos actualizados desde `begin_load()` conservan el estado de esa
+        actualización. Las diferencias con el contenido anterior (p. ej. tras cambiar en
+        bloque los mínimos) se publican como 'alerta' / 'normalizado'.
+        """
+        items = {
+            int(r[0]): {'id': int(r[0]), 'nombre': r[1], 'stock': int(r[2]), 'stock_minimo': int(r[3])}
+            for r in rows if int(r[2]) <= int(r[3])
+        }
+        with self._lock:
+            for producto_id in self._touched or ():
+                if producto_id in self._items:
+                    items[producto_id] = self._items[producto_id]
+                else:
+                    items.pop(producto_id, None)
+            previous, self._items = self._items, items
+            self._touched = None
+            self._loaded = not self._stale
+            for producto_id, item in items.items():
+                if previous.get(producto_id) != item:
+                    self._publish('alerta', item)
+            for producto_id, item in previous.items():
+                if producto_id not in items:
+                    self._publish('normalizado', item)
+
+    def invalidate(self):
+        """Fuerza una recarga completa en el siguiente acceso."""
+        with self._lock:
+            self._loaded = False
+            self._stale = self._touched is not None
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [dict(self._items[k]) for k in sorted(self._items)]
+
+    def update(self, producto_id: int, nombre, stock: int, stock_minimo: int):
+        item = {'id': producto_id, 'nombre': nombre, 'stock': stock, 'stock_minimo': stock_minimo}
+        with self._lock:
+            if self._touched is not None:
+                self._touched.add(producto_id)
+            previous = self._items.get(producto_id)
+            if stock <= stock_minimo:
+                self._items[producto_id] = item
+                if previous != item:
+                    self._publish('alerta', item)
+            elif previous is not None:
+                del self._items[producto_id]
+                self._publish('normalizado', item)
+
+    def remove(self, producto_id: int):
+        with self._lock:
+            if self._touched is not None:
+                self._touched.add(producto_id)
+            previous = self._items.pop(producto_id, None)
+            if previous is not None:
+                self._publish('normalizado', previous)
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _publish(self, event: str, data: dict):
+        # Se llama con el lock tomado
+        for q in self._subscribers:
+            try:
+                q.put_nowait((event, dict(data)))
+            except queue.Full:
+                # Cliente lento: se descarta el evento; al reconectar recibe un snapshot completo
+                pass
+
+
+class ProductCodeIndex:
+    """Mapa en memoria codigo -> producto para el punto de venta (GET /productos/by-code/<codigo>).
+
+    Se carga una vez con un recorrido de los productos con código y después se actualiza
+    producto a producto tras cada escritura que lo modifica (alta, edición, venta, baja),
+    igual que LowStockIndex. Guarda sólo lo que necesita la caja: id, nombre, precio y stock.
+    """
+
+    def __init__(self):
+        self._by_code = {}
+        self._code_of = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, rows):
+        """Carga completa a partir de filas (id, codigo, nombre, precio_venta, stock)."""
+        with self._lock:
+            self._by_code, self._code_of = {}, {}
+            for r in rows:
+                self._put(int(r[0]), r[1], r[2], r[3], r[4])
+            self._loaded = True
+
+    def invalidate(self):
+        """Fuerza una recarga completa en el siguiente acceso."""
+        with self._lock:
+            self._loaded = False
+
+    def get(self, codigo):
+        with self._lock:
+            item = self._by_code.get(str(codigo).strip())
+            return dict(item) if item is not None else None
+
+    def update(self, producto_id: int, codigo, nombre, precio_venta, stock):
+        with self._lock:
+            self._put(producto_id, codigo, nombre, precio_venta, stock)
+
+    def remove(self, producto_id: int):
+        with self._lock:
+            self._put(producto_id, None, None, None, None)
+
+    def _put(self, producto_id, codigo, nombre, precio_venta, stock):
+        # Se llama con el lock tomado; un cambio de código retira la entrada anterior
+        previous = self._code_of.pop(producto_id, None)
+        if previous is not None:
+            self._by_code.pop(previous, None)
+        codigo = str(codigo).strip() if codigo is not None else ''
+        if not codigo:
+            return
+        self._code_of[producto_id] = codigo
+        self._by_code[codigo] = {'id': producto_id, 'codigo': codigo, 'nombre': nombre,
+                                 'precio_venta': float(precio_venta or 0), 'stock': int(stock or 0)}
+
+
+def sse_message(event: str, data) -> str:
+    """Formatea un mensaje Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# --- Versión de datos y jobs de reportes ---
+
+# Versión de los datos en la base: una sola fila que incrementan la API (en cada escritura) y los
+# procesos que escriben directamente (mantenimiento.py). Se replica como cualquier otra tabla.
+SQL_VERSION_DATOS = 'SELECT version FROM Version_Datos WHERE id = 1'
+
+
+def bump_db_version(conn):
+    """Incrementa Version_Datos (sin commit): las APIs en marcha descartan sus reportes cacheados y sus ETag."""
+    cur = conn.cursor()
+    cur.execute('UPDATE Version_Datos SET version = version + 1 WHERE id = 1')
+    if not getattr(cur, 'rowcount', 0):
+        cur.execute('INSERT IGNORE INTO Version_Datos (id, version) VALUES (1, 0)')
+        cur.execute('UPDATE Version_Datos SET version = version + 1 WHERE id = 1')
+    cur.close()
+
+
+class DataVersion:
+    """Versión de los datos para las cachés de resultados y los ETag.
+
+    Cada lectura cacheable lee Version_Datos en la misma conexión (réplica o primaria) que
+    después lee los datos, y la combina con un contador local que se incrementa en cada
+    escritura confirmada por esta API. Un resultado guardado con una versión incluye todos
+    los cambios hasta esa versión: una réplica atrasada produce una versión anterior, nunca
+    un resultado viejo con la versión nueva.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+        # Identifica el proceso: tras un reinicio el contador vuelve a 0 y no debe confundirse
+        self.epoch = uuid.uuid4().hex[:12]
+        self._warned = False
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def etag(self, resource: str, version: tuple) -> str:
+        return f'{resource}-{self.epoch}-{version[0]}-{version[1]}'
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value += 1
+            return self._value
+
+    def read(self, conn) -> Optional[tuple]:
+        """(Version_Datos, contador local) leída en `conn`; None si la tabla no se puede leer (no se cachea)."""
+        local = self._value
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(SQL_VERSION_DATOS)
+            row = cur.fetchone()
+            return (int(row[0]) if row else 0, local)
+        except Exception as e:
+            self.warn(e)
+            return None
+        finally:
+            if cur is not None:
+                cur.close()
+
+    def warn(self, error):
+        """Avisa una sola vez de que Version_Datos no está disponible."""
+        if not self._warned:
+            self._warned = True
+            print(f"Aviso: Version_Datos no disponible (¿falta migrate_version_datos.sql?): {error}")
+
+
+class BorrowedConnection:
+    """Conexión prestada: delega en la original salvo close(), que no hace nada.
+
+    La devuelve read_connection() mientras el hilo tiene fijada una conexión de lectura,
+    así las consultas existentes (que cierran su conexión al terminar) reutilizan la misma.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        pass
+
+
+class TTLCache:
+    """Caché en memoria de resultados con vencimiento corto (segundos) y un solo cálculo por clave.
+
+    Si varias peticiones piden a la vez una clave vencida, sólo una la calcula y las demás
+    esperan su resultado: varias pantallas consultando el mismo tablero cada pocos segundos
+    hacen una consulta por período de TTL, no una por pantalla.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # clave -> (vence, valor)
+        self._computing = {}            # clave -> Lock del cálculo en curso
+        self._lock = threading.Lock()
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry
+        return None
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry[1]
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # Otro hilo pudo calcularlo mientras se esperaba
+                entry = self._fresh(key)
+                if entry is not None:
+                    return entry[1]
+            try:
+                value = compute()
+                with self._lock:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                return value
+            finally:
+                with self._lock:
+                    self._computing.pop(key, None)
+
+
+class ReportJobQueue:
+    """Cola de reportes ejecutados por un pool de hilos, con caché LRU de resultados.
+
+    La caché se indexa por (reporte, desde, hasta, versión de datos). `read_scope()` es un
+    context manager que fija la conexión de lectura del hilo y devuelve la versión de los
+    datos que verá el reporte (None: no se cachea). Dos peticiones idénticas mientras la
+    primera sigue esperando un hilo libre comparten el mismo job.
+    """
+
+    def __init__(self, runner, workers: int = 2, cache_size: int = 64, job_ttl: float = 3600, read_scope=None):
+        self.runner = runner
+        self.read_scope = read_scope or (lambda: nullcontext(None))
+        self.cache_size = cache_size
+        self.job_ttl = job_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='reportes')
+        self._cache = OrderedDict()
+        self._jobs = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, self._cache[key]
+        return False, None
+
+    def _cache_put(self, key, result):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def run_cached(self, nombre, desde, hasta):
+        """Ejecuta el reporte en el hilo actual salvo que ya esté en caché para la versión leída."""
+        with self.read_scope() as version:
+            if version is None:
+                return self.runner(nombre, desde, hasta)
+            key = (nombre, desde, hasta, version)
+            hit, result = self._cache_get(key)
+            if hit:
+                return result
+            result = self.runner(nombre, desde, hasta)
+            self._cache_put(key, result)
+            return result
+
+    def submit(self, nombre, desde, hasta) -> dict:
+        # El job vuelve a leer la versión al empezar; hasta entonces, las peticiones iguales lo comparten
+        key = (nombre, desde, hasta)
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            pending_id = self._pending.get(key)
+            if pending_id in self._jobs:
+                return self._public(self._jobs[pending_id])
+        job = {'id': uuid.uuid4().hex, 'reporte': nombre, 'desde': desde, 'hasta': hasta,
+               'estado': 'pendiente', 'resultado': None, 'error': None,
+               'creado': now, 'terminado': None, 'evento': threading.Event()}
+        with self.read_scope() as version:
+            hit, result = self._cache_get(key + (version,)) if version is not None else (False, None)
+        if hit:
+            job.update(estado='completado', resultado=result, terminado=now)
+            job['evento'].set()
+        with self._lock:
+            self._jobs[job['id']] = job
+            if not hit:
+                self._pending[key] = job['id']
+        if not hit:
+            self._executor.submit(self._run, job, key)
+        return self._public(job)
+
+    def _run(self, job, key):
+        with self._lock:
+            if self._pending.get(key) == job['id']:
+                del self._pending[key]
+        job['estado'] = 'en_proceso'
+        try:
+            result = self.run_cached(job['reporte'], job['desde'], job['hasta'])
+            job.update(estado='completado', resultado=result)
+        except Exception as e:
+            job.update(estado='error', error=str(e))
+        finally:
+            job['terminado'] = time.time()
+            job['evento'].set()
+
+    def get(self, job_id, wait: float = 0):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait:
+            job['evento'].wait(wait)
+        return self._public(job)
+
+    def _purge(self, now):
+        # Se llama con el lock tomado
+        for job_id in [j for j, job in self._jobs.items() if job['terminado'] and now - job['terminado'] > self.job_ttl]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public(job) -> dict:
+        return {k: v for k, v in job.items() if k != 'evento'}
+
+# --- Exportación de reportes (CSV / XLSX) ---
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def has_openpyxl() -> bool:
+    try:
+        import openpyxl  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def create_streaming_cursor(conn):
+    """Cursor sin buffer: las filas se leen del servidor a medida que se consumen.
+
+    Si el driver no lo soporta se usa un cursor normal.
+    """
+    driver = 'sqlite' if db_backend() == 'sqlite' else getattr(mariadb_driver, '__name__', '')
+    try:
+        if driver == 'pymysql':
+            return conn.cursor(mariadb_driver.cursors.SSCursor)
+        if driver == 'mariadb':
+            return conn.cursor(buffered=False)
+    except Exception:
+        pass
+    return conn.cursor()
+
+
+def iter_cursor(cur, size: int = 500):
+    """Itera las filas de un cursor en bloques de `size` con fetchmany."""
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def iter_csv(columns, rows, flush_every: int = 500):
+    """Genera un CSV por trozos a partir de un iterable de filas."""
+    import csv
+    import io
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % flush_every == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_xlsx(sheet_name, columns, rows, chunk_size: int = 64 * 1024):
+    """Genera un XLSX con el modo write-only de openpyxl (las filas van a disco, no a memoria).
+
+    Los valores conservan su tipo (números, fechas) en lugar de exportarse como texto.
+    """
+    import tempfile
+    from decimal import Decimal
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name[:31])
+    ws.append(list(columns))
+    for row in rows:
+        ws.append([float(v) if isinstance(v, Decimal) else v for v in row])
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+# --- Formatos de respuesta de reportes (json / columnar / msgpack) ---
+
+PAYLOAD_FORMATS = ('json', 'columnar', 'msgpack')
+
+
+def table_to_records(table: dict) -> list:
+    """Convierte {'columns': [...], 'rows': [...]} en la lista de objetos (un dict por fila)."""
+    cols = table['columns']
+    return [dict(zip(cols, row)) for row in table['rows']]
+
+
+def _msgpack_default(obj):
+    from decimal import Decimal
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"No serializable: {type(obj)!r}")
+
+
+def pack_msgpack(payload) -> bytes:
+    return msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+
 # --- Parte de la Aplicación (API) ---
 
 def create_app():
     app = Flask(__name__)
     bcrypt = Bcrypt(app)
+    idempotency = IdempotencyStore(ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)))
+    low_stock = LowStockIndex()
+    product_codes = ProductCodeIndex()
+    data_version = DataVersion()
+    recent_writers = RecentWriters(window=float(os.getenv('DB_READ_YOUR_WRITES', 5)))
+
+    # --- Límites de tráfico: se evalúan antes que cualquier otro hook y antes de abrir conexiones ---
+    client_limiter = make_rate_limiter('RATE_LIMIT_CLIENT', (50, 100))
+    route_limiter = make_rate_limiter('RATE_LIMIT_ROUTE', (20, 40))
+    report_limiter = make_rate_limiter('RATE_LIMIT_REPORTES', (2, 5))
+    report_slots = ConcurrencyLimiter(int(os.getenv('REPORT_MAX_CONCURRENT', 4)))
+    unlimited_endpoints = {'health', 'ready', 'reporte_existencias_minimas_stream'}
+    # Reportes síncronos (y exportaciones): cada uno ocupa una conexión mientras se calcula.
+    # existencias_minimas no está: se sirve del índice en memoria (LowStockIndex)
+    report_endpoints = {'reporte_compras', 'reporte_ventas', 'reporte_ganancias', 'reporte_kardex',
+                        'reporte_analitica', 'reporte_existencias', 'reporte_pronostico', 'reporte_valoracion'}
+
+    def overloaded(status, mensaje, retry_after):
+        resp = jsonify({'error': mensaje})
+        resp.status_code = status
+        resp.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return resp
+
+    @app.before_request
+    def rate_limit():
+        if request.url_rule is None or request.endpoint in unlimited_endpoints:
+            return None
+        client = request.remote_addr or 'desconocido'
+        checks = [(client_limiter, client), (route_limiter, (client, request.method, request.url_rule.rule))]
+        if request.endpoint in report_endpoints or request.endpoint == 'reporte_job_create':
+            checks.append((report_limiter, client))
+        for limiter, key in checks:
+            wait = limiter.take(key) if limiter is not None else 0
+            if wait:
+                return overloaded(429, 'Demasiadas peticiones, reintente más tarde', wait)
+        return None
+
+    @app.before_request
+    def shed_load():
+        if request.url_rule is None or request.endpoint in unlimited_endpoints:
+            return None
+        # Si ya hay tantas peticiones esperando conexión como conexiones tiene el pool, una más
+        # sólo esperaría hasta DB_POOL_TIMEOUT: mejor rechazarla ya
+        pool = get_pool()
+        if pool is not None and pool.stats()['esperando'] >= pool.max_size:
+            return overloaded(503, 'Servidor saturado, reintente en unos segundos', 1)
+        if request.endpoint in report_endpoints:
+            if not report_slots.try_acquire():
+                return overloaded(503, 'Demasiados reportes en curso, reintente en unos segundos', 2)
+            g.report_slot = True
+        return None
+
+    @app.teardown_request
+    def release_report_slot(exc):
+        # En exportaciones el contexto sigue activo hasta terminar de enviar el archivo
+        if g.pop('report_slot', False):
+            report_slots.release()
+
+    # Listados que admiten revalidación con If-None-Match (caché local de la GUI)
+    etag_resources = {'/productos': 'productos', '/clientes': 'clientes', '/proveedores': 'proveedores'}
+
+    @app.before_request
+    def list_etag_check():
+        resource = etag_resources.get(request.path)
+        if request.method != 'GET' or resource is None or request.args:
+            return None
+        # El ETag se calcula antes de consultar, con la versión del servidor que servirá el listado
+        # (la conexión queda fijada hasta el final de la petición): si una escritura llega entre
+        # medias, el cliente recibe datos más nuevos que su ETag y simplemente volverá a descargarlos.
+        version = pin_read()
+        if version is None:
+            return None
+        g.list_etag = data_version.etag(resource, version)
+        if request.if_none_match.contains(g.list_etag):
+            resp = app.response_class(status=304)
+            resp.set_etag(g.list_etag)
+            return resp
+        return None
+
+    @app.after_request
+    def list_etag_header(response):
+        etag = g.pop('list_etag', None)
+        if etag and response.status_code == 200:
+            response.set_etag(etag)
+        return response
+
+    @app.after_request
+    def bump_data_version(response):
+        # Cualquier escritura exitosa invalida los resultados cacheados calculados antes
+        if request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400 \
+                and not request.path.startswith(('/reportes', '/login')) and request.endpoint != 'batch_get':
+            data_version.bump()
+            recent_writers.mark(request.remote_addr)
+            publish_db_version()
+        return response
+
+    def publish_db_version():
+        # Llega a las réplicas detrás de los cambios que la preceden: allí la versión nunca se adelanta a los datos
+        conn = None
+        try:
+            conn = get_connection()
+            bump_db_version(conn)
+            conn.commit()
+        except Exception as e:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            data_version.warn(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    read_pin = threading.local()
+
+    def read_connection():
+        """Conexión para listados y reportes: una réplica si hay alguna al día, si no la primaria.
+
+        Durante DB_READ_YOUR_WRITES segundos, el cliente que acaba de escribir lee de la primaria.
+        Si el hilo tiene fijada una conexión de lectura (pin_read) se devuelve esa.
+        """
+        pinned = getattr(read_pin, 'conn', None)
+        if pinned is not None:
+            return BorrowedConnection(pinned)
+        if has_request_context() and recent_writers.contains(request.remote_addr):
+            return get_connection()
+        return get_connection(read_only=True)
+
+    def pin_read():
+        """Fija la conexión de lectura del hilo y devuelve la versión de datos de ese servidor.
+
+        Así la versión que entra en la clave de caché o en el ETag y los datos salen del mismo
+        servidor. Devuelve None si no se pudo fijar o leer la versión (entonces no se cachea).
+        """
+        if getattr(read_pin, 'conn', None) is not None:
+            return data_version.read(read_pin.conn)
+        try:
+            conn = read_connection()
+        except Exception:
+            return None
+        read_pin.conn = conn
+        return data_version.read(conn)
+
+    def unpin_read():
+        conn, read_pin.conn = getattr(read_pin, 'conn', None), None
+        if conn is not None:
+            conn.close()
+
+    @contextmanager
+    def pinned_read():
+        """pin_read() durante el bloque; si el hilo ya tenía una conexión fijada la conserva."""
+        if getattr(read_pin, 'conn', None) is not None:
+            yield data_version.read(read_pin.conn)
+            return
+        try:
+            yield pin_read()
+        finally:
+            unpin_read()
+
+    @app.teardown_request
+    def release_read_pin(exc):
+        unpin_read()
+
+    # --- Idempotency-Key en los endpoints de creación (POST) ---
+    @app.before_request
+    def idempotency_begin():
+        key = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or not key:
+            return None
+        scope = f"{request.path}:{key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        estado, respuesta = idempotency.begin(scope, fingerprint)
+        if estado == 'repetido':
+            status, body, mimetype = respuesta
+            resp = app.response_class(body, status=status, mimetype=mimetype)
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        if estado == 'en_curso':
+            return jsonify({'error': 'Hay una petición en curso con la misma Idempotency-Key'}), 409
+        if estado == 'distinto':
+            return jsonify({'error': 'Idempotency-Key reutilizada con un cuerpo distinto'}), 422
+        g.idempotency_scope = scope
+        return None
+
+    @app.after_request
+    def idempotency_complete(response):
+        scope = g.pop('idempotency_scope', None)
+        if scope:
+            # Los 5xx no se guardan: el cliente puede reintentar y la petición se ejecuta de nuevo
+            if response.status_code < 500:
+                idempotency.complete(scope, response.status_code, response.get_data(), response.mimetype)
+            else:
+                idempotency.release(scope)
+        return response
+
+    @app.teardown_request
+    def idempotency_teardown(exc):
+        scope = g.pop('idempotency_scope', None)
+        if scope:
+            idempotency.release(scope)
 
     def row_to_dict(cur, row):
         """Convertir una fila (tuple) a dict usando cur.description como claves."""
@@ -89,6 +1516,10 @@ def create_app():
         cols = [d[0] for d in getattr(cur, 'description', [])]
         return {cols[i]: row[i] for i in range(min(len(cols), len(row)))}
 
+    def rows_to_table(cur, rows):
+        """Resultado columnar: los nombres de columna una sola vez y las filas como listas."""
+        return {'columns': [d[0] for d in getattr(cur, 'description', [])], 'rows': [list(r) for r in rows]}
+
     def normalize_product(prod: dict) -> dict:
         """Asegura tipos consistentes para los campos de Productos.
 
@@ -147,14 +1578,211 @@ def create_app():
             pass
         return None
 
+    low_stock_loading = threading.Lock()
+
+    def ensure_low_stock_loaded(force=False):
+        """Carga el índice de existencias mínimas si aún no se ha cargado (o siempre, con force)."""
+        if low_stock.loaded and not force:
+            return
+        # Una sola carga a la vez; las peticiones que esperaban la encuentran hecha
+        with low_stock_loading:
+            if low_stock.loaded and not force:
+                return
+            low_stock.begin_load()
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute('SELECT id_producto, nombre, stock, stock_minimo FROM Productos WHERE stock <= stock_minimo')
+                low_stock.load(cur.fetchall())
+            except Exception:
+                low_stock.abort_load()
+                raise
+            finally:
+                cur.close()
+                conn.close()
+
+    def ensure_codes_loaded():
+        """Carga el mapa de códigos de producto si aún no se ha cargado."""
+        if product_codes.loaded:
+            return
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT id_producto, codigo, nombre, precio_venta, stock FROM Productos WHERE codigo IS NOT NULL')
+            product_codes.load(cur.fetchall())
+        finally:
+            cur.close()
+            conn.close()
+
+    def refresh_product_indexes(conn, producto_id):
+        """Relee un producto por su PK y actualiza los índices en memoria (existencias mínimas y códigos).
+
+        Se llama tras el commit de cualquier escritura que cambie el producto.
+        Si falla, los índices se invalidan y se recargan completos en el siguiente acceso.
+        """
+        if not low_stock.active and not product_codes.loaded:
+            return
+        try:
+            cur = execute_registered(conn, 'producto_indices', (producto_id,))
+            row = cur.fetchone()
+            cur.close()
+            if row is None:
+                low_stock.remove(producto_id)
+                product_codes.remove(producto_id)
+            else:
+                # También durante una recarga: load() aplica después lo que llegue mientras tanto
+                if low_stock.active:
+                    low_stock.update(producto_id, row[0], int(row[1]), int(row[2]))
+                if product_codes.loaded:
+                    product_codes.update(producto_id, row[3], row[0], row[4], row[1])
+        except Exception:
+            low_stock.invalidate()
+            product_codes.invalidate()
+
+    def record_movement(conn, producto_id, tipo, cantidad, referencia=None):
+        """Agrega al kardex un movimiento de stock (venta, compra o ajuste) sin hacer commit.
+
+        Debe llamarse dentro de la transacción que cambia Productos.stock, antes del commit.
+        """
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        execute_registered(conn, 'movimiento_insertar', (producto_id, fecha, tipo, cantidad, referencia)).close()
+
+    def stock_value(stock, precio_compra):
+        """Valor de `stock` unidades a `precio_compra` (redondeado a centavos, como la columna)."""
+        return round(int(stock) * round(float(precio_compra or 0), 2), 2)
+
+    def adjust_valuation(conn, cambios):
+        """Suma a los totales de Valoracion_Inventario sin hacer commit.
+
+        cambios: [(id_proveedor, unidades, valor)]; id_proveedor None cuenta como 0 (sin proveedor).
+        Debe llamarse dentro de la transacción que cambia el stock o el precio, con la fila del
+        producto ya bloqueada. Las filas se actualizan en orden de id_proveedor, así dos
+        transacciones que tocan los mismos proveedores los bloquean en el mismo orden.
+        """
+        totales = {}
+        for id_proveedor, unidades, valor in cambios:
+            key = int(id_proveedor or 0)
+            u, v = totales.get(key, (0, 0.0))
+            totales[key] = (u + unidades, v + valor)
+        for id_proveedor in sorted(totales):
+            unidades, valor = totales[id_proveedor]
+            valor = round(valor, 2)
+            if not unidades and not valor:
+                continue
+            cur = execute_registered(conn, 'valoracion_ajustar', (unidades, valor, id_proveedor))
+            if not getattr(cur, 'rowcount', 0):
+                # Primer producto del proveedor: crear su fila y volver a aplicar el ajuste
+                cur.close()
+                execute_registered(conn, 'valoracion_crear', (id_proveedor,)).close()
+                cur = execute_registered(conn, 'valoracion_ajustar', (unidades, valor, id_proveedor))
+            cur.close()
+
+    def record_sale_rollup(conn, fecha_venta, producto_id, cantidad, importe):
+        """Suma una línea de venta a Ventas_Por_Hora sin hacer commit.
+
+        La hora es la de registro de la línea. La fila (fecha, hora, producto) sólo la
+        actualizan ventas de ese producto, que ya tienen su fila de Productos bloqueada.
+        """
+        hora = datetime.now().hour
+        params = (cantidad, round(importe, 2), fecha_venta, hora, producto_id)
+        cur = execute_registered(conn, 'ventas_hora_ajustar', params)
+        if not getattr(cur, 'rowcount', 0):
+            cur.close()
+            execute_registered(conn, 'ventas_hora_crear', (fecha_venta, hora, producto_id)).close()
+            cur = execute_registered(conn, 'ventas_hora_ajustar', params)
+        cur.close()
+
+    def normalize_code(value):
+        """Código de producto sin espacios; vacío -> None (sin código)."""
+        value = str(value).strip() if value is not None else ''
+        return value or None
+
+    def duplicate_code(error) -> bool:
+        """True si el IntegrityError es un código repetido (uq_productos_codigo) y no otra restricción."""
+        text = str(error)
+        return 'uq_productos_codigo' in text or 'UNIQUE constraint failed: Productos.codigo' in text
+
+    def product_write_error(conn, error):
+        """Respuesta a un IntegrityError al guardar un producto (tras deshacer la transacción)."""
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if duplicate_code(error):
+            return jsonify({'error': 'El código ya está asignado a otro producto'}), 409
+        # Proveedor inexistente (fk_proveedor), valores nulos... se informa el error real
+        return jsonify({'error': str(error)}), 400
+
+    # --- Lectura de varios registros por id (?ids=1,2,3 o POST /<recurso>/batch-get) ---
+    batch_chunk = max(1, int(os.getenv('BATCH_GET_CHUNK', 500)))
+    batch_max = int(os.getenv('BATCH_GET_MAX', 10000))
+    batch_resources = {
+        'productos': ('SELECT id_producto AS id, codigo, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor FROM Productos',
+                      'id_producto', lambda cur, r: normalize_product(row_to_dict(cur, r))),
+        'clientes': ('SELECT id_cliente AS id, nombre, direccion, telefono, email FROM Clientes', 'id_cliente', row_to_dict),
+        'proveedores': ('SELECT id_proveedor AS id, nombre, direccion, telefono, email FROM Proveedores', 'id_proveedor', row_to_dict),
+    }
+
+    def parse_ids(raw):
+        """Lista de ids sin repetir (en el orden pedido) a partir de "1,2,3" o [1, 2, 3]."""
+        if isinstance(raw, str):
+            raw = [part for part in raw.split(',') if part.strip()]
+        if not isinstance(raw, list):
+            raise ValueError('ids debe ser una lista')
+        return list(dict.fromkeys(int(i) for i in raw))
+
+    def batch_get_response(recurso, raw_ids):
+        """Resuelve muchos ids con consultas IN (...) de hasta BATCH_GET_CHUNK ids en una sola conexión.
+
+        Retorna {'resultados': [...], 'faltantes': [ids no encontrados]} en el orden pedido.
+        """
+        try:
+            ids = parse_ids(raw_ids)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids inválidos: use ids=1,2,3 o {"ids": [1, 2, 3]}'}), 400
+        if len(ids) > batch_max:
+            return jsonify({'error': f'Demasiados ids ({len(ids)}), máximo {batch_max}'}), 400
+        select, pk, to_dict = batch_resources[recurso]
+        found = {}
+        if ids:
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                for start in range(0, len(ids), batch_chunk):
+                    chunk = ids[start:start + batch_chunk]
+                    cur.execute(f"{select} WHERE {pk} IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+                    for row in cur.fetchall():
+                        found[int(row[0])] = to_dict(cur, row)
+            finally:
+                cur.close()
+                conn.close()
+        return jsonify({'resultados': [found[i] for i in ids if i in found],
+                        'faltantes': [i for i in ids if i not in found]}), 200
+
+    @app.route('/<any(productos, clientes, proveedores):recurso>/batch-get', methods=['POST'])
+    def batch_get(recurso):
+        data = request.get_json(silent=True) or {}
+        try:
+            return batch_get_response(recurso, data.get('ids', []))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/health', methods=['GET'])
     def health():
         return jsonify({'status': 'ok'}), 200
 
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        """Readiness: a diferencia de /health, comprueba la base de datos y el pool."""
+        info = check_readiness(timeout=float(request.args.get('timeout', 1)))
+        return jsonify(info), 200 if info['status'] == 'ready' else 503
+
     # --- CRUD Proveedores [cite: 1180] ---
     @app.route('/proveedores', methods=['GET'])
     def get_proveedores():
-        conn = get_connection()
+        if 'ids' in request.args:
+            return batch_get_response('proveedores', request.args['ids'])
+        conn = read_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT id_proveedor AS id, nombre, direccion, telefono, email FROM Proveedores")
         rows = cursor.fetchall()
@@ -168,8 +1796,7 @@ def create_app():
     @app.route('/proveedores/<int:prov_id>', methods=['GET'])
     def get_proveedor(prov_id):
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id_proveedor AS id, nombre, direccion, telefono, email FROM Proveedores WHERE id_proveedor = %s", (prov_id,))
+        cursor = execute_registered(conn, 'proveedor_por_id', (prov_id,))
         row = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -213,26 +1840,62 @@ def create_app():
         conn.close()
         return jsonify({'updated': updated}), 200
 
+    # Detalle_Ventas está particionada (sin claves foráneas): estas consultas hacen de ON DELETE RESTRICT
+    SQL_PRODUCTO_CON_VENTAS = ('SELECT 1 FROM Detalle_Ventas WHERE id_producto = %s UNION ALL '
+                               'SELECT 1 FROM Detalle_Ventas_Archivo WHERE id_producto = %s LIMIT 1')
+    SQL_PROVEEDOR_CON_VENTAS = (
+        'SELECT 1 FROM Productos p WHERE p.id_proveedor = %s AND ('
+        'EXISTS (SELECT 1 FROM Detalle_Ventas dv WHERE dv.id_producto = p.id_producto) OR '
+        'EXISTS (SELECT 1 FROM Detalle_Ventas_Archivo dva WHERE dva.id_producto = p.id_producto)) LIMIT 1'
+    )
+
     @app.route('/proveedores/<int:prov_id>', methods=['DELETE'])
     def delete_proveedor(prov_id):
+        """Borra un proveedor y, en cascada (fk_proveedor), sus productos.
+
+        Si alguno de sus productos tiene ventas registradas se responde 409, igual que al
+        borrar el producto directamente.
+        """
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute('DELETE FROM Proveedores WHERE id_proveedor = %s', (prov_id,))
-        conn.commit()
-        deleted = getattr(cur, 'rowcount', 0)
-        cur.close()
-        conn.close()
+        try:
+            # Bloquear sus productos antes de comprobar: una venta nueva de alguno espera al borrado
+            cur.execute('SELECT id_producto FROM Productos WHERE id_proveedor = %s FOR UPDATE', (prov_id,))
+            productos = [r[0] for r in cur.fetchall()]
+            if productos:
+                cur.execute(SQL_PROVEEDOR_CON_VENTAS, (prov_id,))
+                if cur.fetchone():
+                    conn.rollback()
+                    return jsonify({'error': 'No se puede borrar: hay productos del proveedor con ventas registradas'}), 409
+            cur.execute('DELETE FROM Proveedores WHERE id_proveedor = %s', (prov_id,))
+            deleted = getattr(cur, 'rowcount', 0)
+            # Sus productos se borran en cascada: con ellos se va su total de valoración
+            cur.execute('DELETE FROM Valoracion_Inventario WHERE id_proveedor = %s', (prov_id,))
+            conn.commit()
+        except IntegrityError as e:
+            # Productos con compras registradas (fk_producto_compra)
+            conn.rollback()
+            return jsonify({'error': f'No se puede borrar: {e}'}), 409
+        finally:
+            cur.close()
+            conn.close()
         if not deleted:
             return jsonify({'deleted': 0}), 404
+        # La cascada no pasa por producto_delete: quitar sus productos de los índices en memoria
+        for producto_id in productos:
+            low_stock.remove(producto_id)
+            product_codes.remove(producto_id)
         return jsonify({'deleted': deleted}), 200
 
     # --- CRUD Productos [cite: 1178] ---
     @app.route('/productos', methods=['GET'])
     def productos_list():
         try:
-            conn = get_connection()
+            if 'ids' in request.args:
+                return batch_get_response('productos', request.args['ids'])
+            conn = read_connection()
             cur = conn.cursor()
-            cur.execute('SELECT id_producto AS id, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor FROM Productos')
+            cur.execute('SELECT id_producto AS id, codigo, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor FROM Productos')
             rows = cur.fetchall()
             productos = [normalize_product(row_to_dict(cur, r)) for r in rows]
             cur.close()
@@ -245,8 +1908,7 @@ def create_app():
     def producto_get(producto_id):
         try:
             conn = get_connection()
-            cur = conn.cursor()
-            cur.execute('SELECT id_producto AS id, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor FROM Productos WHERE id_producto = %s', (producto_id,))
+            cur = execute_registered(conn, 'producto_por_id', (producto_id,))
             row = cur.fetchone()
             producto = normalize_product(row_to_dict(cur, row))
             cur.close()
@@ -257,9 +1919,23 @@ def create_app():
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/productos/by-code/<path:codigo>', methods=['GET'])
+    def producto_by_code(codigo):
+        """Búsqueda por código de barras / SKU para la caja: se responde desde memoria."""
+        try:
+            ensure_codes_loaded()
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        producto = product_codes.get(codigo)
+        if producto is None:
+            return jsonify({'error': 'Código no encontrado'}), 404
+        return jsonify(producto), 200
+
     @app.route('/productos', methods=['POST'])
     def producto_create():
         data = request.get_json() or {}
+        conn = None
+        cur = None
         try:
             precio_compra = float(data.get('precio_compra', 0))
             porcentaje_ganancia = float(data.get('porcentaje_ganancia', 0))
@@ -276,38 +1952,56 @@ def create_app():
             conn = get_connection()
             cur = conn.cursor()
             cur.execute(
-                'INSERT INTO Productos (nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-                (data.get('nombre'), data.get('descripcion'), precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor)
+                'INSERT INTO Productos (codigo, nombre, descripcion, precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                (normalize_code(data.get('codigo')), data.get('nombre'), data.get('descripcion'), precio_compra, porcentaje_ganancia, precio_venta, stock, stock_minimo, id_proveedor)
             )
-            conn.commit()
             new_id = get_last_insert_id(cur, conn)
-            cur.close()
-            conn.close()
+            if stock and new_id is not None:
+                # Saldo inicial en el kardex
+                record_movement(conn, new_id, 'ajuste', stock)
+                adjust_valuation(conn, [(id_proveedor, stock, stock_value(stock, precio_compra))])
+            conn.commit()
+            if new_id is not None:
+                refresh_product_indexes(conn, new_id)
             return jsonify({'id': new_id}), 201
+        except IntegrityError as e:
+            return product_write_error(conn, e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+        finally:
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
 
     @app.route('/productos/<int:producto_id>', methods=['PUT'])
     def producto_update(producto_id):
         data = request.get_json() or {}
         if not data:
             return jsonify({'error': 'No hay campos para actualizar'}), 400
-        
+
+        conn = None
+        cur = None
         try:
             # Obtener datos actuales para recalcular precio_venta si es necesario
             conn = get_connection()
             cur = conn.cursor()
-            cur.execute("SELECT precio_compra, porcentaje_ganancia FROM Productos WHERE id_producto = %s", (producto_id,))
+            # Bloquear la fila: el ajuste de stock se registra en el kardex con la diferencia
+            # y la valoración pasa del valor anterior (proveedor, stock, precio) al nuevo
+            cur.execute("SELECT precio_compra, porcentaje_ganancia, stock, id_proveedor FROM Productos WHERE id_producto = %s FOR UPDATE", (producto_id,))
             producto_row = cur.fetchone()
             if not producto_row:
-                cur.close()
-                conn.close()
+                conn.rollback()
                 return jsonify({'error': 'Producto no encontrado'}), 404
             
             producto = {'precio_compra': float(producto_row[0]), 'porcentaje_ganancia': float(producto_row[1])}
+            stock_anterior = int(producto_row[2])
+            anterior = (producto_row[3], stock_anterior, producto['precio_compra'])
 
             fields, vals = [], []
-            for key in ('nombre', 'descripcion', 'stock', 'stock_minimo', 'id_proveedor', 'precio_compra', 'porcentaje_ganancia'):
+            for key in ('codigo', 'nombre', 'descripcion', 'stock', 'stock_minimo', 'id_proveedor', 'precio_compra', 'porcentaje_ganancia'):
                 if key in data:
                     # Normalizar tipos según el campo
                     val = data[key]
@@ -326,6 +2020,8 @@ def create_app():
                             val = int(val) if val is not None and val != '' else None
                         except Exception:
                             val = None
+                    elif key == 'codigo':
+                        val = normalize_code(val)
 
                     fields.append(f"{key} = %s")
                     vals.append(val)
@@ -340,30 +2036,68 @@ def create_app():
                 vals.append(precio_venta)
 
             if not fields:
+                conn.rollback()
                 return jsonify({'error': 'No hay campos para actualizar'}), 400
 
             vals.append(producto_id)
             sql = f"UPDATE Productos SET {', '.join(fields)} WHERE id_producto = %s"
             
             cur.execute(sql, tuple(vals))
+            if 'stock' in producto and producto['stock'] != stock_anterior:
+                record_movement(conn, producto_id, 'ajuste', producto['stock'] - stock_anterior)
+            nuevo = (producto.get('id_proveedor', anterior[0]), producto.get('stock', stock_anterior), producto['precio_compra'])
+            if nuevo != anterior:
+                adjust_valuation(conn, [(anterior[0], -anterior[1], -stock_value(anterior[1], anterior[2])),
+                                        (nuevo[0], nuevo[1], stock_value(nuevo[1], nuevo[2]))])
             conn.commit()
             updated = getattr(cur, 'rowcount', 0)
-            cur.close()
-            conn.close()
+            if updated:
+                refresh_product_indexes(conn, producto_id)
             return jsonify({'updated': updated}), 200
+        except IntegrityError as e:
+            # La fila quedó bloqueada (FOR UPDATE): deshacer antes de devolver la conexión
+            return product_write_error(conn, e)
         except Exception as e:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
             return jsonify({'error': str(e)}), 500
+        finally:
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
 
     @app.route('/productos/<int:producto_id>', methods=['DELETE'])
     def producto_delete(producto_id):
         try:
             conn = get_connection()
+            # Bloquear la fila antes de comprobar las ventas (una venta nueva espera al borrado) y
+            # para descontar de la valoración el stock que se borra
+            cur = execute_registered(conn, 'producto_bloquear_stock', (producto_id,))
+            row = cur.fetchone()
+            cur.close()
             cur = conn.cursor()
+            cur.execute(SQL_PRODUCTO_CON_VENTAS, (producto_id, producto_id))
+            if cur.fetchone():
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return jsonify({'error': 'No se puede borrar: el producto tiene ventas registradas'}), 409
             cur.execute('DELETE FROM Productos WHERE id_producto = %s', (producto_id,))
-            conn.commit()
             deleted = getattr(cur, 'rowcount', 0)
+            if deleted and row:
+                adjust_valuation(conn, [(row[2], -int(row[0]), -stock_value(row[0], row[1]))])
+            conn.commit()
             cur.close()
             conn.close()
+            if deleted:
+                low_stock.remove(producto_id)
+                product_codes.remove(producto_id)
             if not deleted:
                 return jsonify({'deleted': 0}), 404
             return jsonify({'deleted': deleted}), 200
@@ -376,7 +2110,9 @@ def create_app():
     # --- CRUD Clientes [cite: 1179] ---
     @app.route('/clientes', methods=['GET'])
     def clientes_list():
-        conn = get_connection()
+        if 'ids' in request.args:
+            return batch_get_response('clientes', request.args['ids'])
+        conn = read_connection()
         cur = conn.cursor()
         cur.execute('SELECT id_cliente AS id, nombre, direccion, telefono, email FROM Clientes')
         rows = cur.fetchall()
@@ -388,8 +2124,7 @@ def create_app():
     @app.route('/clientes/<int:cliente_id>', methods=['GET'])
     def cliente_get(cliente_id):
         conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT id_cliente AS id, nombre, direccion, telefono, email FROM Clientes WHERE id_cliente = %s', (cliente_id,))
+        cur = execute_registered(conn, 'cliente_por_id', (cliente_id,))
         row = cur.fetchone()
         cur.close()
         conn.close()
@@ -444,6 +2179,8 @@ def create_app():
     def cliente_delete(cliente_id):
         conn = get_connection()
         cur = conn.cursor()
+        # Ventas está particionada (sin claves foráneas): equivalente a ON DELETE SET NULL
+        cur.execute('UPDATE Ventas SET id_cliente = NULL WHERE id_cliente = %s', (cliente_id,))
         cur.execute('DELETE FROM Clientes WHERE id_cliente = %s', (cliente_id,))
         conn.commit()
         deleted = getattr(cur, 'rowcount', 0)
@@ -532,6 +2269,37 @@ def create_app():
                 pass
             return jsonify({'error': str(e)}), 500
 
+    def insert_sale_line(conn, id_venta, fecha_venta, id_producto, cantidad, precio_unitario):
+        """Registra una línea de venta y descuenta el stock dentro de la transacción de `conn`.
+
+        Retorna (id_detalle, None) o (None, (mensaje, status)) si la línea no se puede
+        registrar; en ese caso quien llama hace rollback.
+        """
+        # Bloquear fila del producto para evitar condiciones de carrera
+        cur = execute_registered(conn, 'producto_bloquear_stock', (id_producto,))
+        row = cur.fetchone()
+        cur.close()
+        if not row:
+            return None, ('Producto no encontrado', 404)
+        stock_actual = int(row[0])
+        costo_unitario = row[1] if row[1] is not None else 0
+        if stock_actual < cantidad:
+            return None, (f'Stock insuficiente. Disponible: {stock_actual}', 400)
+
+        cur = execute_registered(conn, 'detalle_venta_insertar', (id_producto, cantidad, precio_unitario, costo_unitario, id_venta))
+        inserted = getattr(cur, 'rowcount', 0)
+        new_id = getattr(cur, 'lastrowid', None)
+        cur.close()
+        if not inserted:
+            return None, ('Venta no encontrada', 404)
+
+        # Reducir stock
+        execute_registered(conn, 'producto_descontar_stock', (cantidad, id_producto)).close()
+        record_movement(conn, id_producto, 'venta', -cantidad, new_id)
+        adjust_valuation(conn, [(row[2], -cantidad, -stock_value(cantidad, costo_unitario))])
+        record_sale_rollup(conn, fecha_venta, id_producto, cantidad, cantidad * precio_unitario)
+        return new_id, None
+
     @app.route('/detalle_ventas', methods=['POST'])
     def detalle_ventas_create():
         """Crear un detalle de venta y reducir el stock del producto de forma transaccional.
@@ -546,37 +2314,212 @@ def create_app():
             precio_unitario = float(data.get('precio_unitario', 0))
         except Exception:
             return jsonify({'error': 'Parámetros inválidos (id_venta, id_producto, cantidad, precio_unitario son requeridos)'}), 400
+        if cantidad <= 0:
+            return jsonify({'error': 'Cantidad debe ser mayor que 0'}), 400
+
+        conn = None
+        cur = None
+        try:
+            conn = get_connection()
+            cur = execute_registered(conn, 'venta_fecha', (id_venta,))
+            venta = cur.fetchone()
+            if not venta:
+                conn.rollback()
+                return jsonify({'error': 'Venta no encontrada'}), 404
+
+            new_id, error = insert_sale_line(conn, id_venta, venta[0], id_producto, cantidad, precio_unitario)
+            if error:
+                conn.rollback()
+                return jsonify({'error': error[0]}), error[1]
+
+            conn.commit()
+            refresh_product_indexes(conn, id_producto)
+            return jsonify({'id': new_id}), 201
+        except IntegrityError as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return jsonify({'error': str(e)}), 500
+        finally:
+            # Cerrar también en las salidas tempranas (404/400) para devolver la conexión al pool
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
+
+    def registered_sale(conn, clave):
+        """id de la venta ya registrada con `clave` (POST /ventas/completa) o None."""
+        cur = execute_registered(conn, 'venta_clave_buscar', (clave,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else None
+
+    @app.route('/ventas/completa', methods=['POST'])
+    def venta_completa_create():
+        """Registra una venta con todas sus líneas en una sola transacción.
+
+        JSON: clave (generada por el cliente, hasta 64 caracteres), fecha_venta (opcional),
+        id_cliente (opcional) e items: [{id_producto, cantidad, precio_unitario}, ...].
+        La clave se guarda en Ventas_Claves en la misma transacción: reenviar la venta (la cola
+        sin conexión de la GUI, aunque la API se haya reiniciado entre medias) devuelve 200 con
+        la venta ya registrada en vez de crear otra. Si una línea falla no se guarda nada.
+        """
+        data = request.get_json() or {}
+        clave = str(data.get('clave') or '').strip()
+        if not clave or len(clave) > 64:
+            return jsonify({'error': 'clave es requerida (hasta 64 caracteres)'}), 400
+        fecha_venta = data.get('fecha_venta') or datetime.now().strftime('%Y-%m-%d')
+        try:
+            date.fromisoformat(fecha_venta)
+            lineas = [(int(it['id_producto']), int(it['cantidad']), float(it.get('precio_unitario', 0)))
+                      for it in data.get('items') or []]
+        except Exception:
+            return jsonify({'error': 'Parámetros inválidos (fecha_venta YYYY-MM-DD; items con id_producto, cantidad, precio_unitario)'}), 400
+        if not lineas:
+            return jsonify({'error': 'La venta debe tener al menos un item'}), 400
+        if any(cantidad <= 0 for _, cantidad, _ in lineas):
+            return jsonify({'error': 'Cantidad debe ser mayor que 0'}), 400
+        total = round(sum(cantidad * precio for _, cantidad, precio in lineas), 2)
+
+        conn = None
+        cur = None
+        try:
+            conn = get_connection()
+            existente = registered_sale(conn, clave)
+            if existente is not None:
+                return jsonify({'id': existente, 'repetida': True}), 200
+
+            cur = conn.cursor()
+            cur.execute('INSERT INTO Ventas (fecha_venta, id_cliente, total) VALUES (%s, %s, %s)',
+                        (fecha_venta, data.get('id_cliente'), total))
+            id_venta = getattr(cur, 'lastrowid', None)
+            try:
+                execute_registered(conn, 'venta_clave_registrar',
+                                   (clave, id_venta, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).close()
+            except IntegrityError:
+                # Otra petición con la misma clave se confirmó mientras tanto
+                conn.rollback()
+                return jsonify({'id': registered_sale(conn, clave), 'repetida': True}), 200
+
+            detalles = [None] * len(lineas)
+            # Productos en orden de id: dos ventas con productos en común nunca se bloquean en orden inverso
+            for i in sorted(range(len(lineas)), key=lambda i: lineas[i][0]):
+                id_producto, cantidad, precio_unitario = lineas[i]
+                detalles[i], error = insert_sale_line(conn, id_venta, fecha_venta, id_producto, cantidad, precio_unitario)
+                if error:
+                    conn.rollback()
+                    return jsonify({'error': f'Producto {id_producto}: {error[0]}'}), error[1]
+
+            conn.commit()
+            for id_producto in sorted({linea[0] for linea in lineas}):
+                refresh_product_indexes(conn, id_producto)
+            return jsonify({'id': id_venta, 'total': total, 'detalles': detalles}), 201
+        except IntegrityError as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return jsonify({'error': str(e)}), 500
+        finally:
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
+
+    # --- Compras: entradas de stock ---
+    @app.route('/compras', methods=['POST'])
+    def compras_create():
+        """Crear una compra. Espera JSON con: fecha_compra (YYYY-MM-DD opcional), id_proveedor (opcional), total."""
+        data = request.get_json() or {}
+        fecha_compra = data.get('fecha_compra') or datetime.now().strftime('%Y-%m-%d')
+        id_proveedor = data.get('id_proveedor')
+        try:
+            total = float(data.get('total', 0))
+        except Exception:
+            return jsonify({'error': 'total inválido'}), 400
 
         conn = None
         cur = None
         try:
             conn = get_connection()
             cur = conn.cursor()
-            # Bloquear fila del producto para evitar condiciones de carrera
-            cur.execute('SELECT stock FROM Productos WHERE id_producto = %s FOR UPDATE', (id_producto,))
+            cur.execute('INSERT INTO Compras (fecha_compra, id_proveedor, total) VALUES (%s, %s, %s)', (fecha_compra, id_proveedor, total))
+            conn.commit()
+            return jsonify({'id': get_last_insert_id(cur, conn)}), 201
+        except IntegrityError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        finally:
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
+
+    @app.route('/detalle_compras', methods=['POST'])
+    def detalle_compras_create():
+        """Crear un detalle de compra y sumar el stock del producto de forma transaccional.
+
+        JSON esperado: id_compra, id_producto, cantidad, precio_compra
+        """
+        data = request.get_json() or {}
+        try:
+            id_compra = int(data.get('id_compra'))
+            id_producto = int(data.get('id_producto'))
+            cantidad = int(data.get('cantidad'))
+            precio_compra = float(data.get('precio_compra', 0))
+        except Exception:
+            return jsonify({'error': 'Parámetros inválidos (id_compra, id_producto, cantidad, precio_compra son requeridos)'}), 400
+        if cantidad <= 0:
+            return jsonify({'error': 'Cantidad debe ser mayor que 0'}), 400
+
+        conn = None
+        cur = None
+        try:
+            conn = get_connection()
+            # Mismo orden de bloqueo que las ventas: primero la fila del producto
+            cur = execute_registered(conn, 'producto_bloquear_stock', (id_producto,))
             row = cur.fetchone()
             if not row:
                 conn.rollback()
                 return jsonify({'error': 'Producto no encontrado'}), 404
-            stock_actual = int(row[0])
-            if cantidad <= 0:
-                conn.rollback()
-                return jsonify({'error': 'Cantidad debe ser mayor que 0'}), 400
-            if stock_actual < cantidad:
+            cur.close()
+            cur = execute_registered(conn, 'detalle_compra_insertar', (id_producto, cantidad, precio_compra, id_compra))
+            if not getattr(cur, 'rowcount', 0):
                 conn.rollback()
-                return jsonify({'error': f'Stock insuficiente. Disponible: {stock_actual}'},), 400
-
-            # Insertar detalle de venta
-            cur.execute('INSERT INTO Detalle_Ventas (id_venta, id_producto, cantidad, precio_unitario) VALUES (%s, %s, %s, %s)',
-                        (id_venta, id_producto, cantidad, precio_unitario))
+                return jsonify({'error': 'Compra no encontrada'}), 404
+            new_id = getattr(cur, 'lastrowid', None)
 
-            # Reducir stock
-            cur.execute('UPDATE Productos SET stock = stock - %s WHERE id_producto = %s', (cantidad, id_producto))
+            execute_registered(conn, 'producto_sumar_stock', (cantidad, id_producto)).close()
+            record_movement(conn, id_producto, 'compra', cantidad, new_id)
+            # El stock se valora al precio_compra del producto (la compra no lo modifica)
+            adjust_valuation(conn, [(row[2], cantidad, stock_value(cantidad, row[1]))])
 
             conn.commit()
-            new_id = getattr(cur, 'lastrowid', None)
-            cur.close()
-            conn.close()
+            refresh_product_indexes(conn, id_producto)
             return jsonify({'id': new_id}), 201
         except IntegrityError as e:
             if conn:
@@ -592,6 +2535,120 @@ def create_app():
                 except Exception:
                     pass
             return jsonify({'error': str(e)}), 500
+        finally:
+            for obj in (cur, conn):
+                if obj is not None:
+                    try:
+                        obj.close()
+                    except Exception:
+                        pass
+
+    # --- Historial de un cliente (ventas) o de un proveedor (compras) ---
+    # Paginación por clave (fecha, id) en orden descendente: cada página es un recorrido de rango
+    # sobre idx_ventas_cliente_fecha (id_cliente, fecha_venta, total) o idx_compras_proveedor_fecha
+    # (id_proveedor, fecha_compra, total), que también cubren los totales; nunca se salta con OFFSET.
+    # La página siguiente empieza después de la última fila de la anterior: (fecha, id) < (cursor_fecha, cursor_id).
+    historial_limit = int(os.getenv('HISTORIAL_LIMIT', 50))
+    historial_max = int(os.getenv('HISTORIAL_MAX_LIMIT', 500))
+    HISTORIAL_DESDE, HISTORIAL_HASTA = '1000-01-01', '9999-12-31'
+
+    def history_page_sql(tabla, id_col, fecha_col, pk):
+        return (f"SELECT {pk}, {fecha_col}, total FROM {tabla} "
+                f"WHERE {id_col} = %(id)s AND {fecha_col} BETWEEN %(desde)s AND %(hasta)s "
+                f"AND ({fecha_col} < %(cursor_fecha)s OR ({fecha_col} = %(cursor_fecha)s AND {pk} < %(cursor_id)s)) "
+                f"ORDER BY {fecha_col} DESC, {pk} DESC LIMIT %(limit)s")
+
+    def history_totals_sql(tabla, id_col, fecha_col):
+        return f"SELECT total FROM {tabla} WHERE {id_col} = %(id)s AND {fecha_col} BETWEEN %(desde)s AND %(hasta)s"
+
+    # recurso -> (consulta de la entidad, clave de la lista, columna de fecha, SQL de la página, SQL de los totales)
+    historiales = {
+        'clientes': ('cliente_por_id', 'ventas', 'fecha_venta',
+                     # Las ventas archivadas están en otra tabla: se pide una página a cada una y se mezclan
+                     "SELECT id_venta, fecha_venta, total FROM ("
+                     f"SELECT * FROM ({history_page_sql('Ventas', 'id_cliente', 'fecha_venta', 'id_venta')}) a UNION ALL "
+                     f"SELECT * FROM ({history_page_sql('Ventas_Archivo', 'id_cliente', 'fecha_venta', 'id_venta')}) b"
+                     ") v ORDER BY fecha_venta DESC, id_venta DESC LIMIT %(limit)s",
+                     "SELECT COUNT(*), COALESCE(SUM(total), 0) FROM ("
+                     f"{history_totals_sql('Ventas', 'id_cliente', 'fecha_venta')} UNION ALL "
+                     f"{history_totals_sql('Ventas_Archivo', 'id_cliente', 'fecha_venta')}) v"),
+        'proveedores': ('proveedor_por_id', 'compras', 'fecha_compra',
+                        history_page_sql('Compras', 'id_proveedor', 'fecha_compra', 'id_compra'),
+                        f"SELECT COUNT(*), COALESCE(SUM(total), 0) FROM ({history_totals_sql('Compras', 'id_proveedor', 'fecha_compra')}) c"),
+    }
+
+    def parse_history_args():
+        """(parámetros de las consultas, error) a partir de ?desde, ?hasta, ?limit y ?cursor."""
+        desde = request.args.get('desde') or HISTORIAL_DESDE
+        hasta = request.args.get('hasta') or HISTORIAL_HASTA
+        try:
+            for fecha in (desde, hasta):
+                datetime.strptime(fecha, '%Y-%m-%d')
+        except ValueError:
+            return None, (jsonify({'error': 'Formato de fecha inválido, use YYYY-MM-DD'}), 400)
+        try:
+            limit = int(request.args.get('limit', historial_limit))
+        except ValueError:
+            return None, (jsonify({'error': 'limit debe ser un número'}), 400)
+        if not 1 <= limit <= historial_max:
+            return None, (jsonify({'error': f'limit debe estar entre 1 y {historial_max}'}), 400)
+        # Sin cursor se empieza por el final del rango (todas las filas cumplen la condición)
+        cursor_fecha, cursor_id = hasta, 2 ** 31
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_fecha, raw_id = cursor.split(':')
+                datetime.strptime(cursor_fecha, '%Y-%m-%d')
+                cursor_id = int(raw_id)
+            except ValueError:
+                return None, (jsonify({'error': 'cursor inválido'}), 400)
+        return {'desde': desde, 'hasta': hasta, 'limit': limit,
+                'cursor_fecha': cursor_fecha, 'cursor_id': cursor_id}, None
+
+    def history_response(recurso, entity_id):
+        registro, clave, fecha_col, sql_pagina, sql_totales = historiales[recurso]
+        params, error = parse_history_args()
+        if error: return error
+        params['id'] = entity_id
+        conn = read_connection()
+        try:
+            cur = execute_registered(conn, registro, (entity_id,))
+            entidad = cur.fetchone()
+            cur.close()
+            if not entidad:
+                return jsonify({'error': 'No encontrado'}), 404
+            cur = conn.cursor()
+            try:
+                cur.execute(sql_pagina, params)
+                rows = cur.fetchall()
+                cur.execute(sql_totales, params)
+                cantidad, monto = cur.fetchone()
+            finally:
+                cur.close()
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        finally:
+            conn.close()
+        items = [{'id': r[0], fecha_col: str(r[1]), 'total': float(r[2])} for r in rows]
+        siguiente = f"{items[-1][fecha_col]}:{items[-1]['id']}" if len(items) == params['limit'] else None
+        return jsonify({'id': entidad[0], 'nombre': entidad[1],
+                        'desde': params['desde'], 'hasta': params['hasta'],
+                        'cantidad': int(cantidad), 'monto_total': float(monto),
+                        clave: items, 'siguiente': siguiente}), 200
+
+    @app.route('/clientes/<int:cliente_id>/ventas', methods=['GET'])
+    def cliente_ventas(cliente_id):
+        """Ventas de un cliente, de la más reciente a la más antigua.
+
+        ?desde=&hasta= (YYYY-MM-DD, opcionales), ?limit= (por defecto 50) y ?cursor= con el valor
+        `siguiente` de la página anterior. cantidad y monto_total son de todo el rango.
+        """
+        return history_response('clientes', cliente_id)
+
+    @app.route('/proveedores/<int:prov_id>/compras', methods=['GET'])
+    def proveedor_compras(prov_id):
+        """Compras a un proveedor; mismos parámetros y respuesta que /clientes/<id>/ventas."""
+        return history_response('proveedores', prov_id)
 
     # --- REPORTES [cite: 1181, 1182, 1183, 1184, 1185] ---
 
@@ -605,138 +2662,594 @@ def create_app():
         except Exception:
             return None, (jsonify({'error': 'Formato de fecha inválido, use YYYY-MM-DD'}), 400)
 
-    @app.route('/reportes/compras', methods=['GET'])
-    def reporte_compras():
-        desde, hasta = request.args.get('desde'), request.args.get('hasta')
-        dates, error = validate_dates(desde, hasta)
-        if error: return error
-
-        conn = get_connection()
+    # Los reportes por fecha reciben los parámetros por nombre: {'desde': ..., 'hasta': ...}.
+    # Ventas y Detalle_Ventas están particionadas por mes de fecha_venta; filtrar siempre por
+    # esa columna permite que MariaDB lea sólo las particiones del rango. Los meses archivados
+    # (mantenimiento.py archivar) se leen de las tablas *_Archivo, indexadas por fecha.
+    SQL_VENTAS_RANGO = (
+        "(SELECT id_venta, fecha_venta, id_cliente, total FROM Ventas "
+        "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s "
+        "UNION ALL SELECT id_venta, fecha_venta, id_cliente, total FROM Ventas_Archivo "
+        "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s)"
+    )
+    # Cubierto por idx_detalle_ganancias (fecha_venta, id_producto, cantidad, precio_unitario,
+    # costo_unitario): se resuelve leyendo sólo el índice, sin tocar las filas ni Productos.
+    SQL_DETALLE_VENTAS_RANGO = (
+        "(SELECT id_producto, cantidad, precio_unitario, costo_unitario FROM Detalle_Ventas "
+        "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s "
+        "UNION ALL SELECT id_producto, cantidad, precio_unitario, costo_unitario FROM Detalle_Ventas_Archivo "
+        "WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s)"
+    )
+    SQL_REPORTE_COMPRAS = (
+        "SELECT c.id_compra AS id, c.fecha_compra, c.total, p.id_proveedor, p.nombre AS proveedor "
+        "FROM Compras c LEFT JOIN Proveedores p ON c.id_proveedor = p.id_proveedor "
+        "WHERE c.fecha_compra BETWEEN %(desde)s AND %(hasta)s ORDER BY c.fecha_compra"
+    )
+    SQL_REPORTE_VENTAS = (
+        "SELECT v.id_venta AS id, v.fecha_venta, v.total, c.id_cliente, c.nombre AS cliente "
+        f"FROM {SQL_VENTAS_RANGO} v LEFT JOIN Clientes c ON v.id_cliente = c.id_cliente "
+        "ORDER BY v.fecha_venta"
+    )
+    # El costo es el guardado en cada línea de venta (no el precio de compra actual). Se agrega
+    # por producto sobre las tablas de ventas y sólo después se busca el nombre: un acceso a
+    # Productos por producto vendido, no por línea.
+    SQL_REPORTE_GANANCIAS = (
+        "SELECT COALESCE(p.nombre, CONCAT('#', g.id_producto)) as producto, g.cantidad_vendida, "
+        "g.total_ventas, g.total_costo, g.ganancia "
+        "FROM (SELECT dv.id_producto, SUM(dv.cantidad) as cantidad_vendida, "
+        "SUM(dv.cantidad * dv.precio_unitario) as total_ventas, "
+        "SUM(dv.cantidad * dv.costo_unitario) as total_costo, "
+        "SUM(dv.cantidad * (dv.precio_unitario - dv.costo_unitario)) as ganancia "
+        f"FROM {SQL_DETALLE_VENTAS_RANGO} dv GROUP BY dv.id_producto) g "
+        "LEFT JOIN Productos p ON p.id_producto = g.id_producto "
+        "ORDER BY producto"
+    )
+    # Kardex por producto: el stock al empezar el rango sale de la foto más reciente anterior a
+    # `desde` (Snapshots_Stock, mantenimiento.py snapshots) más los movimientos posteriores a esa
+    # foto. Sólo se recorren los movimientos desde la foto, por idx_movimientos_producto
+    # (id_producto, id_movimiento, fecha, cantidad), sin leer la tabla.
+    SQL_REPORTE_KARDEX = (
+        "SELECT p.id_producto, p.nombre AS producto, "
+        "COALESCE(s.stock, 0) + COALESCE(SUM(CASE WHEN m.fecha < %(desde)s THEN m.cantidad END), 0) AS stock_inicial, "
+        "COALESCE(SUM(CASE WHEN m.fecha >= %(desde)s AND m.cantidad > 0 THEN m.cantidad END), 0) AS entradas, "
+        "COALESCE(SUM(CASE WHEN m.fecha >= %(desde)s AND m.cantidad < 0 THEN -m.cantidad END), 0) AS salidas, "
+        "COALESCE(s.stock, 0) + COALESCE(SUM(m.cantidad), 0) AS stock_final "
+        "FROM Productos p "
+        "LEFT JOIN Snapshots_Stock s ON s.id_producto = p.id_producto AND s.fecha = "
+        "(SELECT MAX(s2.fecha) FROM Snapshots_Stock s2 WHERE s2.id_producto = p.id_producto AND s2.fecha <= %(desde)s) "
+        "LEFT JOIN Movimientos_Stock m ON m.id_producto = p.id_producto "
+        "AND m.id_movimiento > COALESCE(s.id_movimiento, 0) AND DATE(m.fecha) <= %(hasta)s "
+        "GROUP BY p.id_producto, p.nombre, s.stock ORDER BY p.nombre"
+    )
+    SQL_REPORTE_EXISTENCIAS = "SELECT nombre, stock FROM Productos ORDER BY nombre"
+    # Último pronóstico de demanda (mantenimiento.py pronostico) junto al stock actual
+    SQL_REPORTE_PRONOSTICO = (
+        "SELECT p.id_producto, p.nombre AS producto, p.stock, p.stock_minimo, f.demanda_diaria, f.desviacion, "
+        "f.stock_minimo_sugerido, f.fecha_calculo "
+        "FROM Pronosticos_Demanda f JOIN Productos p ON p.id_producto = f.id_producto ORDER BY p.nombre"
+    )
+    # Totales mantenidos por la API (adjust_valuation): una fila por proveedor, sin recorrer Productos
+    SQL_REPORTE_VALORACION = (
+        "SELECT v.id_proveedor, COALESCE(pr.nombre, 'Sin proveedor') AS proveedor, v.unidades, v.valor "
+        "FROM Valoracion_Inventario v LEFT JOIN Proveedores pr ON pr.id_proveedor = v.id_proveedor "
+        "WHERE v.unidades <> 0 OR v.valor <> 0 ORDER BY v.valor DESC"
+    )
+    # Copia en bloque el stock_minimo sugerido: una sola sentencia sobre todos los productos pronosticados
+    SQL_APLICAR_PRONOSTICO = (
+        "UPDATE Productos SET stock_minimo = (SELECT f.stock_minimo_sugerido FROM Pronosticos_Demanda f "
+        "WHERE f.id_producto = Productos.id_producto) "
+        "WHERE id_producto IN (SELECT id_producto FROM Pronosticos_Demanda)"
+    )
+
+    def query_reporte_compras(desde, hasta):
+        conn = read_connection()
         cur = conn.cursor()
         try:
-            sql = (
-                "SELECT c.id_compra AS id, c.fecha_compra, c.total, p.id_proveedor, p.nombre AS proveedor "
-                "FROM Compras c LEFT JOIN Proveedores p ON c.id_proveedor = p.id_proveedor "
-                "WHERE c.fecha_compra BETWEEN %s AND %s ORDER BY c.fecha_compra"
-            )
-            cur.execute(sql, (desde, hasta))
-            compras = [row_to_dict(cur, r) for r in cur.fetchall()]
-            
+            cur.execute(SQL_REPORTE_COMPRAS, {'desde': desde, 'hasta': hasta})
+            compras = rows_to_table(cur, cur.fetchall())
+
             cur.execute('SELECT COALESCE(SUM(total),0) FROM Compras WHERE fecha_compra BETWEEN %s AND %s', (desde, hasta))
             suma_total = cur.fetchone()[0]
-            
-            return jsonify({'desde': desde, 'hasta': hasta, 'suma_total': float(suma_total), 'compras': compras}), 200
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+
+            return {'desde': desde, 'hasta': hasta, 'suma_total': float(suma_total), 'compras': compras}
         finally:
             cur.close()
             conn.close()
 
-    @app.route('/reportes/ventas', methods=['GET'])
-    def reporte_ventas():
-        desde, hasta = request.args.get('desde'), request.args.get('hasta')
-        dates, error = validate_dates(desde, hasta)
-        if error: return error
-
-        conn = get_connection()
+    def query_reporte_ventas(desde, hasta):
+        conn = read_connection()
         cur = conn.cursor()
         try:
-            sql = (
-                "SELECT v.id_venta AS id, v.fecha_venta, v.total, c.id_cliente, c.nombre AS cliente "
-                "FROM Ventas v LEFT JOIN Clientes c ON v.id_cliente = c.id_cliente "
-                "WHERE v.fecha_venta BETWEEN %s AND %s ORDER BY v.fecha_venta"
-            )
-            cur.execute(sql, (desde, hasta))
-            ventas = [row_to_dict(cur, r) for r in cur.fetchall()]
+            rango = {'desde': desde, 'hasta': hasta}
+            cur.execute(SQL_REPORTE_VENTAS, rango)
+            ventas = rows_to_table(cur, cur.fetchall())
 
-            cur.execute('SELECT COALESCE(SUM(total), 0) FROM Ventas WHERE fecha_venta BETWEEN %s AND %s', (desde, hasta))
+            cur.execute(f'SELECT COALESCE(SUM(total), 0) FROM {SQL_VENTAS_RANGO} v', rango)
             suma_total = cur.fetchone()[0]
 
-            return jsonify({'desde': desde, 'hasta': hasta, 'suma_total': float(suma_total), 'ventas': ventas}), 200
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return {'desde': desde, 'hasta': hasta, 'suma_total': float(suma_total), 'ventas': ventas}
         finally:
             cur.close()
             conn.close()
 
-    @app.route('/reportes/ganancias', methods=['GET'])
-    def reporte_ganancias():
-        desde, hasta = request.args.get('desde'), request.args.get('hasta')
-        dates, error = validate_dates(desde, hasta)
-        if error: return error
-
-        conn = get_connection()
+    def query_reporte_ganancias(desde, hasta):
+        conn = read_connection()
         cur = conn.cursor()
         try:
-            sql_productos = (
-                "SELECT p.nombre as producto, SUM(dv.cantidad) as cantidad_vendida, "
-                "SUM(dv.cantidad * dv.precio_unitario) as total_ventas, "
-                "SUM(dv.cantidad * p.precio_compra) as total_costo, "
-                "SUM(dv.cantidad * (dv.precio_unitario - p.precio_compra)) as ganancia "
-                "FROM Detalle_Ventas dv "
-                "JOIN Ventas v ON dv.id_venta = v.id_venta "
-                "JOIN Productos p ON dv.id_producto = p.id_producto "
-                "WHERE v.fecha_venta BETWEEN %s AND %s "
-                "GROUP BY p.nombre"
-            )
-            cur.execute(sql_productos, (desde, hasta))
-            ganancias_por_producto = [row_to_dict(cur, r) for r in cur.fetchall()]
+            rango = {'desde': desde, 'hasta': hasta}
+            cur.execute(SQL_REPORTE_GANANCIAS, rango)
+            ganancias_por_producto = rows_to_table(cur, cur.fetchall())
 
             sql_total = (
-                "SELECT SUM(dv.cantidad * (dv.precio_unitario - p.precio_compra)) as ganancia_total "
-                "FROM Detalle_Ventas dv "
-                "JOIN Ventas v ON dv.id_venta = v.id_venta "
-                "JOIN Productos p ON dv.id_producto = p.id_producto "
-                "WHERE v.fecha_venta BETWEEN %s AND %s"
+                "SELECT SUM(dv.cantidad * (dv.precio_unitario - dv.costo_unitario)) as ganancia_total "
+                f"FROM {SQL_DETALLE_VENTAS_RANGO} dv"
             )
-            cur.execute(sql_total, (desde, hasta))
+            cur.execute(sql_total, rango)
             ganancia_total = cur.fetchone()[0]
 
-            return jsonify({
+            return {
                 'desde': desde,
                 'hasta': hasta,
                 'ganancia_total': float(ganancia_total or 0.0),
                 'ganancias_por_producto': ganancias_por_producto
-            }), 200
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            }
         finally:
             cur.close()
             conn.close()
 
-    @app.route('/reportes/existencias_minimas', methods=['GET'])
-    def reporte_existencias_minimas():
-        conn = get_connection()
+    def query_reporte_kardex(desde, hasta):
+        conn = read_connection()
         cur = conn.cursor()
         try:
-            cur.execute("SELECT nombre, stock, stock_minimo FROM Productos WHERE stock <= stock_minimo")
-            productos = [row_to_dict(cur, r) for r in cur.fetchall()]
-            return jsonify(productos), 200
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            cur.execute(SQL_REPORTE_KARDEX, {'desde': desde, 'hasta': hasta})
+            return {'desde': desde, 'hasta': hasta, 'productos': rows_to_table(cur, cur.fetchall())}
         finally:
             cur.close()
             conn.close()
 
-    @app.route('/reportes/existencias', methods=['GET'])
-    def reporte_existencias():
-        conn = get_connection()
+    # Parámetros de reposición de la analítica de inventario
+    analitica_parametros = {
+        'lead_time': float(os.getenv('ANALITICA_LEAD_TIME', 7)),
+        'dias_revision': float(os.getenv('ANALITICA_DIAS_REVISION', 14)),
+        'z': float(os.getenv('ANALITICA_Z', 1.65)),
+    }
+
+    def query_reporte_analitica(desde, hasta):
+        conn = read_connection()
+        try:
+            tabla = analitica.analizar(conn, desde, hasta, **analitica_parametros)
+        finally:
+            conn.close()
+        return {'desde': desde, 'hasta': hasta, 'parametros': analitica_parametros, 'productos': tabla}
+
+    def query_reporte_existencias_minimas(desde=None, hasta=None):
+        # Servido desde el índice mantenido en memoria; sólo la primera llamada recorre Productos
+        ensure_low_stock_loaded()
+        return {'columns': ['nombre', 'stock', 'stock_minimo'],
+                'rows': [[p['nombre'], p['stock'], p['stock_minimo']] for p in low_stock.snapshot()]}
+
+    def query_reporte_pronostico(desde=None, hasta=None):
+        conn = read_connection()
         cur = conn.cursor()
         try:
-            cur.execute("SELECT nombre, stock FROM Productos ORDER BY nombre")
-            productos = [row_to_dict(cur, r) for r in cur.fetchall()]
-            return jsonify(productos), 200
+            cur.execute(SQL_REPORTE_PRONOSTICO)
+            return rows_to_table(cur, cur.fetchall())
+        finally:
+            cur.close()
+            conn.close()
+
+    def query_reporte_valoracion(desde=None, hasta=None):
+        conn = read_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(SQL_REPORTE_VALORACION)
+            rows = cur.fetchall()
+            return {'valor_total': round(sum(float(r[3]) for r in rows), 2),
+                    'unidades_total': sum(int(r[2]) for r in rows),
+                    'por_proveedor': rows_to_table(cur, rows)}
+        finally:
+            cur.close()
+            conn.close()
+
+    def query_reporte_existencias(desde=None, hasta=None):
+        conn = read_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(SQL_REPORTE_EXISTENCIAS)
+            return rows_to_table(cur, cur.fetchall())
+        finally:
+            cur.close()
+            conn.close()
+
+    # SQL de las filas de detalle de cada reporte, usado por la exportación ?format=csv|xlsx
+    reportes_sql = {
+        'compras': SQL_REPORTE_COMPRAS,
+        'ventas': SQL_REPORTE_VENTAS,
+        'ganancias': SQL_REPORTE_GANANCIAS,
+        'kardex': SQL_REPORTE_KARDEX,
+        'existencias': SQL_REPORTE_EXISTENCIAS,
+        'pronostico': SQL_REPORTE_PRONOSTICO,
+        'valoracion': SQL_REPORTE_VALORACION,
+    }
+
+    # nombre -> (función, requiere rango de fechas, clave de la tabla de filas; None si el reporte es sólo la tabla)
+    reportes = {
+        'compras': (query_reporte_compras, True, 'compras'),
+        'ventas': (query_reporte_ventas, True, 'ventas'),
+        'ganancias': (query_reporte_ganancias, True, 'ganancias_por_producto'),
+        'kardex': (query_reporte_kardex, True, 'productos'),
+        'analitica': (query_reporte_analitica, True, 'productos'),
+        'existencias_minimas': (query_reporte_existencias_minimas, False, None),
+        'existencias': (query_reporte_existencias, False, None),
+        'pronostico': (query_reporte_pronostico, False, None),
+        'valoracion': (query_reporte_valoracion, False, 'por_proveedor'),
+    }
+
+    def render_report(nombre, result, formato):
+        """Convierte el resultado columnar interno al formato pedido.
+
+        'json' (por defecto) mantiene la forma histórica con una lista de objetos por fila;
+        'columnar' y 'msgpack' envían {'columns': [...], 'rows': [[...], ...]}.
+        """
+        if result is None or formato != 'json':
+            return result
+        key = reportes[nombre][2]
+        if key is None:
+            return table_to_records(result)
+        out = dict(result)
+        out[key] = table_to_records(result[key])
+        return out
+
+    def payload_response(payload, formato, status=200):
+        if formato == 'msgpack':
+            return Response(pack_msgpack(payload), status=status, mimetype='application/x-msgpack')
+        resp = jsonify(payload)
+        resp.status_code = status
+        return resp
+
+    def run_report(nombre, desde=None, hasta=None):
+        return reportes[nombre][0](desde, hasta)
+
+    # Reportes servidos desde memoria: no usan conexión, así que tampoco la caché por versión de datos
+    reportes_en_memoria = {'existencias_minimas'}
+
+    def report_result(nombre, desde, hasta):
+        if nombre in reportes_en_memoria:
+            return run_report(nombre, desde, hasta)
+        return report_jobs.run_cached(nombre, desde, hasta)
+
+    report_jobs = ReportJobQueue(
+        run_report,
+        workers=int(os.getenv('REPORT_WORKERS', 2)),
+        cache_size=int(os.getenv('REPORT_CACHE_SIZE', 64)),
+        read_scope=pinned_read,
+    )
+
+    def report_response(nombre):
+        """Respuesta síncrona de un reporte, reutilizando el resultado cacheado si los datos no cambiaron."""
+        desde, hasta = request.args.get('desde'), request.args.get('hasta')
+        if reportes[nombre][1]:
+            dates, error = validate_dates(desde, hasta)
+            if error: return error
+        else:
+            desde = hasta = None
+        formato = request.args.get('format', 'json')
+        if formato in EXPORT_FORMATS:
+            return export_response(nombre, desde, hasta, formato)
+        error = check_payload_format(formato)
+        if error: return error
+        try:
+            result = report_result(nombre, desde, hasta)
+            return payload_response(render_report(nombre, result, formato), formato)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    def check_payload_format(formato):
+        if formato not in PAYLOAD_FORMATS:
+            return jsonify({'error': f"format inválido, use {', '.join(PAYLOAD_FORMATS + tuple(EXPORT_FORMATS))}"}), 400
+        if formato == 'msgpack' and msgpack is None:
+            return jsonify({'error': 'msgpack no está instalado en el servidor: pip install msgpack'}), 400
+        return None
+
+    def export_response(nombre, desde, hasta, formato):
+        """Exporta las filas del reporte leyéndolas del cursor a medida que se envían (memoria constante)."""
+        if formato == 'xlsx' and not has_openpyxl():
+            return jsonify({'error': 'openpyxl no está instalado en el servidor: pip install openpyxl'}), 500
+        if nombre not in reportes_sql:
+            # Reportes calculados en Python (analítica) o servidos desde memoria: se exporta la tabla ya calculada
+            try:
+                result = report_result(nombre, desde, hasta)
+            except Exception as e:
+                return jsonify({'error': str(e)}), 500
+            key = reportes[nombre][2]
+            table = result[key] if key is not None else result
+            return export_table(nombre, desde, hasta, formato, table['columns'], iter(table['rows']))
+        try:
+            conn = read_connection()
+            cur = create_streaming_cursor(conn)
+            if reportes[nombre][1]:
+                cur.execute(reportes_sql[nombre], {'desde': desde, 'hasta': hasta})
+            else:
+                cur.execute(reportes_sql[nombre])
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        def cleanup():
+            for obj in (cur, conn):
+                try:
+                    obj.close()
+                except Exception:
+                    pass
+
+        resp = export_table(nombre, desde, hasta, formato, [d[0] for d in cur.description], iter_cursor(cur))
+        resp.call_on_close(cleanup)
+        return resp
+
+    def export_table(nombre, desde, hasta, formato, columns, rows):
+        body = iter_csv(columns, rows) if formato == 'csv' else iter_xlsx(nombre, columns, rows)
+        filename = f"reporte_{nombre}" + (f"_{desde}_{hasta}" if desde else '') + f".{formato}"
+        return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[formato],
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+    @app.route('/reportes/compras', methods=['GET'])
+    def reporte_compras():
+        return report_response('compras')
+
+    @app.route('/reportes/ventas', methods=['GET'])
+    def reporte_ventas():
+        return report_response('ventas')
+
+    @app.route('/reportes/ganancias', methods=['GET'])
+    def reporte_ganancias():
+        return report_response('ganancias')
+
+    @app.route('/reportes/kardex', methods=['GET'])
+    def reporte_kardex():
+        return report_response('kardex')
+
+    @app.route('/reportes/analitica', methods=['GET'])
+    def reporte_analitica():
+        """ABC por ingresos, rotación, días de cobertura y cantidad sugerida de reposición por producto."""
+        return report_response('analitica')
+
+    @app.route('/reportes/existencias_minimas', methods=['GET'])
+    def reporte_existencias_minimas():
+        return report_response('existencias_minimas')
+
+    @app.route('/reportes/existencias_minimas/stream', methods=['GET'])
+    def reporte_existencias_minimas_stream():
+        """Stream SSE: un evento 'snapshot' inicial y luego 'alerta'/'normalizado' por cada cambio."""
+        try:
+            ensure_low_stock_loaded()
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+        keepalive = float(os.getenv('SSE_KEEPALIVE', 15))
+
+        def stream():
+            # Suscribirse antes del snapshot para no perder cambios intermedios
+            subscription = low_stock.subscribe()
+            try:
+                yield sse_message('snapshot', low_stock.snapshot())
+                while True:
+                    try:
+                        event, data = subscription.get(timeout=keepalive)
+                    except queue.Empty:
+                        yield ': ping\n\n'
+                        continue
+                    yield sse_message(event, data)
+            finally:
+                low_stock.unsubscribe(subscription)
+
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(stream()), mimetype='text/event-stream', headers=headers)
+
+    @app.route('/reportes/existencias', methods=['GET'])
+    def reporte_existencias():
+        return report_response('existencias')
+
+    @app.route('/reportes/pronostico', methods=['GET'])
+    def reporte_pronostico():
+        """Demanda diaria pronosticada y stock_minimo sugerido por producto (mantenimiento.py pronostico)."""
+        return report_response('pronostico')
+
+    @app.route('/reportes/valoracion', methods=['GET'])
+    def reporte_valoracion():
+        """Valor del inventario (stock * precio_compra) total y por proveedor, leído de los totales mantenidos."""
+        return report_response('valoracion')
+
+    # --- Tablero de ventas (GET /dashboard) ---
+    # Se calcula sobre Ventas_Por_Hora (una fila por día, hora y producto, mantenida en cada
+    # venta), nunca sobre las tablas de ventas; el resultado se reutiliza durante DASHBOARD_TTL
+    # segundos, así un tablero que consulta cada pocos segundos no carga la base.
+    dashboard_cache = TTLCache(float(os.getenv('DASHBOARD_TTL', 5)))
+    dashboard_max_dias = int(os.getenv('DASHBOARD_MAX_DIAS', 366))
+    SEMANAS_MEDIA_MOVIL = 4
+    SQL_DASHBOARD_SERIE = (
+        "SELECT fecha, hora, SUM(unidades), SUM(importe) FROM Ventas_Por_Hora "
+        "WHERE fecha BETWEEN %(desde)s AND %(hasta)s GROUP BY fecha, hora ORDER BY fecha, hora"
+    )
+    SQL_DASHBOARD_TOP = (
+        "SELECT t.id_producto, COALESCE(p.nombre, CONCAT('#', t.id_producto)) AS producto, t.unidades, t.importe "
+        "FROM (SELECT id_producto, SUM(unidades) AS unidades, SUM(importe) AS importe FROM Ventas_Por_Hora "
+        "WHERE fecha BETWEEN %(desde)s AND %(hasta)s GROUP BY id_producto ORDER BY importe DESC LIMIT %(top)s) t "
+        "LEFT JOIN Productos p ON p.id_producto = t.id_producto ORDER BY t.importe DESC"
+    )
+
+    def moving_average(valores, ventana):
+        """Media móvil simple de las últimas `ventana` posiciones (incluida la actual)."""
+        medias, suma = [], 0.0
+        for i, valor in enumerate(valores):
+            suma += valor
+            if i >= ventana:
+                suma -= valores[i - ventana]
+            medias.append(round(suma / min(i + 1, ventana), 2))
+        return medias
+
+    def build_dashboard(desde, hasta, top, ventana):
+        # La serie empieza antes de `desde` para que las medias móviles del primer día y de la
+        # primera semana ya tengan su ventana completa
+        lunes = desde - timedelta(days=desde.weekday())
+        inicio = min(desde - timedelta(days=ventana - 1), lunes - timedelta(weeks=SEMANAS_MEDIA_MOVIL - 1))
+        conn = read_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(SQL_DASHBOARD_SERIE, {'desde': inicio.isoformat(), 'hasta': hasta.isoformat()})
+            serie = [(date.fromisoformat(str(r[0])[:10]), int(r[1]), int(r[2]), float(r[3])) for r in cur.fetchall()]
+            cur.execute(SQL_DASHBOARD_TOP, {'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'top': top})
+            top_productos = [{'id_producto': r[0], 'producto': r[1], 'unidades': int(r[2]), 'importe': float(r[3])}
+                             for r in cur.fetchall()]
         finally:
             cur.close()
             conn.close()
 
+        dias = [inicio + timedelta(days=i) for i in range((hasta - inicio).days + 1)]
+        por_dia = {d: [0, 0.0] for d in dias}
+        perfil = [[0, 0.0] for _ in range(24)]
+        por_hora = []
+        for fecha, hora, unidades, importe in serie:
+            por_dia[fecha][0] += unidades
+            por_dia[fecha][1] += importe
+            if fecha >= desde:
+                perfil[hora][0] += unidades
+                perfil[hora][1] += importe
+                por_hora.append({'fecha': fecha.isoformat(), 'hora': hora, 'unidades': unidades, 'importe': round(importe, 2)})
+
+        medias_dia = moving_average([por_dia[d][1] for d in dias], ventana)
+        semanas = {}
+        for d in dias:
+            semana = semanas.setdefault(d - timedelta(days=d.weekday()), [0, 0.0])
+            semana[0] += por_dia[d][0]
+            semana[1] += por_dia[d][1]
+        lunes_ordenados = sorted(semanas)
+        medias_semana = moving_average([semanas[l][1] for l in lunes_ordenados], SEMANAS_MEDIA_MOVIL)
+        dentro = [d >= desde for d in dias]
+        return {
+            'desde': desde.isoformat(), 'hasta': hasta.isoformat(),
+            'totales': {'unidades': sum(por_dia[d][0] for d in dias if d >= desde),
+                        'importe': round(sum(por_dia[d][1] for d in dias if d >= desde), 2)},
+            'top_productos': top_productos,
+            'por_hora': por_hora,
+            'perfil_horario': [{'hora': h, 'unidades': u, 'importe': round(i, 2)} for h, (u, i) in enumerate(perfil)],
+            'por_dia': [{'fecha': d.isoformat(), 'unidades': por_dia[d][0], 'importe': round(por_dia[d][1], 2),
+                         'media_movil': medias_dia[i]} for i, d in enumerate(dias) if dentro[i]],
+            'por_semana': [{'semana': l.isoformat(), 'unidades': semanas[l][0], 'importe': round(semanas[l][1], 2),
+                            'media_movil': medias_semana[i]} for i, l in enumerate(lunes_ordenados) if l >= lunes],
+        }
+
+    @app.route('/dashboard', methods=['GET'])
+    def dashboard():
+        """Tablero de ventas: top de productos, ventas por hora, día y semana y medias móviles.
+
+        ?desde=&hasta= (por defecto los últimos 30 días), ?top= (productos, por defecto 10) y
+        ?ventana= (días de la media móvil diaria, por defecto 7; la semanal usa 4 semanas).
+        """
+        hoy = date.today()
+        try:
+            hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else hoy
+            desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=29)
+        except ValueError:
+            return jsonify({'error': 'Formato de fecha inválido, use YYYY-MM-DD'}), 400
+        try:
+            top = int(request.args.get('top', 10))
+            ventana = int(request.args.get('ventana', 7))
+        except ValueError:
+            return jsonify({'error': 'top y ventana deben ser números'}), 400
+        if desde > hasta or (hasta - desde).days >= dashboard_max_dias:
+            return jsonify({'error': f'Rango inválido: desde <= hasta y como máximo {dashboard_max_dias} días'}), 400
+        if not 1 <= top <= 100 or not 1 <= ventana <= 90:
+            return jsonify({'error': 'top debe estar entre 1 y 100 y ventana entre 1 y 90'}), 400
+        try:
+            resultado = dashboard_cache.get_or_compute((desde, hasta, top, ventana),
+                                                       lambda: build_dashboard(desde, hasta, top, ventana))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        resp = jsonify(resultado)
+        resp.headers['Cache-Control'] = f'max-age={int(dashboard_cache.ttl)}'
+        return resp
+
+    @app.route('/pronosticos/aplicar', methods=['POST'])
+    def pronosticos_aplicar():
+        """Reemplaza el stock_minimo de los productos por el sugerido en el último pronóstico."""
+        try:
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute(SQL_APLICAR_PRONOSTICO)
+                conn.commit()
+                actualizados = getattr(cur, 'rowcount', 0)
+            finally:
+                cur.close()
+                conn.close()
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        # Cambian los mínimos de muchos productos: el índice se recarga completo y las diferencias
+        # llegan a los suscriptores como alertas / normalizados
+        if low_stock.loaded:
+            try:
+                ensure_low_stock_loaded(force=True)
+            except Exception:
+                low_stock.invalidate()
+        return jsonify({'actualizados': actualizados}), 200
+
+    # --- Jobs de reportes en segundo plano ---
+    @app.route('/reportes/jobs', methods=['POST'])
+    def reporte_job_create():
+        """Encola un reporte. JSON: reporte, desde, hasta (fechas sólo para compras/ventas/ganancias/kardex/analitica).
+
+        Si el resultado ya está cacheado para la versión actual de los datos se devuelve
+        directamente con 200; si no, 202 con el id del job para consultarlo después.
+        """
+        data = request.get_json() or {}
+        nombre = data.get('reporte')
+        if nombre not in reportes:
+            return jsonify({'error': f"Reporte desconocido. Use uno de: {', '.join(reportes)}"}), 400
+        desde, hasta = data.get('desde'), data.get('hasta')
+        if reportes[nombre][1]:
+            dates, error = validate_dates(desde, hasta)
+            if error: return error
+        else:
+            desde = hasta = None
+        formato = data.get('format', 'json')
+        error = check_payload_format(formato)
+        if error: return error
+        job = report_jobs.submit(nombre, desde, hasta)
+        job['resultado'] = render_report(nombre, job['resultado'], formato)
+        if job['estado'] == 'completado':
+            return payload_response(job, formato)
+        resp = payload_response(job, formato, 202)
+        resp.headers['Location'] = f"/reportes/jobs/{job['id']}"
+        return resp
+
+    @app.route('/reportes/jobs/<job_id>', methods=['GET'])
+    def reporte_job_get(job_id):
+        """Estado de un job. ?wait=N espera hasta N segundos (máx. 30) a que termine (long-polling)."""
+        try:
+            wait = min(max(float(request.args.get('wait', 0)), 0), 30)
+        except ValueError:
+            return jsonify({'error': 'wait inválido'}), 400
+        formato = request.args.get('format', 'json')
+        error = check_payload_format(formato)
+        if error: return error
+        job = report_jobs.get(job_id, wait=wait)
+        if job is None:
+            return jsonify({'error': 'Job no encontrado'}), 404
+        job['resultado'] = render_report(job['reporte'], job['resultado'], formato)
+        return payload_response(job, formato)
+
+    # Perfilado opt-in: sin PROFILE_TOKEN ni PROFILE_SAMPLE_RATE la app no se envuelve (coste cero)
+    profiler = make_request_profiler(app.wsgi_app)
+    if profiler is not None:
+        app.wsgi_app = profiler
+
     return app
 
 # --- Bloque para ejecutar el servidor ---
 if __name__ == '__main__':
     app = create_app()
     port = int(os.getenv('PORT', 5000))
-    print(f"--- Servidor API corriendo en http://127.0.0.1:{port} ---")
-    app.run(host='127.0.0.1', port=port, debug=True)
+    if os.getenv('API_READY_HANDSHAKE') == '1':
+        # Arrancada por la GUI: sin reloader, y aviso por stdout en cuanto el socket escucha
+        serve(app, '127.0.0.1', port, on_listening=lambda: print('API_READY', flush=True))
+    else:
+        print(f"--- Servidor API corriendo en http://127.0.0.1:{port} ---")
+        app.run(host='127.0.0.1', port=port, debug=True)
@@ -0,0 +1,53 @@
+"""Benchmark de la analítica de inventario (analitica.calcular) sobre datos sintéticos.
+
+No necesita base de datos: genera las líneas de venta y los productos en memoria y mide
+sólo el cálculo vectorizado (ABC, rotación, cobertura y reposición):
+
+    python benchmarks/bench_analitica.py --lineas 500000 --productos 5000 --dias 365
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import analitica  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lineas', type=int, default=300000, help='líneas de venta')
+    parser.add_argument('--productos', type=int, default=5000)
+    parser.add_argument('--dias', type=int, default=365, help='días del periodo')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+    if not analitica.disponible():
+        sys.exit('numpy/pandas no están instalados: pip install pandas')
+    np, pd = analitica.np, analitica.pd
+
+    rng = np.random.default_rng(42)
+    ids = np.arange(1, args.productos + 1)
+    productos = pd.DataFrame({'id_producto': ids, 'nombre': [f'Producto {i}' for i in ids],
+                              'stock': rng.integers(0, 500, args.productos), 'stock_minimo': 0,
+                              'precio_compra': rng.uniform(1, 100, args.productos).round(2)})
+    # Demanda sesgada (pocos productos concentran la mayoría de las ventas, como en la práctica)
+    elegidos = np.minimum(rng.zipf(1.3, args.lineas), args.productos)
+    fechas = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, args.dias, args.lineas), unit='D')
+    precio = productos['precio_compra'].to_numpy()[elegidos - 1]
+    lineas = pd.DataFrame({'id_producto': elegidos, 'fecha_venta': fechas.date,
+                           'cantidad': rng.integers(1, 10, args.lineas),
+                           'precio_unitario': (precio * 1.3).round(2), 'costo_unitario': precio})
+
+    tiempos = []
+    for _ in range(args.repeticiones):
+        t0 = time.perf_counter()
+        tabla = analitica.a_tabla(analitica.calcular(lineas, productos, args.dias))
+        tiempos.append(time.perf_counter() - t0)
+    clases = pd.Series([fila[2] for fila in tabla['rows']]).value_counts().to_dict()
+    print(f'{args.lineas} líneas, {args.productos} productos, {args.dias} días; clases {clases}')
+    print(f'mejor {min(tiempos) * 1000:.0f} ms, peor {max(tiempos) * 1000:.0f} ms ({args.repeticiones} repeticiones)')
+
+
+if __name__ == '__main__':
+    main()
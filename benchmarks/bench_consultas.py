@@ -0,0 +1,88 @@
+"""Benchmark de lecturas por PK: SQL de texto en cada petición vs. sentencia preparada reutilizada.
+
+Usa la misma configuración que la API (.env / DB_HOST, DB_USER, DB_PASSWORD, DB_NAME):
+
+    python benchmarks/bench_consultas.py --n 5000
+    python benchmarks/bench_consultas.py --consulta cliente_por_id --id 3
+
+Los cursores preparados requieren el driver `mariadb`; con pymysql sólo se mide el modo texto.
+Con DB_BACKEND=sqlite (y DB_SQLITE_PATH) se mide el backend SQLite embebido, sin servidor.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app_compacto  # noqa: E402
+
+
+def bench(label, run_once, n):
+    """Ejecuta `run_once` n veces y retorna (label, ops/s, p50 µs, p99 µs)."""
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        run_once()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    total = sum(samples)
+    return label, n / total, statistics.median(samples) * 1e6, samples[int(0.99 * (len(samples) - 1))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=5000, help='consultas por modo')
+    parser.add_argument('--consulta', default='producto_por_id', choices=sorted(k for k, v in app_compacto.QUERY_REGISTRY.items() if v.startswith('SELECT') and 'FOR UPDATE' not in v))
+    parser.add_argument('--id', type=int, default=None, help='PK a consultar (por defecto la primera de la tabla)')
+    args = parser.parse_args()
+
+    sql = app_compacto.QUERY_REGISTRY[args.consulta]
+    pool = app_compacto.ConnectionPool(app_compacto.create_connection, max_size=1)
+    conn = pool.acquire()
+    if args.id is None:
+        table = sql.split(' FROM ')[1].split()[0]
+        pk = sql.split(' WHERE ')[1].split()[0]
+        cur = conn.cursor()
+        cur.execute(f'SELECT {pk} FROM {table} ORDER BY {pk} LIMIT 1')
+        row = cur.fetchone()
+        cur.close()
+        if row is None:
+            sys.exit(f'La tabla {table} está vacía: indica --id')
+        args.id = row[0]
+
+    def texto():
+        # Lo que hacía cada endpoint: cursor nuevo y SQL de texto que el servidor vuelve a parsear
+        cur = conn.cursor()
+        cur.execute(sql, (args.id,))
+        cur.fetchone()
+        cur.close()
+
+    def preparada():
+        cur = app_compacto.execute_registered(conn, args.consulta, (args.id,))
+        cur.fetchone()
+        cur.close()
+
+    modes = [('texto', texto)]
+    if pool.prepared:
+        modes.append(('preparada', preparada))
+    else:
+        print('Driver sin cursores preparados (pymysql o sqlite): sólo se mide el modo texto. Instala `mariadb` para comparar.')
+
+    # Calentamiento: conexión, caché de la tabla y preparación de la sentencia
+    for _, fn in modes:
+        for _ in range(min(200, args.n)):
+            fn()
+
+    backend = 'sqlite' if app_compacto.db_backend() == 'sqlite' else app_compacto.mariadb_driver.__name__
+    print(f'{args.consulta} (id={args.id}), {args.n} consultas por modo, driver {backend}')
+    print(f"{'modo':<10} {'ops/s':>10} {'p50 µs':>10} {'p99 µs':>10}")
+    for label, fn in modes:
+        _, ops, p50, p99 = bench(label, fn, args.n)
+        print(f'{label:<10} {ops:>10.0f} {p50:>10.1f} {p99:>10.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -46,7 +46,7 @@ CREATE TABLE `Compras` (
   `fecha_compra` date NOT NULL,
   `total` decimal(10,2) NOT NULL,
   PRIMARY KEY (`id_compra`),
-  KEY `fk_proveedor_compra` (`id_proveedor`),
+  KEY `idx_compras_proveedor_fecha` (`id_proveedor`,`fecha_compra`,`total`),
   CONSTRAINT `fk_proveedor_compra` FOREIGN KEY (`id_proveedor`) REFERENCES `Proveedores` (`id_proveedor`) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -82,15 +82,83 @@ DROP TABLE IF EXISTS `Detalle_Ventas`;
 CREATE TABLE `Detalle_Ventas` (
   `id_detalle` int(11) NOT NULL AUTO_INCREMENT,
   `id_venta` int(11) DEFAULT NULL,
+  `fecha_venta` date NOT NULL,
   `id_producto` int(11) DEFAULT NULL,
   `cantidad` int(11) NOT NULL,
   `precio_unitario` decimal(10,2) NOT NULL,
-  PRIMARY KEY (`id_detalle`),
+  `costo_unitario` decimal(10,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`id_detalle`,`fecha_venta`),
   KEY `fk_venta` (`id_venta`),
   KEY `fk_producto` (`id_producto`),
-  CONSTRAINT `fk_producto` FOREIGN KEY (`id_producto`) REFERENCES `Productos` (`id_producto`),
-  CONSTRAINT `fk_venta` FOREIGN KEY (`id_venta`) REFERENCES `Ventas` (`id_venta`) ON DELETE CASCADE
-) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+  KEY `idx_detalle_ganancias` (`fecha_venta`,`id_producto`,`cantidad`,`precio_unitario`,`costo_unitario`)
+) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+ PARTITION BY RANGE  COLUMNS(`fecha_venta`)
+(PARTITION p_antiguo VALUES LESS THAN ('2025-01-01'),
+PARTITION p202501 VALUES LESS THAN ('2025-02-01'),
+PARTITION p202502 VALUES LESS THAN ('2025-03-01'),
+PARTITION p202503 VALUES LESS THAN ('2025-04-01'),
+PARTITION p202504 VALUES LESS THAN ('2025-05-01'),
+PARTITION p202505 VALUES LESS THAN ('2025-06-01'),
+PARTITION p202506 VALUES LESS THAN ('2025-07-01'),
+PARTITION p202507 VALUES LESS THAN ('2025-08-01'),
+PARTITION p202508 VALUES LESS THAN ('2025-09-01'),
+PARTITION p202509 VALUES LESS THAN ('2025-10-01'),
+PARTITION p202510 VALUES LESS THAN ('2025-11-01'),
+PARTITION p202511 VALUES LESS THAN ('2025-12-01'),
+PARTITION p202512 VALUES LESS THAN ('2026-01-01'),
+PARTITION p202601 VALUES LESS THAN ('2026-02-01'),
+PARTITION p202602 VALUES LESS THAN ('2026-03-01'),
+PARTITION p202603 VALUES LESS THAN ('2026-04-01'),
+PARTITION p202604 VALUES LESS THAN ('2026-05-01'),
+PARTITION p202605 VALUES LESS THAN ('2026-06-01'),
+PARTITION p202606 VALUES LESS THAN ('2026-07-01'),
+PARTITION p202607 VALUES LESS THAN ('2026-08-01'),
+PARTITION p202608 VALUES LESS THAN ('2026-09-01'),
+PARTITION p202609 VALUES LESS THAN ('2026-10-01'),
+PARTITION p202610 VALUES LESS THAN ('2026-11-01'),
+PARTITION p202611 VALUES LESS THAN ('2026-12-01'),
+PARTITION p202612 VALUES LESS THAN ('2027-01-01'),
+PARTITION p_futuro VALUES LESS THAN (MAXVALUE));
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Detalle_Ventas_Archivo`
+--
+
+DROP TABLE IF EXISTS `Detalle_Ventas_Archivo`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Detalle_Ventas_Archivo` (
+  `id_detalle` int(11) NOT NULL,
+  `id_venta` int(11) DEFAULT NULL,
+  `fecha_venta` date NOT NULL,
+  `id_producto` int(11) DEFAULT NULL,
+  `cantidad` int(11) NOT NULL,
+  `precio_unitario` decimal(10,2) NOT NULL,
+  `costo_unitario` decimal(10,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`id_detalle`,`fecha_venta`),
+  KEY `idx_detalle_archivo_ganancias` (`fecha_venta`,`id_producto`,`cantidad`,`precio_unitario`,`costo_unitario`),
+  KEY `idx_detalle_archivo_producto` (`id_producto`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Movimientos_Stock`
+--
+
+DROP TABLE IF EXISTS `Movimientos_Stock`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Movimientos_Stock` (
+  `id_movimiento` int(11) NOT NULL AUTO_INCREMENT,
+  `id_producto` int(11) NOT NULL,
+  `fecha` datetime NOT NULL,
+  `tipo` enum('venta','compra','ajuste') NOT NULL,
+  `cantidad` int(11) NOT NULL,
+  `referencia` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id_movimiento`),
+  KEY `idx_movimientos_producto` (`id_producto`,`id_movimiento`,`fecha`,`cantidad`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
 --
@@ -103,6 +171,7 @@ DROP TABLE IF EXISTS `Productos`;
 CREATE TABLE `Productos` (
   `id_producto` int(11) NOT NULL AUTO_INCREMENT,
   `nombre` varchar(100) NOT NULL,
+  `codigo` varchar(64) DEFAULT NULL,
   `descripcion` text DEFAULT NULL,
   `precio_compra` decimal(10,2) NOT NULL,
   `porcentaje_ganancia` decimal(5,2) NOT NULL,
@@ -111,11 +180,30 @@ CREATE TABLE `Productos` (
   `stock_minimo` int(11) NOT NULL,
   `id_proveedor` int(11) DEFAULT NULL,
   PRIMARY KEY (`id_producto`),
+  UNIQUE KEY `uq_productos_codigo` (`codigo`),
   KEY `fk_proveedor` (`id_proveedor`),
   CONSTRAINT `fk_proveedor` FOREIGN KEY (`id_proveedor`) REFERENCES `Proveedores` (`id_proveedor`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=67 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `Pronosticos_Demanda`
+--
+
+DROP TABLE IF EXISTS `Pronosticos_Demanda`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Pronosticos_Demanda` (
+  `id_producto` int(11) NOT NULL,
+  `fecha_calculo` datetime NOT NULL,
+  `demanda_diaria` decimal(12,4) NOT NULL,
+  `desviacion` decimal(12,4) NOT NULL,
+  `stock_minimo_sugerido` int(11) NOT NULL,
+  PRIMARY KEY (`id_producto`),
+  CONSTRAINT `fk_pronostico_producto` FOREIGN KEY (`id_producto`) REFERENCES `Productos` (`id_producto`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `Proveedores`
 --
@@ -133,6 +221,22 @@ CREATE TABLE `Proveedores` (
 ) ENGINE=InnoDB AUTO_INCREMENT=43 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `Snapshots_Stock`
+--
+
+DROP TABLE IF EXISTS `Snapshots_Stock`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Snapshots_Stock` (
+  `id_producto` int(11) NOT NULL,
+  `fecha` datetime NOT NULL,
+  `stock` int(11) NOT NULL,
+  `id_movimiento` int(11) NOT NULL,
+  PRIMARY KEY (`id_producto`,`fecha`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `Usuarios`
 --
@@ -149,6 +253,35 @@ CREATE TABLE `Usuarios` (
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `Valoracion_Inventario`
+--
+
+DROP TABLE IF EXISTS `Valoracion_Inventario`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Valoracion_Inventario` (
+  `id_proveedor` int(11) NOT NULL,
+  `unidades` int(11) NOT NULL DEFAULT 0,
+  `valor` decimal(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`id_proveedor`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Version_Datos`
+--
+
+DROP TABLE IF EXISTS `Version_Datos`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Version_Datos` (
+  `id` tinyint(4) NOT NULL,
+  `version` bigint(20) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `Ventas`
 --
@@ -161,10 +294,88 @@ CREATE TABLE `Ventas` (
   `fecha_venta` date NOT NULL,
   `id_cliente` int(11) DEFAULT NULL,
   `total` decimal(10,2) NOT NULL,
-  PRIMARY KEY (`id_venta`),
-  KEY `fk_cliente` (`id_cliente`),
-  CONSTRAINT `fk_cliente` FOREIGN KEY (`id_cliente`) REFERENCES `Clientes` (`id_cliente`) ON DELETE SET NULL
-) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+  PRIMARY KEY (`id_venta`,`fecha_venta`),
+  KEY `idx_ventas_cliente_fecha` (`id_cliente`,`fecha_venta`,`total`),
+  KEY `idx_ventas_fecha` (`fecha_venta`)
+) ENGINE=InnoDB AUTO_INCREMENT=3 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+ PARTITION BY RANGE  COLUMNS(`fecha_venta`)
+(PARTITION p_antiguo VALUES LESS THAN ('2025-01-01'),
+PARTITION p202501 VALUES LESS THAN ('2025-02-01'),
+PARTITION p202502 VALUES LESS THAN ('2025-03-01'),
+PARTITION p202503 VALUES LESS THAN ('2025-04-01'),
+PARTITION p202504 VALUES LESS THAN ('2025-05-01'),
+PARTITION p202505 VALUES LESS THAN ('2025-06-01'),
+PARTITION p202506 VALUES LESS THAN ('2025-07-01'),
+PARTITION p202507 VALUES LESS THAN ('2025-08-01'),
+PARTITION p202508 VALUES LESS THAN ('2025-09-01'),
+PARTITION p202509 VALUES LESS THAN ('2025-10-01'),
+PARTITION p202510 VALUES LESS THAN ('2025-11-01'),
+PARTITION p202511 VALUES LESS THAN ('2025-12-01'),
+PARTITION p202512 VALUES LESS THAN ('2026-01-01'),
+PARTITION p202601 VALUES LESS THAN ('2026-02-01'),
+PARTITION p202602 VALUES LESS THAN ('2026-03-01'),
+PARTITION p202603 VALUES LESS THAN ('2026-04-01'),
+PARTITION p202604 VALUES LESS THAN ('2026-05-01'),
+PARTITION p202605 VALUES LESS THAN ('2026-06-01'),
+PARTITION p202606 VALUES LESS THAN ('2026-07-01'),
+PARTITION p202607 VALUES LESS THAN ('2026-08-01'),
+PARTITION p202608 VALUES LESS THAN ('2026-09-01'),
+PARTITION p202609 VALUES LESS THAN ('2026-10-01'),
+PARTITION p202610 VALUES LESS THAN ('2026-11-01'),
+PARTITION p202611 VALUES LESS THAN ('2026-12-01'),
+PARTITION p202612 VALUES LESS THAN ('2027-01-01'),
+PARTITION p_futuro VALUES LESS THAN (MAXVALUE));
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Ventas_Claves`
+--
+
+DROP TABLE IF EXISTS `Ventas_Claves`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Ventas_Claves` (
+  `clave` varchar(64) NOT NULL,
+  `id_venta` int(11) NOT NULL,
+  `creada` datetime NOT NULL,
+  PRIMARY KEY (`clave`),
+  KEY `idx_ventas_claves_creada` (`creada`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Ventas_Por_Hora`
+--
+
+DROP TABLE IF EXISTS `Ventas_Por_Hora`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Ventas_Por_Hora` (
+  `fecha` date NOT NULL,
+  `hora` tinyint(4) NOT NULL,
+  `id_producto` int(11) NOT NULL,
+  `unidades` int(11) NOT NULL DEFAULT 0,
+  `importe` decimal(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`fecha`,`hora`,`id_producto`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `Ventas_Archivo`
+--
+
+DROP TABLE IF EXISTS `Ventas_Archivo`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `Ventas_Archivo` (
+  `id_venta` int(11) NOT NULL,
+  `fecha_venta` date NOT NULL,
+  `id_cliente` int(11) DEFAULT NULL,
+  `total` decimal(10,2) NOT NULL,
+  PRIMARY KEY (`id_venta`,`fecha_venta`),
+  KEY `idx_ventas_archivo_cliente_fecha` (`id_cliente`,`fecha_venta`,`total`),
+  KEY `idx_ventas_archivo_fecha` (`fecha_venta`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
@@ -1,111 +1,615 @@
+import time
+# Marca de inicio para medir el tiempo de arranque (ver StartupTimer)
+_STARTUP_T0 = time.perf_counter()
 import os
+import json
 import customtkinter as ctk
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError
 import subprocess
 import threading
-import time
+import queue
 import sys
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import filedialog
 from tkinter import ttk
 from tkinter import simpledialog
-try:
-    import pandas as pd
-    HAS_PANDAS = True
-except Exception:
-    pd = None
-    HAS_PANDAS = False
 
 # Usar API_URL del entorno, o default
 API_URL = os.getenv('API_URL', 'http://127.0.0.1:5000')
 
+# pandas se importa sólo la primera vez que se necesita (exportación local): importarlo
+# al arrancar añade más de un segundo al inicio de la app empaquetada.
+_pandas = None
+
+
+def load_pandas():
+    """Importa pandas bajo demanda. Retorna el módulo o None si no está instalado."""
+    global _pandas
+    if _pandas is None:
+        try:
+            import pandas
+            _pandas = pandas
+        except Exception:
+            _pandas = False
+    return _pandas or None
+
+
+class StartupTimer:
+    """Mide el arranque de la GUI (imports, login visible, API lista).
+
+    Se activa con `--medir-arranque` o GUI_STARTUP_TIMING=1. Las marcas se imprimen y, si
+    GUI_STARTUP_LOG apunta a un archivo, se añaden como una línea JSON para seguir la
+    evolución del arranque en frío del ejecutable generado con gui.spec. Con
+    `--medir-arranque` la app se cierra sola en cuanto el login está visible y la API lista.
+    """
+
+    def __init__(self):
+        self.exit_when_ready = '--medir-arranque' in sys.argv
+        self.enabled = self.exit_when_ready or os.getenv('GUI_STARTUP_TIMING') == '1'
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.marks:
+                self.marks[name] = round((time.perf_counter() - _STARTUP_T0) * 1000, 1)
+                print(f"[arranque] {name}: {self.marks[name]} ms")
+
+    def done(self):
+        """True cuando ya se midieron el login visible y la API lista."""
+        return 'login_visible' in self.marks and ('api_lista' in self.marks or 'api_error' in self.marks)
+
+    def report(self):
+        if not self.enabled:
+            return
+        path = os.getenv('GUI_STARTUP_LOG')
+        if path:
+            try:
+                with open(path, 'a', encoding='utf-8') as fh:
+                    fh.write(json.dumps({'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'), 'frozen': bool(getattr(sys, 'frozen', False)), **self.marks}) + '\n')
+            except Exception as e:
+                print(f"No se pudo escribir {path}: {e}")
+
+
+STARTUP = StartupTimer()
 
-def make_session(retries: int = 3, backoff_factor: float = 0.5, status_forcelist=(429, 500, 502, 503, 504)):
-    """Crear una requests.Session con reintentos."""
-    session = requests.Session()
-    retry = Retry(
+
+def _env_timeout(name, default):
+    """Lee un timeout (connect, read) de la variable GUI_TIMEOUT_<NAME> con formato "3,6"."""
+    value = os.getenv(f'GUI_TIMEOUT_{name.upper()}')
+    if not value:
+        return default
+    try:
+        connect, read = (float(v) for v in value.split(','))
+        return (connect, read)
+    except ValueError:
+        return default
+
+
+# Timeouts (connect, read) por clase de endpoint: conectar siempre es rápido en local; lo que
+# varía es cuánto puede tardar el servidor en responder.
+TIMEOUTS = {
+    'salud': _env_timeout('salud', (1, 2)),
+    'crud': _env_timeout('crud', (2, 6)),
+    'reporte': _env_timeout('reporte', (2, 30)),
+    'exportacion': _env_timeout('exportacion', (5, 300)),
+    'stream': _env_timeout('stream', (3, 60)),
+}
+
+
+def endpoint_class(url, stream=False):
+    """Clase de endpoint ('salud', 'crud', 'reporte', 'exportacion', 'stream') según la ruta."""
+    path = urlsplit(url).path
+    if path in ('/health', '/ready'):
+        return 'salud'
+    if path.endswith('/stream'):
+        return 'stream'
+    if path.startswith('/reportes'):
+        return 'exportacion' if stream else 'reporte'
+    return 'crud'
+
+
+class RetryBudget:
+    """Presupuesto de reintentos compartido por la sesión.
+
+    En la ventana de `window` segundos se permiten como máximo `ratio` reintentos por
+    petición (con un mínimo de `min_per_sec` por segundo). Si el servidor está saturado
+    los reintentos se cortan en lugar de multiplicar la carga.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_sec: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+        self.rejected = 0
+
+    def _trim(self, now):
+        for q in (self._requests, self._retries):
+            while q and now - q[0] > self.window:
+                q.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_retry(self) -> bool:
+        """Consume un reintento del presupuesto; False si ya no quedan."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= self._allowed():
+                self.rejected += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def _allowed(self):
+        return max(self.min_per_sec * self.window, self.ratio * len(self._requests))
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {'peticiones': len(self._requests), 'reintentos': len(self._retries),
+                    'disponibles': max(0, int(self._allowed()) - len(self._retries)), 'rechazados': self.rejected}
+
+
+class BudgetedRetry(Retry):
+    """Retry de urllib3 que sólo reintenta si el RetryBudget de la sesión lo permite."""
+
+    def __init__(self, *args, budget=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.budget = self.budget
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        redirect = response is not None and response.get_redirect_location()
+        if self.budget is not None and not redirect and not self.budget.try_retry():
+            raise MaxRetryError(_pool, url, error or ResponseError('presupuesto de reintentos agotado'))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class LatencyStats:
+    """Latencias de las peticiones por clase de endpoint (últimas `size` muestras)."""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, clase, elapsed, ok=True):
+        with self._lock:
+            self._samples.setdefault(clase, deque(maxlen=self.size)).append(elapsed)
+            total, errors = self._counts.get(clase, (0, 0))
+            self._counts[clase] = (total + 1, errors + (0 if ok else 1))
+
+    def snapshot(self) -> dict:
+        """{clase: {'peticiones', 'errores', 'p50_ms', 'p95_ms', 'max_ms'}}"""
+        with self._lock:
+            result = {}
+            for clase, samples in self._samples.items():
+                ordered = sorted(samples)
+                def pct(p):
+                    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+                total, errors = self._counts[clase]
+                result[clase] = {'peticiones': total, 'errores': errors, 'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'max_ms': round(ordered[-1] * 1000, 1)}
+            return result
+
+
+class ApiSession(requests.Session):
+    """Sesión de la GUI: timeout por clase de endpoint, presupuesto de reintentos y métricas de latencia."""
+
+    def __init__(self, budget=None, stats=None):
+        super().__init__()
+        self.budget = budget
+        self.stats = stats or LatencyStats()
+        self.pool_size = None
+        self.keep_alive = True
+
+    def request(self, method, url, *args, **kwargs):
+        clase = endpoint_class(url, kwargs.get('stream', False))
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = TIMEOUTS[clase]
+        if self.budget is not None:
+            self.budget.record_request()
+        t0 = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.stats.record(clase, time.perf_counter() - t0, ok=False)
+            raise
+        self.stats.record(clase, time.perf_counter() - t0, ok=response.status_code < 500)
+        return response
+
+
+def make_session(retries: int = 3, backoff_factor: float = 0.5, status_forcelist=(429, 500, 502, 503, 504),
+                 pool_size: int = None, keep_alive: bool = None, budget: RetryBudget = None):
+    """Crear la sesión HTTP de la GUI con reintentos acotados por un presupuesto.
+
+    pool_size: conexiones persistentes por host (GUI_HTTP_POOL; por defecto el doble de GUI_WORKERS).
+    keep_alive: reutilizar conexiones (GUI_HTTP_KEEPALIVE=0 lo desactiva).
+    """
+    if pool_size is None:
+        pool_size = int(os.getenv('GUI_HTTP_POOL', 2 * int(os.getenv('GUI_WORKERS', 4))))
+    if keep_alive is None:
+        keep_alive = os.getenv('GUI_HTTP_KEEPALIVE', '1') != '0'
+    if budget is None:
+        budget = RetryBudget(ratio=float(os.getenv('GUI_RETRY_RATIO', 0.2)))
+    session = ApiSession(budget=budget)
+    retry = BudgetedRetry(
         total=retries,
         read=retries,
         connect=retries,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
-        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'])
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS']),
+        budget=budget,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    # Una sola API: basta un pool (host) con `pool_size` conexiones reutilizables
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    session.pool_size = pool_size
+    session.keep_alive = keep_alive
     return session
 
 
-# Sesión global usada por la GUI
 SESSION = make_session()
 
 
-def ensure_api_running(timeout=5):
-    """Asegura que la API esté corriendo; si no, la arranca."""
-    global API_URL
-    def is_up(url):
-        try:
-            r = SESSION.get(f"{url}/health", timeout=2)
-            return r.status_code == 200
-        except Exception:
-            return False
+def idempotency_headers(key=None):
+    """Cabeceras con una Idempotency-Key para POST de creación.
 
-    if is_up(API_URL):
-        return None
+    La sesión reintenta POST ante 5xx; con la misma clave la API devuelve la respuesta
+    original en lugar de crear (y descontar stock) dos veces.
+    """
+    return {'Idempotency-Key': key or uuid.uuid4().hex}
 
-    # Intentar arrancar la API en puerto 5000 (usando el app_compacto.py)
-    target = f"http://127.0.0.1:5000"
-    env = os.environ.copy()
-    env['PORT'] = '5000'
-    p = None
-    try:
-        # Asume que el servidor se llama 'app_compacto.py'
-        p = subprocess.Popen([sys.executable, "app_compacto.py"], cwd='.', env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-    except Exception as e:
-        print(f"No se pudo iniciar app_compacto.py: {e}")
 
-    start = time.time()
-    while time.time() - start < timeout:
-        if is_up(target):
-            API_URL = target
-            return p # Retorna el proceso para que pueda ser terminado al salir
-        time.sleep(0.25)
+class RequestExecutor:
+    """Pool acotado de hilos para las peticiones de la GUI.
 
-    if p:
-        p.terminate()
+    - `submit(fn, key=...)`: si ya hay una petición en curso con la misma clave (p.ej. el mismo
+      GET), se reutiliza su resultado en lugar de lanzar otra.
+    - Los callbacks se ejecutan en el hilo de Tk a través de una única cola (`start_pump`).
+    - `cancel(canal)` descarta los resultados pendientes de un canal (p.ej. la tabla al
+      cambiar de módulo), así una respuesta vieja nunca pisa la vista actual.
+    """
 
-    # Si falla, preguntar al usuario
-    answer = simpledialog.askstring("Configurar API", "No se pudo iniciar la API. Introduce la URL (ej: http://127.0.0.1:5000):", initialvalue=API_URL)
-    if answer and is_up(answer):
-    
-        # En algunos entornos `wait_window` no mantiene el bucle de eventos
-        # y los callbacks `after` desde hilos fallan con "main thread is not in main loop".
-        # Usamos un pequeño loop que procesa eventos en el hilo principal hasta que
-        # la ventana de login se cierre. Esto permite que `self.after(...)` funcione
-        # correctamente desde hilos worker.
-        try:
-            import time as _time
+    def __init__(self, max_workers=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or int(os.getenv('GUI_WORKERS', 4)), thread_name_prefix='gui-api')
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._generations = {}
+        self._ui_queue = queue.SimpleQueue()
+
+    def submit(self, fn, *args, key=None, channel=None, on_done=None, on_error=None):
+        """Ejecuta fn(*args) en el pool; on_done(resultado) u on_error(excepción) corren en el hilo de Tk.
+
+        key: sólo para lecturas (GET); las peticiones iguales en curso comparten el resultado.
+        channel: los callbacks se descartan si se llama a cancel(channel) antes de entregarlos.
+        """
+        with self._lock:
+            generation = self._generations.get(channel, 0)
+            future = self._inflight.get(key) if key is not None else None
+            if future is None:
+                future = self._pool.submit(fn, *args)
+                if key is not None:
+                    self._inflight[key] = future
+                    future.add_done_callback(lambda f, k=key: self._forget(k, f))
+        future.add_done_callback(lambda f: self._ui_queue.put(lambda: self._deliver(f, channel, generation, on_done, on_error)))
+        return future
+
+    def cancel(self, channel):
+        """Invalida los resultados aún no entregados de `channel`."""
+        with self._lock:
+            self._generations[channel] = self._generations.get(channel, 0) + 1
+
+    def call_soon(self, fn):
+        """Encola fn para ejecutarla en el hilo de Tk (seguro desde cualquier hilo)."""
+        self._ui_queue.put(fn)
+
+    def start_pump(self, widget, interval=50):
+        """Procesa la cola de callbacks en el loop de Tk de `widget` mientras exista."""
+        def pump():
             while True:
-                if not login_window.winfo_exists():
+                try:
+                    fn = self._ui_queue.get_nowait()
+                except queue.Empty:
                     break
-                root.update()
-                _time.sleep(0.05)
-        except Exception:
-            # En caso de que update falle, intentar fallback a wait_window
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Error ejecutando callback de la GUI: {e}")
             try:
-                root.wait_window(login_window)
+                if widget.winfo_exists():
+                    widget.after(interval, pump)
             except Exception:
                 pass
-        return None
+        widget.after(interval, pump)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _deliver(self, future, channel, generation, on_done, on_error):
+        if future.cancelled() or self._generations.get(channel, 0) != generation:
+            return
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                print(f"Error en petición de la GUI: {error}")
+        elif on_done:
+            on_done(future.result())
 
+
+# Pool compartido por todas las ventanas de la GUI
+GUI_EXECUTOR = RequestExecutor()
+
+
+def _health_ok(url, timeout=2):
+    try:
+        r = SESSION.get(f"{url}/health", timeout=timeout)
+        return r.status_code == 200
+    except Exception:
+        return False
+
+
+def check_api_ready(url, timeout=2):
+    """Consulta /ready. Retorna (responde, error_db).
+
+    `responde` indica si la API contesta; `error_db` describe el problema si la API está
+    arriba pero sin base de datos. Con una API sin /ready se recurre a /health.
+    """
+    try:
+        r = SESSION.get(f"{url}/ready", timeout=timeout)
+    except Exception:
+        return False, None
+    if r.status_code == 200:
+        return True, None
+    if r.status_code == 503:
+        try:
+            detail = r.json().get('error')
+        except ValueError:
+            detail = r.text
+        return True, f"La API no puede acceder a la base de datos: {detail}"
+    return _health_ok(url, timeout), None
+
+
+class ApiBootstrap:
+    """Comprueba la API y, si no responde, arranca app_compacto.py, todo en un hilo de fondo.
+
+    Permite mostrar el login mientras la API arranca; quien necesite la API espera con
+    wait(). Al lanzar app_compacto.py se espera su aviso 'API_READY' por stdout (el
+    socket ya escucha) en lugar de sondear /health, y después se consulta /ready una vez
+    para saber si la base de datos responde. launcher.py, que levanta la API en su propio
+    proceso, entrega el resultado directamente con signal_ready().
+    """
+
+    def __init__(self, timeout=10, spawn=True):
+        self.timeout = timeout
+        self.spawn = spawn
+        self.proc = None
+        self.error = None
+        self.db_error = None
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def signal_ready(self, error=None, db_error=None):
+        """Marca el arranque como terminado sin sondear (handoff desde launcher.py)."""
+        with self._lock:
+            self._started = True
+        self.error = error
+        self.db_error = db_error
+        STARTUP.mark('api_error' if error else 'api_lista')
+        self._ready.set()
+
+    def wait(self, timeout=None):
+        """Espera a que termine el arranque. Retorna True si la API responde."""
+        self.start()
+        self._ready.wait(timeout)
+        return self._ready.is_set() and self.error is None
+
+    @property
+    def finished(self):
+        return self._ready.is_set()
+
+    def _run(self):
+        global API_URL
+        try:
+            up, self.db_error = check_api_ready(API_URL, timeout=1)
+            if up:
+                return
+            if not self.spawn:
+                self._poll(API_URL)
+                return
+            # Intentar arrancar la API en puerto 5000 (usando el app_compacto.py)
+            target = "http://127.0.0.1:5000"
+            if self._spawn_and_wait():
+                up, self.db_error = check_api_ready(target, timeout=2)
+                if up:
+                    API_URL = target
+                    return
+            if self.proc:
+                self.proc.terminate()
+                self.proc = None
+            if not self.error:
+                self.error = f"La API no respondió en {target}"
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            STARTUP.mark('api_error' if self.error else 'api_lista')
+            self._ready.set()
+
+    def _spawn_and_wait(self):
+        """Lanza app_compacto.py y espera su línea 'API_READY'. Retorna True si llegó a tiempo."""
+        import collections
+        env = os.environ.copy()
+        env['PORT'] = '5000'
+        env['API_READY_HANDSHAKE'] = '1'
+        try:
+            # Asume que el servidor se llama 'app_compacto.py'
+            self.proc = subprocess.Popen([sys.executable, "app_compacto.py"], cwd='.', env=env,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        except Exception as e:
+            self.error = f"No se pudo iniciar app_compacto.py: {e}"
+            return False
+
+        listening = threading.Event()
+        tail = collections.deque(maxlen=20)
+
+        def drain(pipe):
+            # Leer siempre la salida: si el pipe se llena, el servidor se bloquearía
+            for line in pipe:
+                if line.strip() == 'API_READY':
+                    listening.set()
+                else:
+                    tail.append(line.rstrip())
+            listening.set()  # EOF: el proceso terminó
+
+        threading.Thread(target=drain, args=(self.proc.stdout,), daemon=True).start()
+        listening.wait(self.timeout)
+        if self.proc.poll() is not None:
+            self.error = "app_compacto.py terminó al arrancar: " + (' | '.join(tail) or f"código {self.proc.returncode}")
+            return False
+        return listening.is_set()
+
+    def _poll(self, url):
+        # Sondeo con espera creciente (sólo cuando no se puede recibir una señal de listo)
+        start = time.time()
+        delay = 0.05
+        while time.time() - start < self.timeout:
+            up, self.db_error = check_api_ready(url, timeout=1)
+            if up:
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        self.error = f"La API no respondió en {url}"
+
+
+# Arranque de la API compartido por la ventana de login y la ventana principal
+API_BOOTSTRAP = ApiBootstrap()
+
+
+def ask_api_url():
+    """Pide al usuario la URL de la API cuando no se pudo arrancar (hilo principal)."""
+    global API_URL
+    answer = simpledialog.askstring("Configurar API", "No se pudo iniciar la API. Introduce la URL (ej: http://127.0.0.1:5000):", initialvalue=API_URL)
+    if answer and _health_ok(answer.rstrip('/')):
+        API_URL = answer.rstrip('/')
+        API_BOOTSTRAP.error = None
+        return True
+    return False
+
+
+def ensure_api_running(timeout=5):
+    """Asegura que la API esté corriendo; si no, la arranca. Bloquea hasta saberlo.
+
+    Debe llamarse desde el hilo principal (puede mostrar diálogos). Retorna el proceso
+    lanzado (o None) para que pueda terminarse al salir.
+    """
+    API_BOOTSTRAP.timeout = timeout
+    if API_BOOTSTRAP.wait(timeout + 5) or ask_api_url():
+        return API_BOOTSTRAP.proc
+    exit_api_unreachable()
+
+
+def exit_api_unreachable(cleanup=None):
+    """Sin API la aplicación no puede continuar: avisa y termina el proceso (hilo principal)."""
     messagebox.showerror("Error", "No se pudo conectar a la API. La aplicación se cerrará.")
+    if cleanup is not None:
+        cleanup()
     sys.exit(1)
 
 
+def iter_sse_events(response):
+    """Itera (evento, datos) de una respuesta Server-Sent Events abierta con stream=True."""
+    event, data_lines = 'message', []
+    for raw in response.iter_lines(decode_unicode=True):
+        if raw is None:
+            continue
+        if raw == '':
+            if data_lines:
+                yield event, '\n'.join(data_lines)
+            event, data_lines = 'message', []
+        elif raw.startswith(':'):
+            continue  # comentario / keep-alive
+        elif raw.startswith('event:'):
+            event = raw[6:].strip()
+        elif raw.startswith('data:'):
+            data_lines.append(raw[5:].lstrip())
+
+
+def fetch_report(nombre, params, poll_wait=5, max_wait=900, fmt='columnar'):
+    """Obtiene un reporte a través de la API de jobs: lo encola y espera el resultado con long-polling.
+
+    Evita el timeout de una única petición larga en reportes de varios años.
+    Por defecto pide el formato columnar ({'columns': [...], 'rows': [[...]]}).
+    Retorna (status, data, text) como si fuera la respuesta HTTP del reporte.
+    """
+    r = SESSION.post(f"{API_URL}/reportes/jobs", json={'reporte': nombre, 'format': fmt, **params})
+    if r.status_code not in (200, 202):
+        return r.status_code, None, r.text
+    job = r.json()
+    deadline = time.time() + max_wait
+    while job.get('estado') in ('pendiente', 'en_proceso') and time.time() < deadline:
+        r = SESSION.get(f"{API_URL}/reportes/jobs/{job['id']}", params={'wait': poll_wait, 'format': fmt},
+                        timeout=(TIMEOUTS['reporte'][0], poll_wait + TIMEOUTS['reporte'][1]))
+        if r.status_code != 200:
+            return r.status_code, None, r.text
+        job = r.json()
+    if job.get('estado') == 'completado':
+        return 200, job.get('resultado'), ''
+    if job.get('estado') == 'error':
+        return 500, None, job.get('error') or 'Error desconocido'
+    return 504, None, 'El reporte no terminó a tiempo'
+
+
+def table_rows(table, columns):
+    """Filas de una tabla columnar reordenadas según `columns` (sin construir un dict por fila)."""
+    if not table:
+        return []
+    positions = {c: i for i, c in enumerate(table.get('columns', []))}
+    idx = [positions.get(c) for c in columns]
+    return [[row[i] if i is not None else None for i in idx] for row in table.get('rows', [])]
+
+
 def api_is_up(url, timeout=2):
     """Comprobar si la API responde en /health."""
     try:
@@ -117,6 +621,137 @@ def api_is_up(url, timeout=2):
         return False, str(e)
 
 
+class LocalCache:
+    """Caché local (SQLite) de Productos, Clientes y Proveedores y cola de ventas sin conexión.
+
+    Las tablas se pintan al instante desde la caché y se revalidan en segundo plano con
+    If-None-Match/ETag. Las ventas que no se pudieron enviar por falta de conexión quedan
+    en `ventas_pendientes` y se reenvían por lotes cuando la API vuelve; cada venta lleva
+    su clave (guardada por la API junto con la venta), así que reenviarla nunca la duplica.
+    """
+
+    def __init__(self, path=None):
+        import sqlite3
+        self.path = path or os.getenv('GUI_CACHE_PATH') or os.path.join(os.path.expanduser('~'), '.inventario_cache.sqlite3')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS recursos (nombre TEXT PRIMARY KEY, etag TEXT, datos TEXT NOT NULL, actualizado REAL NOT NULL)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS ventas_pendientes ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, clave TEXT UNIQUE NOT NULL, id_cliente INTEGER, fecha_venta TEXT NOT NULL, '
+            'items TEXT NOT NULL, creado REAL NOT NULL, intentos INTEGER NOT NULL DEFAULT 0, '
+            "estado TEXT NOT NULL DEFAULT 'pendiente', ultimo_error TEXT)"
+        )
+        self._db.commit()
+
+    def get_resource(self, nombre):
+        """Retorna (datos, etag) o (None, None) si el recurso no está en caché."""
+        with self._lock:
+            row = self._db.execute('SELECT datos, etag FROM recursos WHERE nombre = ?', (nombre,)).fetchone()
+        if not row:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def put_resource(self, nombre, datos, etag):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO recursos (nombre, etag, datos, actualizado) VALUES (?, ?, ?, ?)',
+                             (nombre, etag, json.dumps(datos), time.time()))
+            self._db.commit()
+
+    def invalidate(self, nombre):
+        with self._lock:
+            self._db.execute('UPDATE recursos SET etag = NULL WHERE nombre = ?', (nombre,))
+            self._db.commit()
+
+    def enqueue_sale(self, clave, id_cliente, fecha_venta, items):
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO ventas_pendientes (clave, id_cliente, fecha_venta, items, creado) VALUES (?, ?, ?, ?, ?)',
+                             (clave, id_cliente, fecha_venta, json.dumps(items), time.time()))
+            self._db.commit()
+
+    def pending_sales(self, limit=20):
+        with self._lock:
+            rows = self._db.execute("SELECT id, clave, id_cliente, fecha_venta, items FROM ventas_pendientes WHERE estado = 'pendiente' ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [{'id': r[0], 'clave': r[1], 'id_cliente': r[2], 'fecha_venta': r[3], 'items': json.loads(r[4])} for r in rows]
+
+    def count_pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM ventas_pendientes WHERE estado = 'pendiente'").fetchone()[0]
+
+    def sale_sent(self, sale_id):
+        with self._lock:
+            self._db.execute('DELETE FROM ventas_pendientes WHERE id = ?', (sale_id,))
+            self._db.commit()
+
+    def sale_rejected(self, sale_id, error):
+        """La API rechazó la venta (4xx): no se reintenta, queda como 'rechazada' para revisarla."""
+        with self._lock:
+            self._db.execute("UPDATE ventas_pendientes SET intentos = intentos + 1, ultimo_error = ?, estado = 'rechazada' WHERE id = ?",
+                             (error, sale_id))
+            self._db.commit()
+
+    def sale_failed(self, sale_id, error, max_attempts=5):
+        """Registra un rechazo de la API; tras `max_attempts` la venta queda como 'fallida'."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE ventas_pendientes SET intentos = intentos + 1, ultimo_error = ?, "
+                "estado = CASE WHEN intentos + 1 >= ? THEN 'fallida' ELSE estado END WHERE id = ?",
+                (error, max_attempts, sale_id))
+            self._db.commit()
+
+
+_LOCAL_CACHE = None
+
+
+def get_local_cache():
+    """Caché local compartida; None si no se pudo abrir (la GUI funciona igual, sin caché)."""
+    global _LOCAL_CACHE
+    if _LOCAL_CACHE is None:
+        try:
+            _LOCAL_CACHE = LocalCache()
+        except Exception as e:
+            print(f"Caché local desactivada: {e}")
+            _LOCAL_CACHE = False
+    return _LOCAL_CACHE or None
+
+
+class OfflineError(Exception):
+    """La API no es accesible (error de conexión o timeout)."""
+
+
+# Rechazos que pueden resolverse solos al reintentar (límite de tráfico, timeout del servidor)
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+def submit_sale(clave, id_cliente, fecha_venta, items):
+    """Envía una venta completa (cabecera y líneas en una sola transacción) a /ventas/completa.
+
+    `clave` identifica la venta en la API (tabla Ventas_Claves): reenviarla devuelve la venta
+    ya registrada, aunque la API se haya reiniciado. Retorna (ok, mensaje, reintentable);
+    reintentable es False si la API rechazó la venta (4xx) y reenviarla no cambiaría nada.
+    Lanza OfflineError si la API no es accesible, en cuyo caso la venta puede encolarse.
+    """
+    payload = {"clave": clave, "fecha_venta": fecha_venta, "id_cliente": id_cliente,
+               "items": [{"id_producto": int(it['id_producto']), "cantidad": int(it['cantidad']),
+                          "precio_unitario": float(it['precio_unitario'])} for it in items]}
+    try:
+        r = SESSION.post(f"{API_URL}/ventas/completa", json=payload)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise OfflineError(str(e))
+    if r.status_code in (200, 201):
+        total = r.json().get('total')
+        if total is None:
+            total = sum(it['cantidad'] * it['precio_unitario'] for it in payload['items'])
+        return True, f'Venta registrada (total: {float(total):.2f})', False
+    try:
+        detalle = r.json().get('error') or r.text
+    except ValueError:
+        detalle = r.text
+    reintentable = r.status_code >= 500 or r.status_code in RETRYABLE_STATUS
+    return False, f"Error registrando la venta: {r.status_code} {detalle}", reintentable
+
+
 # --- CLASE LOGINWINDOW CON CORRECCIÓN DE CIERRE ---
 class LoginWindow(ctk.CTkToplevel):
     def __init__(self, parent):
@@ -127,13 +762,9 @@ class LoginWindow(ctk.CTkToplevel):
         self.user = None
         self.resizable(False, False)
 
-        # Cola de tareas que los hilos pueden encolar para que el hilo
-        # principal las ejecute de forma segura. Usamos un lock simple
-        # para proteger la cola al acceder desde otros hilos.
-        self._task_queue = []
-        self._queue_lock = threading.Lock()
-        # Iniciar el procesador de la cola en el hilo principal
-        self.after(100, self._process_queue)
+        # Las peticiones van al pool compartido; sus resultados se entregan en el loop de Tk
+        # de esta ventana hasta que MainApp toma el relevo
+        GUI_EXECUTOR.start_pump(self)
 
         title_label = ctk.CTkLabel(self, text="Iniciar Sesión", font=ctk.CTkFont(size=18, weight="bold"))
         title_label.pack(pady=(25, 15))
@@ -157,27 +788,72 @@ class LoginWindow(ctk.CTkToplevel):
 
         self.username_entry.focus()
         self.bind("<Return>", lambda e: self.login())
+        self.bind("<Map>", lambda e: STARTUP.mark('login_visible'), add="+")
+
+        self._asking_api = False
+        threading.Thread(target=self._watch_api, daemon=True).start()
+
+    def _wait_for_api(self, retry):
+        """Espera (en el hilo worker) a que la API esté lista.
+
+        Si no se pudo arrancar, encola en el hilo principal la petición de URL y reintenta
+        `retry` si el usuario introduce una válida. Retorna True si se puede continuar.
+        """
+        if API_BOOTSTRAP.wait(API_BOOTSTRAP.timeout + 5):
+            if API_BOOTSTRAP.db_error:
+                # Volver a comprobar: la base de datos puede haberse recuperado
+                _, API_BOOTSTRAP.db_error = check_api_ready(API_URL)
+            if API_BOOTSTRAP.db_error:
+                # La API responde pero no la base de datos: avisar en vez de esperar un timeout
+                def warn():
+                    self.enable_buttons()
+                    messagebox.showerror("Base de datos", API_BOOTSTRAP.db_error)
+                GUI_EXECUTOR.call_soon(warn)
+                return False
+            return True
+
+        def ask():
+            # El aviso del arranque y un clic en Login pueden llegar aquí a la vez: un solo diálogo
+            if self._asking_api:
+                self.enable_buttons()
+                return
+            self._asking_api = True
+            if ask_api_url():
+                self._asking_api = False
+                retry()
+            else:
+                exit_api_unreachable(self.destroy)
+        GUI_EXECUTOR.call_soon(ask)
+        return False
+
+    def _watch_api(self):
+        """Si la API no arranca, pide la URL (o cierra la app) sin esperar a que se pulse Login."""
+        if API_BOOTSTRAP.wait(API_BOOTSTRAP.timeout + 5):
+            return
+        self._wait_for_api(self.enable_buttons)
 
     def create_test_user(self):
         self.login_button.configure(state='disabled')
         self.create_user_button.configure(state='disabled')
 
         def worker():
+            if not self._wait_for_api(self.create_test_user):
+                return
             try:
-                r = SESSION.post(f"{API_URL}/usuarios", json={"username": "admin", "password": "admin", "rol": "administrador"}, timeout=4)
+                r = SESSION.post(f"{API_URL}/usuarios", json={"username": "admin", "password": "admin", "rol": "administrador"}, headers=idempotency_headers())
                 if r.status_code == 201:
-                    self._enqueue(lambda: messagebox.showinfo("Usuario Creado", "Usuario 'admin' (pass 'admin') creado. Ahora puedes hacer login."))
+                    GUI_EXECUTOR.call_soon(lambda: messagebox.showinfo("Usuario Creado", "Usuario 'admin' (pass 'admin') creado. Ahora puedes hacer login."))
                 elif r.status_code == 409:
-                    self._enqueue(lambda: messagebox.showinfo("Usuario Existe", "El usuario 'admin' ya existe."))
+                    GUI_EXECUTOR.call_soon(lambda: messagebox.showinfo("Usuario Existe", "El usuario 'admin' ya existe."))
                 else:
-                    self._enqueue(lambda: messagebox.showerror("Error", f"No se pudo crear: {r.text}"))
+                    GUI_EXECUTOR.call_soon(lambda: messagebox.showerror("Error", f"No se pudo crear: {r.text}"))
             except Exception as e:
-                self._enqueue(lambda e=e: messagebox.showerror("Conexión", f"No se pudo conectar a la API: {e}"))
+                GUI_EXECUTOR.call_soon(lambda e=e: messagebox.showerror("Conexión", f"No se pudo conectar a la API: {e}"))
             finally:
                 # Encolar la reactivación de botones en el hilo principal
-                self._enqueue(self.enable_buttons)
+                GUI_EXECUTOR.call_soon(self.enable_buttons)
 
-        threading.Thread(target=worker, daemon=True).start()
+        GUI_EXECUTOR.submit(worker)
 
     def enable_buttons(self):
         try:
@@ -221,12 +897,14 @@ class LoginWindow(ctk.CTkToplevel):
                  error_detail = data if isinstance(data, str) else data.get('error', 'Error desconocido')
                  messagebox.showerror("Error", f"Login falló: HTTP {status} - {error_detail}")
 
-        # Función que se ejecuta en el hilo secundario
+        # Función que se ejecuta en el pool de la GUI
         def worker():
             result = {"status": None, "data": None, "error": None}
+            if not self._wait_for_api(self.login):
+                return
             try:
                 print(f"Intentando login para '{username}' en {API_URL}/login") # Mensaje de depuración
-                r = SESSION.post(f"{API_URL}/login", json={"username": username, "password": password}, timeout=4)
+                r = SESSION.post(f"{API_URL}/login", json={"username": username, "password": password})
                 result["status"] = r.status_code
                 try:
                     # Intentar obtener JSON si es posible
@@ -244,41 +922,9 @@ class LoginWindow(ctk.CTkToplevel):
                  result["error"] = f"Error inesperado: {e}"
 
             # Encolar la función process_login_result para que la ejecute el hilo principal
-            self._enqueue(lambda res=result: process_login_result(res))
-
-        # Iniciar el hilo de trabajo
-        threading.Thread(target=worker, daemon=True).start()
-
-    # ---------------- Cola de tareas para comunicación thread->UI ----------------
-    def _enqueue(self, fn):
-        """Encola una función para que sea ejecutada en el hilo principal.
-
-        Los worker threads pueden llamar a esta función sin usar self.after.
-        """
-        with self._queue_lock:
-            self._task_queue.append(fn)
-
-    def _process_queue(self):
-        """Ejecuta tareas encoladas por worker threads. Debe llamarse en el hilo principal."""
-        # Sacar todas las tareas y ejecutarlas
-        tasks = []
-        with self._queue_lock:
-            if self._task_queue:
-                tasks = list(self._task_queue)
-                self._task_queue.clear()
-
-        for fn in tasks:
-            try:
-                fn()
-            except Exception as e:
-                print(f"Error ejecutando tarea en cola: {e}")
+            GUI_EXECUTOR.call_soon(lambda res=result: process_login_result(res))
 
-        # Volver a llamarse periódicamente mientras la ventana exista
-        try:
-            if self.winfo_exists():
-                self.after(100, self._process_queue)
-        except Exception:
-            pass
+        GUI_EXECUTOR.submit(worker)
 
 # --- FIN DE LA FUNCIÓN LOGIN CORREGIDA ---
 
@@ -290,6 +936,8 @@ class ReportWindow(ctk.CTkToplevel):
         self.geometry("800x600")
         self.report_type = report_type
         self.parent = parent
+        # Al cerrar la ventana se descarta cualquier reporte aún en curso
+        self.bind('<Destroy>', lambda e: GUI_EXECUTOR.cancel(f'reporte-{id(self)}') if e.widget is self else None, add='+')
 
         self.create_widgets()
         if self.report_type not in ["Existencias Mínimas", "Existencias"]:
@@ -298,25 +946,22 @@ class ReportWindow(ctk.CTkToplevel):
             self.load_report()
 
     def create_widgets(self):
+        # Último reporte cargado (para exportarlo con los mismos filtros)
+        self._report_name = None
+        self._report_params = None
+        self._report_rows = []
+
         top_frame = ctk.CTkFrame(self)
         top_frame.pack(pady=10, padx=10, fill="x")
 
-        # Botón para exportar el reporte actual a Excel
+        # Botón para exportar el reporte actual a Excel (el archivo lo genera la API)
         try:
-            if HAS_PANDAS:
-                export_btn = ctk.CTkButton(top_frame, text="Exportar a Excel", command=self.export_to_excel)
-            else:
-                # Si pandas no está disponible, mostrar botón que indica dependencia
-                export_btn = ctk.CTkButton(
-                    top_frame,
-                    text="Exportar a Excel (instala pandas)",
-                    command=lambda: messagebox.showwarning('Dependencia', 'Instala pandas y openpyxl: pip install pandas openpyxl')
-                )
-            export_btn.pack(side="right", padx=5)
+            self.export_btn = ctk.CTkButton(top_frame, text="Exportar a Excel", command=self.export_to_excel)
+            self.export_btn.pack(side="right", padx=5)
         except Exception:
             pass
 
-        if self.report_type in ["Ventas", "Ganancias", "Compras"]:
+        if self.report_type in ["Ventas", "Ganancias", "Compras", "Kardex", "Analítica"]:
             ctk.CTkLabel(top_frame, text="Desde (YYYY-MM-DD):").pack(side="left", padx=5)
             self.desde_entry = ctk.CTkEntry(top_frame, placeholder_text="2023-01-01")
             self.desde_entry.pack(side="left", padx=5)
@@ -342,13 +987,16 @@ class ReportWindow(ctk.CTkToplevel):
             "Ventas": "ventas",
             "Compras": "compras",
             "Ganancias": "ganancias",
+            "Kardex": "kardex",
+            "Analítica": "analitica",
+            "Valoración": "valoracion",
             "Existencias Mínimas": "existencias_minimas",
             "Existencias": "existencias"
         }
-        endpoint = f"{API_URL}/reportes/{endpoint_map.get(self.report_type)}"
+        report_name = endpoint_map.get(self.report_type)
 
         params = {}
-        if self.report_type in ["Ventas", "Ganancias", "Compras"]:
+        if self.report_type in ["Ventas", "Ganancias", "Compras", "Kardex", "Analítica"]:
             desde = self.desde_entry.get()
             hasta = self.hasta_entry.get()
             if not desde or not hasta:
@@ -356,52 +1004,60 @@ class ReportWindow(ctk.CTkToplevel):
                 return
             params = {"desde": desde, "hasta": hasta}
 
-        def worker():
-            try:
-                r = SESSION.get(endpoint, params=params, timeout=10)
-                status = r.status_code
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else None
-                text = r.text
-            except Exception as e:
-                self.after(0, lambda: messagebox.showerror("Conexión", f"No se pudo conectar a la API: {e}"))
-                return
+        def update_ui(result):
+            status, data, text = result
+            if status == 200 and data is not None:
+                summary_text = ""
+                table = None
+
+                if self.report_type == "Ventas":
+                    cols = [('id', 'ID', 50), ('fecha_venta', 'Fecha', 100), ('total', 'Total', 100), ('id_cliente', 'ID Cliente', 80), ('cliente', 'Cliente', 150)]
+                    table = data.get('ventas')
+                    summary_text = f"Total Ventas: {data.get('suma_total', 0):.2f}"
+                elif self.report_type == "Compras":
+                    cols = [('id', 'ID', 50), ('fecha_compra', 'Fecha', 100), ('total', 'Total', 100), ('id_proveedor', 'ID Prov', 80), ('proveedor', 'Proveedor', 150)]
+                    table = data.get('compras')
+                    summary_text = f"Total Compras: {data.get('suma_total', 0):.2f}"
+                elif self.report_type == "Ganancias":
+                    cols = [('producto', 'Producto', 150), ('cantidad_vendida', 'Cant.', 80), ('total_ventas', 'T. Ventas', 100), ('total_costo', 'T. Costo', 100), ('ganancia', 'Ganancia', 100)]
+                    table = data.get('ganancias_por_producto')
+                    summary_text = f"Ganancia Total: {data.get('ganancia_total', 0):.2f}"
+                elif self.report_type == "Kardex":
+                    cols = [('producto', 'Producto', 150), ('stock_inicial', 'Stock Inicial', 90), ('entradas', 'Entradas', 80), ('salidas', 'Salidas', 80), ('stock_final', 'Stock Final', 90)]
+                    table = data.get('productos')
+                elif self.report_type == "Analítica":
+                    cols = [('producto', 'Producto', 150), ('clase', 'ABC', 50), ('ingresos', 'Ingresos', 90), ('rotacion_anual', 'Rotación', 80), ('dias_cobertura', 'Días Cob.', 80), ('stock', 'Stock', 70), ('punto_reorden', 'P. Reorden', 80), ('cantidad_sugerida', 'Pedir', 70)]
+                    table = data.get('productos')
+                    summary_text = "Clase A: 80% de los ingresos. Pedir: cantidad sugerida para reponer."
+                elif self.report_type == "Valoración":
+                    cols = [('proveedor', 'Proveedor', 200), ('unidades', 'Unidades', 100), ('valor', 'Valor', 120)]
+                    table = data.get('por_proveedor')
+                    summary_text = f"Valor del inventario: {float(data.get('valor_total', 0)):.2f} ({data.get('unidades_total', 0)} unidades)"
+                elif self.report_type == "Existencias Mínimas":
+                    cols = [('nombre', 'Nombre', 150), ('stock', 'Stock', 100), ('stock_minimo', 'Stock Mínimo', 100)]
+                    table = data
+                elif self.report_type == "Existencias":
+                    cols = [('nombre', 'Nombre', 150), ('stock', 'Stock', 100)]
+                    table = data
+
+                rows = table_rows(table, [c[0] for c in cols])
+                self.configure_tree(cols)
+                for row in rows:
+                    self.tree.insert("", "end", values=tuple(row))
+
+                self.summary_label.configure(text=summary_text)
+                self._report_name = report_name
+                self._report_params = params
+                self._report_rows = rows
 
-            def update_ui():
-                if status == 200 and data is not None:
-                    summary_text = ""
-                    list_data = []
-
-                    if self.report_type == "Ventas":
-                        cols = [('id', 'ID', 50), ('fecha_venta', 'Fecha', 100), ('total', 'Total', 100), ('id_cliente', 'ID Cliente', 80), ('cliente', 'Cliente', 150)]
-                        list_data = data.get('ventas', [])
-                        summary_text = f"Total Ventas: {data.get('suma_total', 0):.2f}"
-                    elif self.report_type == "Compras":
-                        cols = [('id', 'ID', 50), ('fecha_compra', 'Fecha', 100), ('total', 'Total', 100), ('id_proveedor', 'ID Prov', 80), ('proveedor', 'Proveedor', 150)]
-                        list_data = data.get('compras', [])
-                        summary_text = f"Total Compras: {data.get('suma_total', 0):.2f}"
-                    elif self.report_type == "Ganancias":
-                        cols = [('producto', 'Producto', 150), ('cantidad_vendida', 'Cant.', 80), ('total_ventas', 'T. Ventas', 100), ('total_costo', 'T. Costo', 100), ('ganancia', 'Ganancia', 100)]
-                        list_data = data.get('ganancias_por_producto', [])
-                        summary_text = f"Ganancia Total: {data.get('ganancia_total', 0):.2f}"
-                    elif self.report_type == "Existencias Mínimas":
-                        cols = [('nombre', 'Nombre', 150), ('stock', 'Stock', 100), ('stock_minimo', 'Stock Mínimo', 100)]
-                        list_data = data
-                    elif self.report_type == "Existencias":
-                        cols = [('nombre', 'Nombre', 150), ('stock', 'Stock', 100)]
-                        list_data = data
-
-                    self.configure_tree(cols)
-                    for item in list_data:
-                        self.tree.insert("", "end", values=tuple(item.get(c[0]) for c in cols))
-
-                    self.summary_label.configure(text=summary_text)
-
-                else:
-                    messagebox.showerror("Error", f"API error {status}: {text}")
-
-            self.after(0, update_ui)
+            else:
+                messagebox.showerror("Error", f"API error {status}: {text}")
 
-        threading.Thread(target=worker, daemon=True).start()
+        # Un nuevo filtro o cerrar la ventana descarta la respuesta anterior
+        channel = f'reporte-{id(self)}'
+        GUI_EXECUTOR.cancel(channel)
+        GUI_EXECUTOR.submit(fetch_report, report_name, params, key=('reporte', report_name, tuple(sorted(params.items()))), channel=channel,
+                            on_done=update_ui, on_error=lambda e: messagebox.showerror("Conexión", f"No se pudo conectar a la API: {e}"))
 
     def configure_tree(self, columns):
         self.tree.config(columns=[c[0] for c in columns])
@@ -410,30 +1066,19 @@ class ReportWindow(ctk.CTkToplevel):
             self.tree.column(col, width=width, anchor="w")
 
     def export_to_excel(self):
-        """Exporta el contenido visible del Treeview a un archivo .xlsx usando pandas."""
-        if not HAS_PANDAS:
-            messagebox.showerror('Exportar', 'La librería pandas no está instalada. Instala pandas y openpyxl: pip install pandas openpyxl')
-            return
-        # Recolectar columnas y filas
-        cols = list(self.tree.cget('columns'))
-        if not cols:
-            messagebox.showwarning('Exportar', 'No hay columnas para exportar.')
-            return
-
-        rows = []
-        for iid in self.tree.get_children():
-            vals = self.tree.item(iid, 'values')
-            # Asegurar que vals tenga la misma longitud que cols
-            row = {cols[i]: vals[i] if i < len(vals) else None for i in range(len(cols))}
-            rows.append(row)
+        """Descarga el reporte actual como .xlsx/.csv generado por la API, en el pool de la GUI.
 
-        if not rows:
-            messagebox.showwarning('Exportar', 'No hay datos para exportar.')
+        El archivo se transmite desde la API directamente a disco: la UI no se bloquea y
+        los valores conservan su tipo. Si la API no puede generarlo (p.ej. sin openpyxl en
+        el servidor) se exportan localmente los datos ya cargados con pandas.
+        """
+        if not self._report_name:
+            messagebox.showwarning('Exportar', 'Genera el reporte antes de exportarlo.')
             return
 
         # Pedir ruta al usuario
         try:
-            filepath = filedialog.asksaveasfilename(defaultextension='.xlsx', filetypes=[('Excel files', '*.xlsx')], title='Guardar reporte como')
+            filepath = filedialog.asksaveasfilename(defaultextension='.xlsx', filetypes=[('Excel files', '*.xlsx'), ('CSV', '*.csv')], title='Guardar reporte como')
         except Exception as e:
             messagebox.showerror('Exportar', f'Error al abrir diálogo de guardado: {e}')
             return
@@ -441,13 +1086,64 @@ class ReportWindow(ctk.CTkToplevel):
         if not filepath:
             return
 
+        formato = 'csv' if filepath.lower().endswith('.csv') else 'xlsx'
+        params = dict(self._report_params or {}, format=formato)
+        url = f"{API_URL}/reportes/{self._report_name}"
+        rows = list(self._report_rows)
+        cols = list(self.tree.cget('columns'))
+
         try:
-            df = pd.DataFrame(rows, columns=cols)
+            self.export_btn.configure(state='disabled', text='Exportando...')
+        except Exception:
+            pass
+
+        def worker():
+            error = None
+            try:
+                with SESSION.get(url, params=params, stream=True) as r:
+                    if r.status_code != 200:
+                        raise RuntimeError(f'API error {r.status_code}: {r.text}')
+                    with open(filepath, 'wb') as fh:
+                        for chunk in r.iter_content(chunk_size=64 * 1024):
+                            fh.write(chunk)
+            except Exception as e:
+                error = e
+                # Exportación local como respaldo
+                try:
+                    self.export_local(filepath, formato, cols, rows)
+                    error = None
+                except Exception as local_error:
+                    error = f'{e}; exportación local: {local_error}'
+
+            def done():
+                try:
+                    self.export_btn.configure(state='normal', text='Exportar a Excel')
+                except Exception:
+                    pass
+                if error:
+                    messagebox.showerror('Exportar', f'Error al exportar: {error}')
+                else:
+                    messagebox.showinfo('Exportar', f'Reporte exportado a {filepath}')
+
+            GUI_EXECUTOR.call_soon(done)
+
+        GUI_EXECUTOR.submit(worker)
+
+    @staticmethod
+    def export_local(filepath, formato, cols, rows):
+        """Exporta con pandas las filas ya recibidas (respaldo si la API no genera el archivo)."""
+        pd = load_pandas()
+        if pd is None:
+            raise RuntimeError('La librería pandas no está instalada. Instala pandas y openpyxl: pip install pandas openpyxl')
+        if not rows:
+            raise RuntimeError('No hay datos para exportar.')
+        # Las filas ya vienen como listas en el orden de `cols` (formato columnar)
+        df = pd.DataFrame(rows, columns=cols)
+        if formato == 'csv':
+            df.to_csv(filepath, index=False)
+        else:
             # Intentar escribir con pandas (openpyxl o xlsxwriter debe estar instalado)
             df.to_excel(filepath, index=False)
-            messagebox.showinfo('Exportar', f'Reporte exportado a {filepath}')
-        except Exception as e:
-            messagebox.showerror('Exportar', f'Error al exportar a Excel: {e}')
 
 
 class MainApp(ctk.CTk):
@@ -465,6 +1161,9 @@ class MainApp(ctk.CTk):
         # y cuando cambie a la vista Productos se recargará automáticamente.
         self._products_dirty = False
 
+        # Entrega en el loop de Tk los resultados de las peticiones hechas en el pool compartido
+        GUI_EXECUTOR.start_pump(self)
+
         # Iniciar API en background
         threading.Thread(target=self._start_api_check, daemon=True).start()
 
@@ -472,12 +1171,23 @@ class MainApp(ctk.CTk):
         self.on_resource_change(self.resource_var.get()) # Cargar productos por defecto
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
+        # Alertas de existencias mínimas en tiempo real (SSE) en lugar de consultar el reporte
+        self._low_stock = {}
+        self._closing = False
+        threading.Thread(target=self._watch_low_stock, daemon=True).start()
+
+        # Reenvío de ventas registradas sin conexión
+        self._update_pending_label()
+        threading.Thread(target=self._replay_pending_sales, daemon=True).start()
+
     def _start_api_check(self):
-        """Wrapper que ejecuta ensure_api_running en background."""
-        proc = ensure_api_running()
+        """Espera en background al arranque de la API (iniciado ya desde el login)."""
+        ok = API_BOOTSTRAP.wait()
         def cb():
-            self._api_proc = proc
-        self.after(0, cb)
+            self._api_proc = API_BOOTSTRAP.proc
+            if not ok and not ask_api_url():
+                exit_api_unreachable(self.on_close)
+        GUI_EXECUTOR.call_soon(cb)
 
     def create_widgets(self):
         # Frame principal
@@ -508,9 +1218,20 @@ class MainApp(ctk.CTk):
         reports_button = ctk.CTkButton(selector_frame, text="Reportes", command=self.open_reports_menu)
         reports_button.pack(side="left", padx=20)
 
+        # Panel de diagnóstico de la conexión con la API
+        ctk.CTkButton(selector_frame, text="Diagnóstico", width=100, command=self.open_diagnostics).pack(side="left", padx=5)
+
         # Botón de Salir
         ctk.CTkButton(selector_frame, text="Salir", fg_color="#6c757d", command=self.on_close).pack(side="right", padx=10)
 
+        # Indicador de productos bajo stock mínimo (actualizado por el stream de alertas)
+        self.low_stock_label = ctk.CTkLabel(selector_frame, text="")
+        self.low_stock_label.pack(side="right", padx=10)
+
+        # Ventas pendientes de enviar (cola local sin conexión)
+        self.pending_label = ctk.CTkLabel(selector_frame, text="")
+        self.pending_label.pack(side="right", padx=10)
+
         # --- Tabla (Fila 1, Columna 0) ---
         table_frame = ctk.CTkFrame(main_frame)
         table_frame.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
@@ -614,19 +1335,22 @@ class MainApp(ctk.CTk):
 
         self.report_menu_window = ctk.CTkToplevel(self)
         self.report_menu_window.title("Reportes")
-        self.report_menu_window.geometry("250x300")
+        self.report_menu_window.geometry("250x380")
 
         report_list = {
             "Ventas por Fecha": "Ventas",
             "Compras por Fecha": "Compras",
             "Ganancias por Fecha": "Ganancias",
+            "Kardex (Movimientos de Stock)": "Kardex",
+            "Analítica de Inventario (ABC)": "Analítica",
+            "Valoración de Inventario": "Valoración",
             "Existencias Mínimas": "Existencias Mínimas",
             "Catálogo de Existencias": "Existencias",
         }
 
         for text, report_type in report_list.items():
             disabled = False
-            if self.user_role != 'administrador' and report_type in ["Ganancias", "Compras"]:
+            if self.user_role != 'administrador' and report_type in ["Ganancias", "Compras", "Analítica", "Valoración"]:
                 disabled = True
 
             btn = ctk.CTkButton(
@@ -641,50 +1365,69 @@ class MainApp(ctk.CTk):
         ReportWindow(self, report_type)
 
     def load_data_for(self, resource):
-        """Carga datos en el Treeview para el recurso (Productos, Clientes, etc.)"""
+        """Carga datos en el Treeview para el recurso (Productos, Clientes, etc.)
+
+        Pinta primero la copia de la caché local (si existe) y la revalida en segundo plano
+        con If-None-Match; sólo se vuelve a pintar si la API devuelve datos nuevos.
+        """
         for ch in self.tree.get_children():
             self.tree.delete(ch)
 
         endpoint = f"{API_URL}/{resource.lower()}"
+        cache = get_local_cache()
+        cached, etag = cache.get_resource(resource) if cache else (None, None)
+        if cached is not None:
+            self._render_resource(resource, cached)
+
+        def fetch():
+            headers = {'If-None-Match': etag} if etag and cached is not None else {}
+            r = SESSION.get(endpoint, headers=headers)
+            data = r.json() if r.headers.get('content-type','').startswith('application/json') else None
+            if r.status_code == 200 and data is not None and cache:
+                cache.put_resource(resource, data, r.headers.get('ETag'))
+            return r.status_code, data, r.text
+
+        def update_ui(result):
+            status, data, text = result
+            if status == 304:
+                return  # la copia local sigue vigente
+            if status == 200 and data is not None:
+                self._render_resource(resource, data)
+            elif status >= 400: # Mostrar error si la API responde con error
+                 messagebox.showerror('Error de API', f'Error al cargar {resource}: {status} - {text}')
+
+        def on_error(e):
+            if cached is None:
+                messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}')
+
+        # Canal 'tabla': al cambiar de módulo se descartan las respuestas de la vista anterior
+        GUI_EXECUTOR.cancel('tabla')
+        GUI_EXECUTOR.submit(fetch, key=('GET', endpoint, etag), channel='tabla', on_done=update_ui, on_error=on_error)
+
+    def _render_resource(self, resource, data):
+        """Pinta en el Treeview la lista de registros de un recurso."""
+        for ch in self.tree.get_children():
+            self.tree.delete(ch)
+        if not data: return # No hay datos
 
-        def worker():
-            try:
-                r = SESSION.get(endpoint, timeout=4)
-                status = r.status_code
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else None
-                text = r.text
-            except Exception as e:
-                self.after(0, lambda: messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}'))
-                return
-
-            def update_ui():
-                if status == 200 and data is not None:
-                    if not data: return # No hay datos
-
-                    cols_map = self.get_resource_config(resource).get("cols_map", {})
-                    cols = []
-                    # Asegurar que el ID sea la primera columna si existe
-                    if 'id' in data[0] and 'id' in cols_map:
-                         cols.append(('id', cols_map['id'][0], cols_map['id'][1]))
-
-                    # Añadir el resto de columnas según el mapeo
-                    for key in data[0].keys():
-                        if key == 'id': continue # Ya se añadió
-                        col_config = cols_map.get(key)
-                        if col_config:
-                            cols.append((key, col_config[0], col_config[1]))
-
-                    self.configure_tree(cols)
+        cols_map = self.get_resource_config(resource).get("cols_map", {})
+        cols = []
+        # Asegurar que el ID sea la primera columna si existe
+        if 'id' in data[0] and 'id' in cols_map:
+             cols.append(('id', cols_map['id'][0], cols_map['id'][1]))
 
-                    for item in data:
-                        values = tuple(item.get(c[0]) for c in cols)
-                        self.tree.insert('', 'end', values=values)
-                elif status >= 400: # Mostrar error si la API responde con error
-                     messagebox.showerror('Error de API', f'Error al cargar {resource}: {status} - {text}')
+        # Añadir el resto de columnas según el mapeo
+        for key in data[0].keys():
+            if key == 'id': continue # Ya se añadió
+            col_config = cols_map.get(key)
+            if col_config:
+                cols.append((key, col_config[0], col_config[1]))
 
-            self.after(0, update_ui)
+        self.configure_tree(cols)
 
-        threading.Thread(target=worker, daemon=True).start()
+        for item in data:
+            values = tuple(item.get(c[0]) for c in cols)
+            self.tree.insert('', 'end', values=values)
 
     def clear_form(self):
         self._current_id = None
@@ -836,49 +1579,44 @@ class MainApp(ctk.CTk):
                     return
 
 
-        def worker():
-            nonlocal payload # Permitir modificar payload si la API devuelve el objeto creado/actualizado
-            try:
-                endpoint = f"{API_URL}/{resource.lower()}"
-                # Evitar enviar valores None que rompan conversiones en el servidor
-                payload_to_send = {k: v for k, v in payload.items() if v is not None}
-                if self._current_id:
-                    # Actualizar (PUT)
-                    print(f"PUT {endpoint}/{self._current_id} with payload: {payload_to_send}") # Debug
-                    r = SESSION.put(f"{endpoint}/{self._current_id}", json=payload_to_send, timeout=6)
-                else:
-                    # Crear (POST)
-                    print(f"POST {endpoint} with payload: {payload_to_send}") # Debug
-                    r = SESSION.post(endpoint, json=payload_to_send, timeout=6)
-
-                status = r.status_code
-                try:
-                    response_data = r.json() if r.headers.get('content-type','').startswith('application/json') else r.text
-                except requests.exceptions.JSONDecodeError:
-                    response_data = r.text
-
-            except Exception as e:
-                self.after(0, lambda: messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}'))
-                return
-
-            def ui_after():
-                print(f"Save response: {status} - {response_data}") # Debug
-                if status in (200, 201): # 200 OK (Update), 201 Created (Post)
-                    messagebox.showinfo('OK', f'{resource.rstrip("s")} guardado')
-                    self.clear_form()
-                    self.load_data_for(resource) # Recargar la tabla
-                else:
-                     # Mostrar detalle del error (texto o JSON) para depuración
-                     if isinstance(response_data, dict):
-                         detail = response_data.get('error') or response_data
-                     else:
-                         detail = response_data
-                     messagebox.showerror('Error', f'Error al guardar: {status} - {detail}')
+        record_id = self._current_id
 
+        def request():
+            endpoint = f"{API_URL}/{resource.lower()}"
+            # Evitar enviar valores None que rompan conversiones en el servidor
+            payload_to_send = {k: v for k, v in payload.items() if v is not None}
+            if record_id:
+                # Actualizar (PUT)
+                print(f"PUT {endpoint}/{record_id} with payload: {payload_to_send}") # Debug
+                r = SESSION.put(f"{endpoint}/{record_id}", json=payload_to_send)
+            else:
+                # Crear (POST)
+                print(f"POST {endpoint} with payload: {payload_to_send}") # Debug
+                r = SESSION.post(endpoint, json=payload_to_send, headers=idempotency_headers())
 
-            self.after(0, ui_after)
+            try:
+                response_data = r.json() if r.headers.get('content-type','').startswith('application/json') else r.text
+            except requests.exceptions.JSONDecodeError:
+                response_data = r.text
+            return r.status_code, response_data
+
+        def ui_after(result):
+            status, response_data = result
+            print(f"Save response: {status} - {response_data}") # Debug
+            if status in (200, 201): # 200 OK (Update), 201 Created (Post)
+                messagebox.showinfo('OK', f'{resource.rstrip("s")} guardado')
+                self.clear_form()
+                self.load_data_for(resource) # Recargar la tabla
+            else:
+                 # Mostrar detalle del error (texto o JSON) para depuración
+                 if isinstance(response_data, dict):
+                     detail = response_data.get('error') or response_data
+                 else:
+                     detail = response_data
+                 messagebox.showerror('Error', f'Error al guardar: {status} - {detail}')
 
-        threading.Thread(target=worker, daemon=True).start()
+        GUI_EXECUTOR.submit(request, on_done=ui_after,
+                            on_error=lambda e: messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}'))
 
     def delete_current(self):
         if not self._current_id:
@@ -889,37 +1627,33 @@ class MainApp(ctk.CTk):
 
         resource = self.resource_var.get()
 
-        def worker():
-            try:
-                endpoint = f"{API_URL}/{resource.lower()}/{self._current_id}"
-                print(f"DELETE {endpoint}") # Debug
-                r = SESSION.delete(endpoint, timeout=6)
-                status = r.status_code
-                try:
-                    response_data = r.json() if r.headers.get('content-type','').startswith('application/json') else r.text
-                except requests.exceptions.JSONDecodeError:
-                    response_data = r.text
-
-            except Exception as e:
-                self.after(0, lambda: messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}'))
-                return
-
-            def ui_after():
-                print(f"Delete response: {status} - {response_data}") # Debug
-                if status in (200, 204): # 200 OK, 204 No Content
-                    messagebox.showinfo('OK', 'Eliminado')
-                    self.clear_form()
-                    self.load_data_for(resource) # Recargar la tabla
-                elif status == 404:
-                     messagebox.showerror('Error', 'Error al borrar: Registro no encontrado (404)')
-                else:
-                    error_msg = response_data if isinstance(response_data, str) else response_data.get('error', 'Error desconocido')
-                    messagebox.showerror('Error', f'Error al borrar: {status} - {error_msg}')
-
+        endpoint = f"{API_URL}/{resource.lower()}/{self._current_id}"
 
-            self.after(0, ui_after)
+        def request():
+            print(f"DELETE {endpoint}") # Debug
+            r = SESSION.delete(endpoint)
+            try:
+                response_data = r.json() if r.headers.get('content-type','').startswith('application/json') else r.text
+            except requests.exceptions.JSONDecodeError:
+                response_data = r.text
+            return r.status_code, response_data
+
+        def ui_after(result):
+            status, response_data = result
+            print(f"Delete response: {status} - {response_data}") # Debug
+            if status in (200, 204): # 200 OK, 204 No Content
+                messagebox.showinfo('OK', 'Eliminado')
+                self.clear_form()
+                self.load_data_for(resource) # Recargar la tabla
+            elif status == 404:
+                 messagebox.showerror('Error', 'Error al borrar: Registro no encontrado (404)')
+            else:
+                error_msg = response_data if isinstance(response_data, str) else response_data.get('error', 'Error desconocido')
+                messagebox.showerror('Error', f'Error al borrar: {status} - {error_msg}')
 
-        threading.Thread(target=worker, daemon=True).start()
+        # Un segundo clic mientras el borrado está en curso no lanza otro DELETE
+        GUI_EXECUTOR.submit(request, key=('DELETE', endpoint), on_done=ui_after,
+                            on_error=lambda e: messagebox.showerror('Conexión', f'No se pudo conectar a la API: {e}'))
 
     # ---------------- Venta por Cliente (multi-producto) ----------------
     def open_client_sell_dialog(self):
@@ -949,6 +1683,15 @@ class MainApp(ctk.CTk):
         fecha_entry.pack(side='left', padx=(0,12))
         ctk.CTkLabel(meta_frame, text=f'Cliente ID: {client_id}').pack(side='left')
 
+        # Lector de código de barras: cada lectura es una búsqueda puntual en la API
+        scan_frame = ctk.CTkFrame(dialog)
+        scan_frame.pack(fill='x', padx=10, pady=(8, 0))
+        ctk.CTkLabel(scan_frame, text='Código:').pack(side='left', padx=(0, 6))
+        scan_entry = ctk.CTkEntry(scan_frame, width=220, placeholder_text='Escanear o escribir y Enter')
+        scan_entry.pack(side='left')
+        scan_status = ctk.CTkLabel(scan_frame, text='')
+        scan_status.pack(side='left', padx=8)
+
         rows_frame = ctk.CTkFrame(dialog)
         rows_frame.pack(fill='both', expand=True, padx=10, pady=8)
 
@@ -978,7 +1721,7 @@ class MainApp(ctk.CTk):
                 except Exception:
                     pass
             if prod_options:
-                names = [f"{p['id']} - {p['nombre']} (stock:{p['stock']})" for p in prod_options]
+                names = [option_label(p) for p in prod_options]
             else:
                 names = ["Cargando..."]
             opt = ctk.CTkOptionMenu(row, values=names, variable=var)
@@ -1001,30 +1744,87 @@ class MainApp(ctk.CTk):
             # Guardar la tupla en el orden: (row, var, opt, qty_entry, price_label, stock_label)
             product_rows.append((row, var, opt, qty_entry, price_label, stock_label))
 
+        def option_label(p):
+            return f"{p['id']} - {p['nombre']} (stock:{p['stock']})"
+
         def populate_products(prods):
             nonlocal products_list
-            products_list = prods
-            loading_label.destroy()
-            # Crear una fila inicial
-            add_row(products_list)
+            # Conservar los productos ya escaneados (tienen stock más reciente)
+            scanned = {p['id']: p for p in products_list}
+            products_list = [scanned.pop(p['id'], p) for p in prods] + list(scanned.values())
+            if loading_label.winfo_exists():
+                loading_label.destroy()
+            if not product_rows:
+                # Crear una fila inicial
+                add_row(products_list)
             update_total()
 
-        def fetch_products_worker():
-            try:
-                r = SESSION.get(f"{API_URL}/productos", timeout=6)
-                if r.status_code == 200:
-                    prods = r.json()
-                    # normalizar
-                    normalized = []
-                    for p in prods:
-                        normalized.append({'id': p.get('id'), 'nombre': p.get('nombre'), 'precio_venta': float(p.get('precio_venta') or 0), 'stock': int(p.get('stock') or 0)})
-                    dialog.after(0, lambda: populate_products(normalized))
-                else:
-                    dialog.after(0, lambda: messagebox.showerror('Error', f'No se pudieron cargar productos: {r.status_code} {r.text}'))
-            except Exception as e:
-                dialog.after(0, lambda: messagebox.showerror('Conexión', f'Error al cargar productos: {e}'))
+        def fetch_by_code(codigo):
+            r = SESSION.get(f"{API_URL}/productos/by-code/{quote(codigo, safe='')}")
+            if r.status_code == 404:
+                return None
+            if r.status_code != 200:
+                raise RuntimeError(f'{r.status_code} {r.text}')
+            p = r.json()
+            return {'id': p.get('id'), 'nombre': p.get('nombre'), 'precio_venta': float(p.get('precio_venta') or 0), 'stock': int(p.get('stock') or 0)}
+
+        def add_scanned(prod, codigo):
+            if prod is None:
+                scan_status.configure(text=f'Código {codigo} no encontrado', text_color='#d9534f')
+                return
+            scan_status.configure(text=f"{prod['nombre']} · stock {prod['stock']}", text_color='#28a745')
+            existing = next((p for p in products_list if p['id'] == prod['id']), None)
+            if existing is not None:
+                existing.update(prod)
+            else:
+                products_list.append(prod)
+            # Si el producto ya está en la venta se suma una unidad; si no, fila nueva con cantidad 1
+            for (_row, var, opt, qty_entry, price_label, stock_label) in product_rows:
+                if var.get().split(' - ')[0] == str(prod['id']):
+                    try:
+                        qty = int(qty_entry.get() or 0)
+                    except Exception:
+                        qty = 0
+                    qty_entry.delete(0, 'end')
+                    qty_entry.insert(0, str(qty + 1))
+                    break
+            else:
+                empty = next((r for r in product_rows if not r[1].get()), None)
+                if empty is None:
+                    add_row(products_list)
+                    empty = product_rows[-1]
+                empty[1].set(option_label(prod))
+                empty[3].delete(0, 'end')
+                empty[3].insert(0, '1')
+            if loading_label.winfo_exists():
+                loading_label.destroy()
+            update_total()
 
-        threading.Thread(target=fetch_products_worker, daemon=True).start()
+        def on_scan(_event=None):
+            codigo = scan_entry.get().strip()
+            scan_entry.delete(0, 'end')
+            if not codigo:
+                return
+            GUI_EXECUTOR.submit(fetch_by_code, codigo, key=('GET', 'by-code', codigo), channel=sale_channel,
+                                on_done=lambda prod: add_scanned(prod, codigo),
+                                on_error=lambda e: scan_status.configure(text=f'Error: {e}', text_color='#d9534f'))
+
+        scan_entry.bind('<Return>', on_scan)
+        scan_entry.focus_set()
+
+        def fetch_products():
+            r = SESSION.get(f"{API_URL}/productos")
+            if r.status_code != 200:
+                raise RuntimeError(f'{r.status_code} {r.text}')
+            # normalizar
+            return [{'id': p.get('id'), 'nombre': p.get('nombre'), 'precio_venta': float(p.get('precio_venta') or 0), 'stock': int(p.get('stock') or 0)}
+                    for p in r.json()]
+
+        # Al cerrar el diálogo se descarta la carga pendiente
+        sale_channel = f'venta-{id(dialog)}'
+        dialog.bind('<Destroy>', lambda e: GUI_EXECUTOR.cancel(sale_channel) if e.widget is dialog else None, add='+')
+        GUI_EXECUTOR.submit(fetch_products, key=('GET', f"{API_URL}/productos", 'venta'), channel=sale_channel, on_done=populate_products,
+                            on_error=lambda e: messagebox.showerror('Conexión', f'Error al cargar productos: {e}'))
 
         def on_add_product():
             if products_list:
@@ -1123,24 +1923,21 @@ class MainApp(ctk.CTk):
         def worker():
             success = False
             err = None
-            venta_id = None
-            total = round(sum(it['cantidad'] * float(it['precio_unitario']) for it in items), 2)
+            msg = None
+            clave = uuid.uuid4().hex
+            fecha_venta = time.strftime('%Y-%m-%d')
             try:
-                venta_payload = {"fecha_venta": time.strftime('%Y-%m-%d'), "id_cliente": client_id, "total": total}
-                r = SESSION.post(f"{API_URL}/ventas", json=venta_payload, timeout=6)
-                if r.status_code != 201:
-                    err = f"Error creando venta: {r.status_code} {r.text}"
+                success, msg, _ = submit_sale(clave, client_id, fecha_venta, items)
+                if not success:
+                    err = msg
+            except OfflineError as e:
+                cache = get_local_cache()
+                if cache:
+                    # Sin conexión: guardar la venta y reenviarla cuando vuelva la API
+                    cache.enqueue_sale(clave, client_id, fecha_venta, items)
+                    success, msg = True, 'API no disponible: la venta se guardó y se enviará automáticamente al recuperar la conexión.'
                 else:
-                    venta_id = r.json().get('id')
-                    # crear detalles
-                    for it in items:
-                        detalle = {"id_venta": venta_id, "id_producto": int(it['id_producto']), "cantidad": int(it['cantidad']), "precio_unitario": float(it['precio_unitario'])}
-                        rd = SESSION.post(f"{API_URL}/detalle_ventas", json=detalle, timeout=6)
-                        if rd.status_code != 201:
-                            err = f"Error creando detalle para producto {it['id_producto']}: {rd.status_code} {rd.text}"
-                            break
-                if not err:
-                    success = True
+                    err = f"Error de conexión: {e}"
             except Exception as e:
                 err = f"Error de conexión: {e}"
 
@@ -1166,21 +1963,142 @@ class MainApp(ctk.CTk):
                     except Exception:
                         # Si falla cualquier recarga, marcar productos como sucios
                         self._products_dirty = True
+                    self._update_pending_label()
                     if callback:
-                        callback(True, f'Venta registrada (total: {total:.2f})')
+                        callback(True, msg)
                 else:
                     if callback:
                         callback(False, err or 'Error desconocido')
 
+            GUI_EXECUTOR.call_soon(ui_cb)
+
+        GUI_EXECUTOR.submit(worker)
+
+    # ---------------- Alertas de existencias mínimas (SSE) ----------------
+    def _watch_low_stock(self):
+        """Mantiene abierta la suscripción a /reportes/existencias_minimas/stream, reconectando si se corta."""
+        backoff = 1
+        while not self._closing:
             try:
-                self.after(0, ui_cb)
-            except Exception:
-                pass
+                with SESSION.get(f"{API_URL}/reportes/existencias_minimas/stream", stream=True) as r:
+                    if r.status_code != 200:
+                        raise RuntimeError(f"HTTP {r.status_code}")
+                    backoff = 1
+                    for event, data in iter_sse_events(r):
+                        if self._closing:
+                            return
+                        try:
+                            payload = json.loads(data)
+                        except ValueError:
+                            continue
+                        GUI_EXECUTOR.call_soon(lambda ev=event, p=payload: self._on_low_stock_event(ev, p))
+            except Exception as e:
+                print(f"Stream de existencias mínimas desconectado: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _on_low_stock_event(self, event, payload):
+        """Aplica un evento del stream de existencias mínimas (hilo principal)."""
+        if event == 'snapshot':
+            self._low_stock = {p['id']: p for p in payload}
+        elif event == 'alerta':
+            self._low_stock[payload['id']] = payload
+        elif event == 'normalizado':
+            self._low_stock.pop(payload['id'], None)
+        else:
+            return
+        try:
+            if not self._low_stock:
+                self.low_stock_label.configure(text="")
+            elif event == 'alerta':
+                self.low_stock_label.configure(text=f"Stock bajo: {payload['nombre']} ({payload['stock']}/{payload['stock_minimo']}) · total {len(self._low_stock)}", text_color="#d9534f")
+                self.bell()
+            else:
+                self.low_stock_label.configure(text=f"Productos bajo mínimo: {len(self._low_stock)}", text_color="#d9534f")
+        except Exception:
+            pass
 
-        threading.Thread(target=worker, daemon=True).start()
+    # ---------------- Diagnóstico de la conexión ----------------
+    def open_diagnostics(self):
+        """Muestra latencias por clase de endpoint, presupuesto de reintentos y configuración de la sesión."""
+        if getattr(self, 'diagnostics_window', None) is not None and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.focus()
+            return
+
+        win = self.diagnostics_window = ctk.CTkToplevel(self)
+        win.title("Diagnóstico")
+        win.geometry("620x320")
+
+        info = ctk.CTkLabel(win, text="", justify="left", anchor="w")
+        info.pack(fill="x", padx=10, pady=(10, 5))
+
+        cols = [('clase', 'Clase', 110), ('peticiones', 'Peticiones', 90), ('errores', 'Errores', 70),
+                ('p50_ms', 'p50 (ms)', 80), ('p95_ms', 'p95 (ms)', 80), ('max_ms', 'Máx (ms)', 80)]
+        tree = ttk.Treeview(win, show="headings", columns=[c[0] for c in cols])
+        for col, text, width in cols:
+            tree.heading(col, text=text)
+            tree.column(col, width=width, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def refresh():
+            if not win.winfo_exists():
+                return
+            budget = SESSION.budget.stats() if SESSION.budget else {}
+            timeouts = ', '.join(f"{k} {c:g}/{r:g}s" for k, (c, r) in TIMEOUTS.items())
+            info.configure(text=(
+                f"API: {API_URL} · pool {SESSION.pool_size} conexiones · keep-alive {'sí' if SESSION.keep_alive else 'no'}\n"
+                f"Reintentos (últimos {SESSION.budget.window:g}s): {budget.get('reintentos', 0)} usados, "
+                f"{budget.get('disponibles', 0)} disponibles, {budget.get('rechazados', 0)} rechazados\n"
+                f"Timeouts (conexión/lectura): {timeouts}"
+            ))
+            for ch in tree.get_children():
+                tree.delete(ch)
+            for clase, m in sorted(SESSION.stats.snapshot().items()):
+                tree.insert("", "end", values=(clase, m['peticiones'], m['errores'], m['p50_ms'], m['p95_ms'], m['max_ms']))
+            win.after(1000, refresh)
+
+        refresh()
+
+    # ---------------- Ventas sin conexión ----------------
+    def _replay_pending_sales(self, interval=15, batch=20):
+        """Reenvía por lotes las ventas encoladas sin conexión cuando la API vuelve a responder."""
+        cache = get_local_cache()
+        if not cache:
+            return
+        while not self._closing:
+            time.sleep(interval)
+            pending = cache.pending_sales(batch)
+            if not pending or not api_is_up(API_URL)[0]:
+                continue
+            sent = 0
+            for venta in pending:
+                try:
+                    ok, msg, reintentable = submit_sale(venta['clave'], venta['id_cliente'], venta['fecha_venta'], venta['items'])
+                except OfflineError:
+                    break  # se cortó otra vez; se reintenta en el próximo ciclo
+                if ok:
+                    cache.sale_sent(venta['id'])
+                    sent += 1
+                elif reintentable:
+                    cache.sale_failed(venta['id'], msg)
+                else:
+                    cache.sale_rejected(venta['id'], msg)
+            if sent:
+                self._products_dirty = True
+            GUI_EXECUTOR.call_soon(self._update_pending_label)
+
+    def _update_pending_label(self):
+        cache = get_local_cache()
+        n = cache.count_pending() if cache else 0
+        try:
+            self.pending_label.configure(text=f"Ventas sin enviar: {n}" if n else "", text_color="#f0ad4e")
+        except Exception:
+            pass
 
     def on_close(self):
         """Maneja el cierre de la ventana principal."""
+        self._closing = True
+        GUI_EXECUTOR.shutdown()
         if self._api_proc: # Si la GUI inició la API, la termina
             try:
                 print("Terminando proceso de API...")
@@ -1198,6 +2116,7 @@ class MainApp(ctk.CTk):
             return {
                 "title": "Detalle del Producto",
                 "fields": {
+                    "codigo": ["Código de barras / SKU", str, False],
                     "nombre": ["Nombre", str, True],
                     "descripcion": ["Descripción", str, False],
                     "precio_compra": ["Precio Compra", float, True],
@@ -1208,6 +2127,7 @@ class MainApp(ctk.CTk):
                 },
                 "cols_map": {
                     "id": ["ID", 50],
+                    "codigo": ["Código", 100],
                     "nombre": ["Nombre", 150],
                     "descripcion": ["Descripción", 200],
                     "precio_compra": ["P. Compra", 80],
@@ -1306,12 +2226,17 @@ class MainApp(ctk.CTk):
 
 # --- Bloque para ejecutar la GUI ---
 if __name__ == "__main__":
+    # Antes de crear la ventana raíz: la marca mide sólo la carga de módulos
+    STARTUP.mark('imports')
     ctk.set_appearance_mode("System")
     ctk.set_default_color_theme("blue")
 
     root = ctk.CTk()
     root.withdraw() # Ocultar la ventana raíz principal
 
+    # Comprobar/arrancar la API en segundo plano mientras el login ya está en pantalla
+    API_BOOTSTRAP.start()
+
     # Mostrar ventana de Login
     login_window = LoginWindow(root)
     
@@ -1321,6 +2246,10 @@ if __name__ == "__main__":
         while True:
             if not login_window.winfo_exists():
                 break
+            if STARTUP.exit_when_ready and STARTUP.done():
+                # Modo medición: no esperar al usuario
+                login_window.destroy()
+                break
             root.update()
             _time.sleep(0.05)
     except Exception:
@@ -1329,6 +2258,7 @@ if __name__ == "__main__":
         except Exception:
             pass
 
+    STARTUP.report()
     if getattr(login_window, 'user', None):
         # Si el login es exitoso, mostrar la app principal
         app = MainApp(user_role=login_window.user.get('rol', 'vendedor'))
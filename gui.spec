@@ -1,11 +1,14 @@
 # -*- mode: python ; coding: utf-8 -*-
+# Tiempo de arranque en frío del ejecutable generado:
+#   dist/gui --medir-arranque            (imprime las marcas y se cierra solo)
+#   GUI_STARTUP_LOG=arranque.jsonl dist/gui --medir-arranque   (además las acumula en un archivo)
 
 
 a = Analysis(
     ['gui.py'],
     pathex=[],
     binaries=[],
-    datas=[('app_compacto.py', '.'), ('requirements.txt', '.')],
+    datas=[('app_compacto.py', '.'), ('sqlite_backend.py', '.'), ('analitica.py', '.'), ('db_schema.sql', '.'), ('requirements.txt', '.')],
     hiddenimports=['customtkinter', 'tkinter'],
     hookspath=[],
     hooksconfig={},
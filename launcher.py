@@ -1,30 +1,84 @@
 import threading
-import time
 import os
 import sys
 
 # Iniciar la API en un hilo y luego arrancar la GUI
-def start_api_in_thread(host='127.0.0.1', port=5000):
+def start_api_in_thread(host='127.0.0.1', port=5000, on_ready=None):
+    """Arranca la API en un hilo.
+
+    `on_ready(info)` se llama (desde otro hilo) en cuanto el socket escucha y se ha
+    comprobado la base de datos, con el resultado de `check_readiness()`; si no se pudo
+    abrir el puerto, info['listening'] es False. Así la GUI recibe la señal de listo sin
+    dormir ni sondear /health.
+    """
     try:
-        from app_compacto import create_app
+        from app_compacto import create_app, check_readiness, serve
     except Exception as e:
         print(f"No se pudo importar app_compacto: {e}")
         return None
 
     app = create_app()
+    listening = threading.Event()
+    failure = []
 
     def run_app():
         # Evitar debug=True en build distribuido
-        app.run(host=host, port=port, debug=False)
+        try:
+            serve(app, host=host, port=port, on_listening=listening.set)
+        except Exception as e:
+            failure.append(e)
+            listening.set()
 
     t = threading.Thread(target=run_app, daemon=True)
     t.start()
-    # Dar un breve tiempo para que el server arranque
-    time.sleep(0.5)
+
+    def handoff():
+        listening.wait()
+        if failure:
+            info = {'status': 'unavailable', 'listening': False, 'error': f"No se pudo abrir {host}:{port}: {failure[0]}"}
+        else:
+            info = check_readiness(timeout=5)
+            info['listening'] = True
+        if on_ready is not None:
+            on_ready(info)
+
+    threading.Thread(target=handoff, daemon=True).start()
     return t
 
 
-def start_gui():
+class ApiHandoff:
+    """Resultado del arranque de la API, entregado a la GUI cuando esté disponible."""
+
+    def __init__(self, api_url):
+        self.api_url = api_url
+        self.info = None
+        self.event = threading.Event()
+
+    def set(self, info):
+        self.info = info
+        self.event.set()
+
+    def deliver_to(self, gui):
+        """Espera (en un hilo) la señal de la API y se la pasa a gui.API_BOOTSTRAP."""
+        def wait_and_signal():
+            self.event.wait()
+            info = self.info or {}
+            if not info.get('listening'):
+                # El puerto estaba ocupado (¿otra instancia?): comprobar esa API por HTTP
+                print(info.get('error'))
+                gui.API_BOOTSTRAP.spawn = False
+                gui.API_BOOTSTRAP.start()
+                return
+            gui.API_URL = self.api_url
+            db_error = None
+            if info.get('status') != 'ready':
+                db_error = f"La API no puede acceder a la base de datos: {info.get('error')}"
+            gui.API_BOOTSTRAP.signal_ready(db_error=db_error)
+
+        threading.Thread(target=wait_and_signal, daemon=True).start()
+
+
+def start_gui(handoff=None):
     # Importar gui y reproducir su flujo de inicio (login -> MainApp)
     try:
         import gui
@@ -33,6 +87,13 @@ def start_gui():
         print(f"No se pudo importar gui o customtkinter: {e}")
         raise
 
+    if handoff is not None:
+        # La API se levanta en este proceso: recibir su señal de listo en lugar de sondear
+        handoff.deliver_to(gui)
+    else:
+        gui.API_BOOTSTRAP.start()
+    gui.STARTUP.mark('imports')
+
     # Crear root y mostrar login (copiado del bloque __main__ de gui.py)
     root = ctk.CTk()
     root.withdraw()
@@ -44,6 +105,9 @@ def start_gui():
         while True:
             if not login_window.winfo_exists():
                 break
+            if gui.STARTUP.exit_when_ready and gui.STARTUP.done():
+                login_window.destroy()
+                break
             root.update()
             _time.sleep(0.05)
     except Exception:
@@ -52,6 +116,7 @@ def start_gui():
         except Exception:
             pass
 
+    gui.STARTUP.report()
     if getattr(login_window, 'user', None):
         app = gui.MainApp(user_role=login_window.user.get('rol', 'vendedor'))
         app.mainloop()
@@ -65,9 +130,11 @@ def main():
     port = int(os.getenv('API_PORT', '5000'))
 
     print(f"Iniciando API en background en {host}:{port}...")
-    start_api_in_thread(host=host, port=port)
+    handoff = ApiHandoff(f"http://{host}:{port}")
+    if start_api_in_thread(host=host, port=port, on_ready=handoff.set) is None:
+        handoff = None
     print("Lanzando GUI...")
-    start_gui()
+    start_gui(handoff)
 
 
 if __name__ == '__main__':
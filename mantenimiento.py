@@ -0,0 +1,341 @@
+"""Tareas de mantenimiento de la base de datos (particiones, archivo de ventas, kardex, pronóstico, valoración y claves de venta).
+
+Usa la misma configuración que la API (.env / DB_HOST, DB_USER, DB_PASSWORD, DB_NAME).
+Los comandos que cambian datos incrementan al terminar Version_Datos (`migrate_version_datos.sql`),
+así la API deja de servir los reportes y listados que tenía cacheados.
+`particiones` y `archivar` requieren haber aplicado `migrate_particionar_ventas.sql`;
+`snapshots`, `migrate_kardex.sql`; `pronostico`, `migrate_pronostico.sql`;
+`valoracion`, `migrate_valoracion.sql`; `claves`, `migrate_ventas_claves.sql`.
+
+    python mantenimiento.py particiones [--meses 3]
+        Crea en Ventas y Detalle_Ventas las particiones de los próximos meses dividiendo
+        `p_futuro`. Conviene ejecutarlo una vez al mes (cron / Programador de tareas).
+
+    python mantenimiento.py archivar [--meses 12 | --antes-de 2025-01] [--dry-run]
+        Copia a Ventas_Archivo y Detalle_Ventas_Archivo (comprimidas) los meses cerrados
+        anteriores al corte y elimina sus particiones. Los reportes siguen incluyéndolos.
+
+    python mantenimiento.py snapshots [--dry-run]
+        Guarda en Snapshots_Stock el stock actual de los productos con movimientos desde su
+        última foto. Conviene ejecutarlo a diario: el reporte kardex sólo recorre los
+        movimientos posteriores a la foto más cercana.
+
+    python mantenimiento.py pronostico [--dias 180] [--alpha 0.3] [--procesos N] [--dry-run]
+        Pronostica la demanda diaria de cada producto con suavizado exponencial sobre las
+        ventas de los últimos días y guarda en Pronosticos_Demanda la demanda, su desviación y
+        el stock_minimo sugerido. Con --procesos reparte los productos entre varios procesos.
+
+    python mantenimiento.py valoracion [--corregir]
+        Compara los totales de Valoracion_Inventario que mantiene la API con la suma real de
+        stock * precio_compra por proveedor. Con --corregir reemplaza los que no cuadran.
+
+    python mantenimiento.py claves [--dias 90] [--dry-run]
+        Borra de Ventas_Claves las claves de POST /ventas/completa con más de N días. Una
+        venta encolada sin conexión durante más tiempo ya no se reconocería al reenviarla.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import analitica
+import app_compacto
+
+# Tablas particionadas -> tabla de archivo y columnas copiadas
+TABLAS_ARCHIVO = {
+    'Ventas': ('Ventas_Archivo', ('id_venta', 'fecha_venta', 'id_cliente', 'total')),
+    'Detalle_Ventas': ('Detalle_Ventas_Archivo', ('id_detalle', 'id_venta', 'fecha_venta', 'id_producto', 'cantidad', 'precio_unitario', 'costo_unitario')),
+}
+PARTICION_FUTURO = 'p_futuro'
+
+# Foto de los productos cuyo último movimiento es posterior a su última foto. Los movimientos
+# de un producto se escriben con su fila bloqueada (FOR UPDATE), así que su stock y su último
+# id de movimiento confirmados siempre corresponden entre sí.
+SQL_PRODUCTOS_CON_MOVIMIENTOS = (
+    'FROM Productos p '
+    'JOIN (SELECT id_producto, MAX(id_movimiento) AS ultimo FROM Movimientos_Stock GROUP BY id_producto) m '
+    'ON m.id_producto = p.id_producto '
+    'WHERE m.ultimo > COALESCE((SELECT MAX(s.id_movimiento) FROM Snapshots_Stock s WHERE s.id_producto = p.id_producto), 0)'
+)
+
+# Valor real del inventario por proveedor (0 = sin proveedor): el recorrido completo que la
+# valoración mantenida evita en cada consulta
+SQL_VALORACION_REAL = (
+    'SELECT COALESCE(id_proveedor, 0), SUM(stock), SUM(stock * precio_compra) '
+    'FROM Productos GROUP BY COALESCE(id_proveedor, 0)'
+)
+# Diferencias menores a medio centavo se deben al redondeo, no a un ajuste perdido
+TOLERANCIA_VALOR = 0.005
+
+
+def add_months(d: date, months: int) -> date:
+    """Primer día del mes que está `months` meses después (o antes) del mes de `d`."""
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'p{month.year}{month.month:02d}'
+
+
+def parse_bound(description):
+    """Límite superior de una partición RANGE COLUMNS: date, o None para MAXVALUE."""
+    value = str(description).strip().strip("'")
+    if value.upper() == 'MAXVALUE':
+        return None
+    return date.fromisoformat(value)
+
+
+def plan_new_partitions(partitions, today: date, months_ahead: int):
+    """Particiones mensuales a crear para cubrir hasta `months_ahead` meses tras el actual.
+
+    partitions: lista [(nombre, límite superior o None)] en orden.
+    Retorna [(nombre, límite)] a insertar antes de p_futuro.
+    """
+    bounds = [b for _, b in partitions if b is not None]
+    next_start = max(bounds) if bounds else add_months(today, 0)
+    target = add_months(today, months_ahead + 1)
+    plan = []
+    while next_start < target:
+        plan.append((partition_name(next_start), add_months(next_start, 1)))
+        next_start = add_months(next_start, 1)
+    return plan
+
+
+def closed_partitions(partitions, cutoff: date):
+    """Particiones cuyo rango termina en o antes de `cutoff` (primer día del primer mes que se conserva)."""
+    return [(name, bound) for name, bound in partitions if bound is not None and bound <= cutoff]
+
+
+def read_partitions(cur, table):
+    cur.execute(
+        'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+        'ORDER BY PARTITION_ORDINAL_POSITION', (table,))
+    return [(name, parse_bound(desc)) for name, desc in cur.fetchall()]
+
+
+def cmd_particiones(conn, args):
+    cur = conn.cursor()
+    for table in TABLAS_ARCHIVO:
+        partitions = read_partitions(cur, table)
+        if not partitions:
+            sys.exit(f'{table} no está particionada: aplica migrate_particionar_ventas.sql')
+        plan = plan_new_partitions(partitions, date.today(), args.meses)
+        if not plan:
+            print(f'{table}: particiones al día (última {partitions[-2][0] if len(partitions) > 1 else partitions[-1][0]})')
+            continue
+        nuevas = ', '.join(f"PARTITION {name} VALUES LESS THAN ('{bound.isoformat()}')" for name, bound in plan)
+        sql = (f'ALTER TABLE {table} REORGANIZE PARTITION {PARTICION_FUTURO} INTO '
+               f'({nuevas}, PARTITION {PARTICION_FUTURO} VALUES LESS THAN (MAXVALUE))')
+        print(f"{table}: creando {', '.join(name for name, _ in plan)}")
+        if not args.dry_run:
+            cur.execute(sql)
+    cur.close()
+
+
+def cmd_archivar(conn, args):
+    if args.antes_de:
+        cutoff = date.fromisoformat(f'{args.antes_de}-01')
+    else:
+        cutoff = add_months(date.today(), -args.meses)
+    cur = conn.cursor()
+    # Ambas tablas usan las mismas particiones; se archiva partición a partición
+    to_archive = closed_partitions(read_partitions(cur, 'Ventas'), cutoff)
+    if not to_archive:
+        print(f'No hay meses cerrados antes de {cutoff.isoformat()} para archivar.')
+        return
+    for name, bound in to_archive:
+        counts = {}
+        for table, (archive, columns) in TABLAS_ARCHIVO.items():
+            cur.execute(f'SELECT COUNT(*) FROM {table} PARTITION ({name})')
+            counts[table] = cur.fetchone()[0]
+        resumen = ', '.join(f'{n} filas de {t}' for t, n in counts.items())
+        print(f'{name} (hasta {bound.isoformat()}): {resumen}')
+        if args.dry_run:
+            continue
+        # Copia en una transacción; INSERT IGNORE permite repetir el comando si se cortó
+        # después de copiar y antes de eliminar la partición
+        for table, (archive, columns) in TABLAS_ARCHIVO.items():
+            cols = ', '.join(columns)
+            cur.execute(f'INSERT IGNORE INTO {archive} ({cols}) SELECT {cols} FROM {table} PARTITION ({name})')
+        conn.commit()
+        for table, (archive, columns) in TABLAS_ARCHIVO.items():
+            pk = columns[0]
+            cur.execute(f'SELECT COUNT(*) FROM {table} PARTITION ({name}) t '
+                        f'WHERE NOT EXISTS (SELECT 1 FROM {archive} a WHERE a.{pk} = t.{pk} AND a.fecha_venta = t.fecha_venta)')
+            missing = cur.fetchone()[0]
+            if missing:
+                sys.exit(f'{table}: {missing} filas de {name} no están en {archive}; no se elimina la partición')
+        for table in TABLAS_ARCHIVO:
+            cur.execute(f'ALTER TABLE {table} DROP PARTITION {name}')
+        print(f'{name}: archivada')
+    cur.close()
+
+
+def cmd_snapshots(conn, args):
+    cur = conn.cursor()
+    if args.dry_run:
+        cur.execute(f'SELECT COUNT(*) {SQL_PRODUCTOS_CON_MOVIMIENTOS}')
+        print(f'{cur.fetchone()[0]} productos con movimientos desde su última foto')
+    else:
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cur.execute('INSERT INTO Snapshots_Stock (id_producto, fecha, stock, id_movimiento) '
+                    f'SELECT p.id_producto, %s, p.stock, m.ultimo {SQL_PRODUCTOS_CON_MOVIMIENTOS}', (fecha,))
+        conn.commit()
+        print(f'{cur.rowcount} productos: foto de stock a {fecha}')
+    cur.close()
+
+
+def cmd_pronostico(conn, args):
+    if not analitica.disponible():
+        sys.exit('numpy/pandas no están instalados: pip install pandas')
+    # Sólo días completos: el historial termina ayer
+    hasta = date.today()
+    desde = hasta - timedelta(days=args.dias)
+    t0 = time.perf_counter()
+    ids, matriz = analitica.cargar_historial(conn, desde, hasta)
+    t1 = time.perf_counter()
+    demanda, desviacion, sugerido = analitica.pronosticar(matriz, args.alpha, args.lead_time, args.z, args.procesos)
+    t2 = time.perf_counter()
+    print(f'{len(ids)} productos, {args.dias} días desde {desde.isoformat()}: '
+          f'lectura {t1 - t0:.2f} s, cálculo {t2 - t1:.2f} s')
+    if args.dry_run:
+        return
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    n = analitica.guardar_pronostico(conn, ids, demanda, desviacion, sugerido, fecha)
+    print(f'{n} pronósticos guardados en Pronosticos_Demanda ({time.perf_counter() - t2:.2f} s)')
+
+
+def valuation_differences(reales, guardados):
+    """Proveedores cuyos totales guardados no cuadran con los reales.
+
+    reales, guardados: {id_proveedor: (unidades, valor)}.
+    Retorna [(id_proveedor, guardado, real)] ordenado por proveedor; los que faltan cuentan como (0, 0).
+    """
+    diferencias = []
+    for id_proveedor in sorted(set(reales) | set(guardados)):
+        guardado = guardados.get(id_proveedor, (0, 0.0))
+        real = reales.get(id_proveedor, (0, 0.0))
+        if guardado[0] != real[0] or abs(guardado[1] - real[1]) >= TOLERANCIA_VALOR:
+            diferencias.append((id_proveedor, guardado, real))
+    return diferencias
+
+
+def cmd_valoracion(conn, args):
+    cur = conn.cursor()
+    # Bloquear los totales antes de leer Productos: una venta o ajuste en curso ya tiene su
+    # producto bloqueado y espera por el total de su proveedor, así que ni su cambio en Productos
+    # (sin confirmar) ni su ajuste aparecen en la comparación; se aplica después, sobre el total corregido.
+    cur.execute('SELECT id_proveedor, unidades, valor FROM Valoracion_Inventario ORDER BY id_proveedor FOR UPDATE')
+    guardados = {int(r[0]): (int(r[1]), float(r[2])) for r in cur.fetchall()}
+    cur.execute(SQL_VALORACION_REAL)
+    reales = {int(r[0]): (int(r[1] or 0), float(r[2] or 0)) for r in cur.fetchall()}
+    diferencias = valuation_differences(reales, guardados)
+    total = sum(v for _, v in reales.values())
+    if not diferencias:
+        conn.rollback()
+        print(f'Valoración al día: {len(reales)} proveedores, valor total {total:.2f}')
+        cur.close()
+        return
+    for id_proveedor, guardado, real in diferencias:
+        print(f'proveedor {id_proveedor}: guardado {guardado[0]} u. / {guardado[1]:.2f}, '
+              f'real {real[0]} u. / {real[1]:.2f}')
+    if args.corregir:
+        cur.executemany('REPLACE INTO Valoracion_Inventario (id_proveedor, unidades, valor) VALUES (%s, %s, %s)',
+                        [(id_proveedor, real[0], round(real[1], 2)) for id_proveedor, _, real in diferencias])
+        conn.commit()
+        print(f'{len(diferencias)} totales corregidos; valor total {total:.2f}')
+    else:
+        conn.rollback()
+        print(f'{len(diferencias)} totales no cuadran: ejecuta con --corregir para repararlos')
+    cur.close()
+
+
+def cmd_claves(conn, args):
+    corte = (datetime.now() - timedelta(days=args.dias)).strftime('%Y-%m-%d %H:%M:%S')
+    cur = conn.cursor()
+    if args.dry_run:
+        cur.execute('SELECT COUNT(*) FROM Ventas_Claves WHERE creada < %s', (corte,))
+        print(f'{cur.fetchone()[0]} claves de venta anteriores a {corte}')
+    else:
+        cur.execute('DELETE FROM Ventas_Claves WHERE creada < %s', (corte,))
+        conn.commit()
+        print(f'{cur.rowcount} claves de venta anteriores a {corte} borradas')
+    cur.close()
+
+
+def writes_data(args) -> bool:
+    """True si el comando cambió datos que la API puede tener cacheados (reportes, listados)."""
+    if getattr(args, 'dry_run', False):
+        return False
+    return args.comando in ('archivar', 'snapshots', 'pronostico') or (args.comando == 'valoracion' and args.corregir)
+
+
+def notify_api(conn):
+    """Incrementa Version_Datos: las APIs en marcha dejan de servir lo que tenían cacheado."""
+    try:
+        app_compacto.bump_db_version(conn)
+        conn.commit()
+    except Exception as e:
+        print(f'Aviso: no se pudo actualizar Version_Datos (aplique migrate_version_datos.sql): {e}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mantenimiento de la base de datos del inventario')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('particiones', help='crear las particiones de los próximos meses')
+    p.add_argument('--meses', type=int, default=3, help='meses por delante a cubrir (por defecto 3)')
+    p.add_argument('--dry-run', action='store_true', help='mostrar lo que se haría sin ejecutarlo')
+
+    a = sub.add_parser('archivar', help='mover los meses cerrados a las tablas de archivo')
+    corte = a.add_mutually_exclusive_group()
+    corte.add_argument('--meses', type=int, default=12, help='conservar los últimos N meses (por defecto 12)')
+    corte.add_argument('--antes-de', help='archivar los meses anteriores a YYYY-MM')
+    a.add_argument('--dry-run', action='store_true', help='mostrar lo que se haría sin ejecutarlo')
+
+    f = sub.add_parser('snapshots', help='guardar la foto de stock de los productos con movimientos')
+    f.add_argument('--dry-run', action='store_true', help='mostrar lo que se haría sin ejecutarlo')
+
+    r = sub.add_parser('pronostico', help='pronosticar la demanda y sugerir stock_minimo por producto')
+    r.add_argument('--dias', type=int, default=180, help='días de historial de ventas (por defecto 180)')
+    r.add_argument('--alpha', type=float, default=0.3, help='factor de suavizado entre 0 y 1 (por defecto 0.3)')
+    r.add_argument('--lead-time', type=float, default=float(os.getenv('ANALITICA_LEAD_TIME', 7)),
+                   help='días de entrega de un pedido (por defecto ANALITICA_LEAD_TIME o 7)')
+    r.add_argument('--z', type=float, default=float(os.getenv('ANALITICA_Z', 1.65)),
+                   help='factor del stock de seguridad (por defecto ANALITICA_Z o 1.65)')
+    r.add_argument('--procesos', type=int, default=1, help='procesos para catálogos grandes (por defecto 1)')
+    r.add_argument('--dry-run', action='store_true', help='calcular sin guardar')
+
+    v = sub.add_parser('valoracion', help='comparar la valoración mantenida con la suma real')
+    v.add_argument('--corregir', action='store_true', help='reemplazar los totales que no cuadran')
+
+    k = sub.add_parser('claves', help='borrar las claves de venta antiguas (POST /ventas/completa)')
+    k.add_argument('--dias', type=int, default=90, help='conservar las claves de los últimos N días (por defecto 90)')
+    k.add_argument('--dry-run', action='store_true', help='contar sin borrar')
+
+    args = parser.parse_args(argv)
+    conn = app_compacto.create_connection()
+    try:
+        if args.comando == 'particiones':
+            cmd_particiones(conn, args)
+        elif args.comando == 'snapshots':
+            cmd_snapshots(conn, args)
+        elif args.comando == 'pronostico':
+            cmd_pronostico(conn, args)
+        elif args.comando == 'valoracion':
+            cmd_valoracion(conn, args)
+        elif args.comando == 'claves':
+            cmd_claves(conn, args)
+        else:
+            cmd_archivar(conn, args)
+        if writes_data(args):
+            notify_api(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+-- Añade a Productos el código de barras / SKU (`codigo`) con índice único.
+--
+-- Ejecutar una sola vez sobre una base existente:
+--
+--   mariadb -u api_user -p inventario < migrate_codigo_productos.sql
+--
+-- La columna admite NULL (productos sin código) y el índice único permite varios NULL.
+-- La API busca por código en memoria (GET /productos/by-code/<codigo>); el índice garantiza
+-- que dos productos no compartan código y sirve la carga inicial de ese mapa.
+
+ALTER TABLE `Productos`
+  ADD COLUMN `codigo` varchar(64) DEFAULT NULL AFTER `nombre`,
+  ADD UNIQUE KEY `uq_productos_codigo` (`codigo`);
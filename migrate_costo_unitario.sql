@@ -0,0 +1,43 @@
+-- Guarda el costo unitario en cada línea de venta (Detalle_Ventas.costo_unitario) para que el
+-- reporte de ganancias use el precio de compra vigente al vender y no el actual de Productos.
+--
+-- Ejecutar una sola vez, después de `migrate_particionar_ventas.sql`:
+--
+--   mariadb -u api_user -p inventario < migrate_costo_unitario.sql
+--
+-- Las ventas existentes se completan con el último precio de compra registrado en
+-- Detalle_Compras hasta la fecha de la venta; si el producto no tiene compras previas se usa
+-- el precio_compra actual del producto. Las ventas nuevas lo guarda la API al insertarlas.
+
+-- 1) Columna nueva en las tablas de detalle (vivas y archivo)
+ALTER TABLE `Detalle_Ventas` ADD COLUMN `costo_unitario` decimal(10,2) NOT NULL DEFAULT 0.00 AFTER `precio_unitario`;
+ALTER TABLE `Detalle_Ventas_Archivo` ADD COLUMN `costo_unitario` decimal(10,2) NOT NULL DEFAULT 0.00 AFTER `precio_unitario`;
+
+-- 2) Relleno de las líneas existentes
+UPDATE `Detalle_Ventas` dv
+JOIN `Productos` p ON p.`id_producto` = dv.`id_producto`
+SET dv.`costo_unitario` = COALESCE((
+    SELECT dc.`precio_compra`
+    FROM `Detalle_Compras` dc JOIN `Compras` c ON c.`id_compra` = dc.`id_compra`
+    WHERE dc.`id_producto` = dv.`id_producto` AND c.`fecha_compra` <= dv.`fecha_venta`
+    ORDER BY c.`fecha_compra` DESC, dc.`id_detalle_compra` DESC
+    LIMIT 1), p.`precio_compra`);
+
+UPDATE `Detalle_Ventas_Archivo` dv
+JOIN `Productos` p ON p.`id_producto` = dv.`id_producto`
+SET dv.`costo_unitario` = COALESCE((
+    SELECT dc.`precio_compra`
+    FROM `Detalle_Compras` dc JOIN `Compras` c ON c.`id_compra` = dc.`id_compra`
+    WHERE dc.`id_producto` = dv.`id_producto` AND c.`fecha_compra` <= dv.`fecha_venta`
+    ORDER BY c.`fecha_compra` DESC, dc.`id_detalle_compra` DESC
+    LIMIT 1), p.`precio_compra`);
+
+-- 3) Índices cubrientes para el reporte de ganancias: el rango de fechas y todas las columnas
+--    que suma el reporte están en el índice, así se resuelve sin leer las filas de la tabla.
+--    Reemplazan a los índices (fecha_venta, id_producto), que son prefijo de los nuevos.
+ALTER TABLE `Detalle_Ventas`
+  DROP INDEX `idx_detalle_fecha_producto`,
+  ADD INDEX `idx_detalle_ganancias` (`fecha_venta`, `id_producto`, `cantidad`, `precio_unitario`, `costo_unitario`);
+ALTER TABLE `Detalle_Ventas_Archivo`
+  DROP INDEX `idx_detalle_archivo_fecha_producto`,
+  ADD INDEX `idx_detalle_archivo_ganancias` (`fecha_venta`, `id_producto`, `cantidad`, `precio_unitario`, `costo_unitario`);
@@ -0,0 +1,20 @@
+-- Índices para el historial de un cliente (GET /clientes/<id>/ventas) y de un proveedor
+-- (GET /proveedores/<id>/compras).
+--
+-- Ejecutar una sola vez, después de `migrate_particionar_ventas.sql`:
+--
+--   mariadb -u api_user -p inventario < migrate_historial_indices.sql
+--
+-- Con (id, fecha, total) cada página del historial y sus totales se resuelven con un recorrido
+-- de rango sobre el índice, sin leer las filas (la PK, que incluye el id de la venta o compra,
+-- ya está en cada entrada del índice). Reemplazan a los índices de una sola columna, que son
+-- prefijo de los nuevos; en Compras el nuevo índice sigue sirviendo a la clave foránea.
+
+ALTER TABLE `Ventas`
+  DROP INDEX `fk_cliente`,
+  ADD INDEX `idx_ventas_cliente_fecha` (`id_cliente`, `fecha_venta`, `total`);
+ALTER TABLE `Ventas_Archivo`
+  ADD INDEX `idx_ventas_archivo_cliente_fecha` (`id_cliente`, `fecha_venta`, `total`);
+ALTER TABLE `Compras`
+  ADD INDEX `idx_compras_proveedor_fecha` (`id_proveedor`, `fecha_compra`, `total`),
+  DROP INDEX `fk_proveedor_compra`;
@@ -0,0 +1,42 @@
+-- Kardex: movimientos de stock (solo se agregan filas) y fotos periódicas del stock por producto.
+--
+-- Ejecutar una sola vez sobre una base existente:
+--
+--   mariadb -u api_user -p inventario < migrate_kardex.sql
+--
+-- Cada venta, compra o ajuste de stock que hace la API inserta su movimiento en la misma
+-- transacción que cambia Productos.stock. `python mantenimiento.py snapshots` (por ejemplo,
+-- cada noche con cron) guarda el stock de los productos que tuvieron movimientos; el reporte
+-- /reportes/kardex parte de la foto más cercana y sólo suma los movimientos posteriores.
+--
+-- El historial empieza al aplicar la migración: el stock actual de cada producto se registra
+-- como un ajuste inicial y como su primera foto.
+
+CREATE TABLE IF NOT EXISTS `Movimientos_Stock` (
+  `id_movimiento` int(11) NOT NULL AUTO_INCREMENT,
+  `id_producto` int(11) NOT NULL,
+  `fecha` datetime NOT NULL,
+  `tipo` enum('venta','compra','ajuste') NOT NULL,
+  `cantidad` int(11) NOT NULL,
+  `referencia` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id_movimiento`),
+  KEY `idx_movimientos_producto` (`id_producto`,`id_movimiento`,`fecha`,`cantidad`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `Snapshots_Stock` (
+  `id_producto` int(11) NOT NULL,
+  `fecha` datetime NOT NULL,
+  `stock` int(11) NOT NULL,
+  `id_movimiento` int(11) NOT NULL,
+  PRIMARY KEY (`id_producto`,`fecha`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Saldo inicial
+SET @inicio = NOW();
+INSERT INTO `Movimientos_Stock` (`id_producto`, `fecha`, `tipo`, `cantidad`)
+SELECT `id_producto`, @inicio, 'ajuste', `stock` FROM `Productos` WHERE `stock` <> 0;
+
+INSERT INTO `Snapshots_Stock` (`id_producto`, `fecha`, `stock`, `id_movimiento`)
+SELECT p.`id_producto`, @inicio, p.`stock`, COALESCE(MAX(m.`id_movimiento`), 0)
+FROM `Productos` p LEFT JOIN `Movimientos_Stock` m ON m.`id_producto` = p.`id_producto`
+GROUP BY p.`id_producto`, p.`stock`;
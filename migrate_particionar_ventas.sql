@@ -0,0 +1,121 @@
+-- Particiona Ventas y Detalle_Ventas por mes de `fecha_venta` y crea las tablas de archivo.
+--
+-- Ejecutar una sola vez sobre una base creada con la versión anterior de `db_schema.sql`:
+--
+--   mariadb -u api_user -p inventario < migrate_particionar_ventas.sql
+--
+-- Después:
+--   python mantenimiento.py particiones          # crea las particiones de los próximos meses (mensual, p.ej. cron)
+--   python mantenimiento.py archivar --meses 12  # mueve a *_Archivo los meses cerrados hace más de 12 meses
+--
+-- Restricciones de MariaDB para tablas particionadas:
+--   * la columna de partición debe formar parte de todas las claves únicas: PK (id, fecha_venta);
+--   * InnoDB no admite claves foráneas en tablas particionadas ni hacia ellas. La API valida la
+--     venta al insertar el detalle, mantiene el "ON DELETE SET NULL" de clientes e impide borrar
+--     productos con ventas, también los que se borrarían en cascada al borrar su proveedor.
+
+SET FOREIGN_KEY_CHECKS = 0;
+
+-- 1) Detalle_Ventas lleva la fecha de su venta (misma clave de partición que Ventas)
+ALTER TABLE `Detalle_Ventas` ADD COLUMN `fecha_venta` date DEFAULT NULL AFTER `id_venta`;
+UPDATE `Detalle_Ventas` dv JOIN `Ventas` v ON v.`id_venta` = dv.`id_venta` SET dv.`fecha_venta` = v.`fecha_venta`;
+-- Detalles sin venta (id_venta NULL): quedan en la partición más antigua
+UPDATE `Detalle_Ventas` SET `fecha_venta` = '1970-01-01' WHERE `fecha_venta` IS NULL;
+ALTER TABLE `Detalle_Ventas` MODIFY `fecha_venta` date NOT NULL;
+
+-- 2) Quitar las claves foráneas (se conservan los índices)
+ALTER TABLE `Detalle_Ventas` DROP FOREIGN KEY `fk_venta`, DROP FOREIGN KEY `fk_producto`;
+ALTER TABLE `Ventas` DROP FOREIGN KEY `fk_cliente`;
+
+-- 3) Claves primarias con la fecha e índices para los reportes por rango
+ALTER TABLE `Ventas`
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id_venta`, `fecha_venta`),
+  ADD KEY `idx_ventas_fecha` (`fecha_venta`);
+ALTER TABLE `Detalle_Ventas`
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id_detalle`, `fecha_venta`),
+  ADD KEY `idx_detalle_fecha_producto` (`fecha_venta`, `id_producto`);
+
+-- 4) Particiones mensuales. `p_futuro` recoge lo que aún no tiene partición propia;
+--    `mantenimiento.py particiones` la divide antes de que empiece cada mes.
+ALTER TABLE `Ventas` PARTITION BY RANGE COLUMNS (`fecha_venta`) (
+  PARTITION p_antiguo VALUES LESS THAN ('2025-01-01'),
+  PARTITION p202501 VALUES LESS THAN ('2025-02-01'),
+  PARTITION p202502 VALUES LESS THAN ('2025-03-01'),
+  PARTITION p202503 VALUES LESS THAN ('2025-04-01'),
+  PARTITION p202504 VALUES LESS THAN ('2025-05-01'),
+  PARTITION p202505 VALUES LESS THAN ('2025-06-01'),
+  PARTITION p202506 VALUES LESS THAN ('2025-07-01'),
+  PARTITION p202507 VALUES LESS THAN ('2025-08-01'),
+  PARTITION p202508 VALUES LESS THAN ('2025-09-01'),
+  PARTITION p202509 VALUES LESS THAN ('2025-10-01'),
+  PARTITION p202510 VALUES LESS THAN ('2025-11-01'),
+  PARTITION p202511 VALUES LESS THAN ('2025-12-01'),
+  PARTITION p202512 VALUES LESS THAN ('2026-01-01'),
+  PARTITION p202601 VALUES LESS THAN ('2026-02-01'),
+  PARTITION p202602 VALUES LESS THAN ('2026-03-01'),
+  PARTITION p202603 VALUES LESS THAN ('2026-04-01'),
+  PARTITION p202604 VALUES LESS THAN ('2026-05-01'),
+  PARTITION p202605 VALUES LESS THAN ('2026-06-01'),
+  PARTITION p202606 VALUES LESS THAN ('2026-07-01'),
+  PARTITION p202607 VALUES LESS THAN ('2026-08-01'),
+  PARTITION p202608 VALUES LESS THAN ('2026-09-01'),
+  PARTITION p202609 VALUES LESS THAN ('2026-10-01'),
+  PARTITION p202610 VALUES LESS THAN ('2026-11-01'),
+  PARTITION p202611 VALUES LESS THAN ('2026-12-01'),
+  PARTITION p202612 VALUES LESS THAN ('2027-01-01'),
+  PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+);
+ALTER TABLE `Detalle_Ventas` PARTITION BY RANGE COLUMNS (`fecha_venta`) (
+  PARTITION p_antiguo VALUES LESS THAN ('2025-01-01'),
+  PARTITION p202501 VALUES LESS THAN ('2025-02-01'),
+  PARTITION p202502 VALUES LESS THAN ('2025-03-01'),
+  PARTITION p202503 VALUES LESS THAN ('2025-04-01'),
+  PARTITION p202504 VALUES LESS THAN ('2025-05-01'),
+  PARTITION p202505 VALUES LESS THAN ('2025-06-01'),
+  PARTITION p202506 VALUES LESS THAN ('2025-07-01'),
+  PARTITION p202507 VALUES LESS THAN ('2025-08-01'),
+  PARTITION p202508 VALUES LESS THAN ('2025-09-01'),
+  PARTITION p202509 VALUES LESS THAN ('2025-10-01'),
+  PARTITION p202510 VALUES LESS THAN ('2025-11-01'),
+  PARTITION p202511 VALUES LESS THAN ('2025-12-01'),
+  PARTITION p202512 VALUES LESS THAN ('2026-01-01'),
+  PARTITION p202601 VALUES LESS THAN ('2026-02-01'),
+  PARTITION p202602 VALUES LESS THAN ('2026-03-01'),
+  PARTITION p202603 VALUES LESS THAN ('2026-04-01'),
+  PARTITION p202604 VALUES LESS THAN ('2026-05-01'),
+  PARTITION p202605 VALUES LESS THAN ('2026-06-01'),
+  PARTITION p202606 VALUES LESS THAN ('2026-07-01'),
+  PARTITION p202607 VALUES LESS THAN ('2026-08-01'),
+  PARTITION p202608 VALUES LESS THAN ('2026-09-01'),
+  PARTITION p202609 VALUES LESS THAN ('2026-10-01'),
+  PARTITION p202610 VALUES LESS THAN ('2026-11-01'),
+  PARTITION p202611 VALUES LESS THAN ('2026-12-01'),
+  PARTITION p202612 VALUES LESS THAN ('2027-01-01'),
+  PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+);
+
+-- 5) Tablas de archivo (comprimidas) para los periodos cerrados
+CREATE TABLE IF NOT EXISTS `Ventas_Archivo` (
+  `id_venta` int(11) NOT NULL,
+  `fecha_venta` date NOT NULL,
+  `id_cliente` int(11) DEFAULT NULL,
+  `total` decimal(10,2) NOT NULL,
+  PRIMARY KEY (`id_venta`, `fecha_venta`),
+  KEY `idx_ventas_archivo_fecha` (`fecha_venta`)
+) ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `Detalle_Ventas_Archivo` (
+  `id_detalle` int(11) NOT NULL,
+  `id_venta` int(11) DEFAULT NULL,
+  `fecha_venta` date NOT NULL,
+  `id_producto` int(11) DEFAULT NULL,
+  `cantidad` int(11) NOT NULL,
+  `precio_unitario` decimal(10,2) NOT NULL,
+  PRIMARY KEY (`id_detalle`, `fecha_venta`),
+  KEY `idx_detalle_archivo_fecha_producto` (`fecha_venta`, `id_producto`),
+  KEY `idx_detalle_archivo_producto` (`id_producto`)
+) ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+SET FOREIGN_KEY_CHECKS = 1;
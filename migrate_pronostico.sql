@@ -0,0 +1,19 @@
+-- Pronóstico de demanda por producto (`python mantenimiento.py pronostico`).
+--
+-- Ejecutar una sola vez sobre una base existente:
+--
+--   mariadb -u api_user -p inventario < migrate_pronostico.sql
+--
+-- El comando recalcula todas las filas en cada ejecución (por ejemplo, cada noche con cron).
+-- La API las muestra en /reportes/pronostico y POST /pronosticos/aplicar copia el
+-- stock_minimo sugerido a Productos.
+
+CREATE TABLE IF NOT EXISTS `Pronosticos_Demanda` (
+  `id_producto` int(11) NOT NULL,
+  `fecha_calculo` datetime NOT NULL,
+  `demanda_diaria` decimal(12,4) NOT NULL,
+  `desviacion` decimal(12,4) NOT NULL,
+  `stock_minimo_sugerido` int(11) NOT NULL,
+  PRIMARY KEY (`id_producto`),
+  CONSTRAINT `fk_pronostico_producto` FOREIGN KEY (`id_producto`) REFERENCES `Productos` (`id_producto`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
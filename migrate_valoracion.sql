@@ -0,0 +1,22 @@
+-- Valoración del inventario: totales de stock * precio_compra por proveedor.
+--
+-- Ejecutar una sola vez, con la API detenida:
+--
+--   mariadb -u api_user -p inventario < migrate_valoracion.sql
+--
+-- La API ajusta la fila del proveedor en la misma transacción que cambia el stock o el precio
+-- de compra de un producto (ventas, compras, altas, ediciones y bajas). id_proveedor = 0
+-- agrupa los productos sin proveedor. `python mantenimiento.py valoracion` compara los
+-- totales con la suma real sobre Productos (y con --corregir los repara).
+
+CREATE TABLE IF NOT EXISTS `Valoracion_Inventario` (
+  `id_proveedor` int(11) NOT NULL,
+  `unidades` int(11) NOT NULL DEFAULT 0,
+  `valor` decimal(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`id_proveedor`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Totales iniciales a partir del estado actual
+REPLACE INTO `Valoracion_Inventario` (`id_proveedor`, `unidades`, `valor`)
+SELECT COALESCE(`id_proveedor`, 0), SUM(`stock`), SUM(`stock` * `precio_compra`)
+FROM `Productos` GROUP BY COALESCE(`id_proveedor`, 0);
@@ -0,0 +1,17 @@
+-- Claves de las ventas registradas con POST /ventas/completa (venta y líneas en una transacción).
+--
+-- Ejecutar una sola vez:
+--
+--   mariadb -u api_user -p inventario < migrate_ventas_claves.sql
+--
+-- La API guarda la clave que genera la GUI en la misma transacción que la venta, así que una
+-- venta reenviada desde la cola sin conexión nunca se registra dos veces, aunque la API se haya
+-- reiniciado entre medias. `python mantenimiento.py claves` borra las claves antiguas.
+
+CREATE TABLE IF NOT EXISTS `Ventas_Claves` (
+  `clave` varchar(64) NOT NULL,
+  `id_venta` int(11) NOT NULL,
+  `creada` datetime NOT NULL,
+  PRIMARY KEY (`clave`),
+  KEY `idx_ventas_claves_creada` (`creada`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,32 @@
+-- Resumen de ventas por fecha, hora y producto (Ventas_Por_Hora) para el tablero /dashboard.
+--
+-- Ejecutar una sola vez, con la API detenida:
+--
+--   mariadb -u api_user -p inventario < migrate_ventas_por_hora.sql
+--
+-- La API suma cada línea de venta a su fila en la misma transacción que la inserta. Ventas sólo
+-- guarda la fecha, así que la hora es la de registro de la línea; para las líneas existentes se
+-- toma del movimiento de kardex de la venta y, si no lo hay (ventas anteriores al kardex), se
+-- cuentan en la hora 0.
+
+CREATE TABLE IF NOT EXISTS `Ventas_Por_Hora` (
+  `fecha` date NOT NULL,
+  `hora` tinyint(4) NOT NULL,
+  `id_producto` int(11) NOT NULL,
+  `unidades` int(11) NOT NULL DEFAULT 0,
+  `importe` decimal(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (`fecha`,`hora`,`id_producto`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Relleno a partir de las líneas vivas y archivadas
+REPLACE INTO `Ventas_Por_Hora` (`fecha`, `hora`, `id_producto`, `unidades`, `importe`)
+SELECT dv.`fecha_venta`, COALESCE(HOUR(m.`fecha`), 0), dv.`id_producto`,
+       SUM(dv.`cantidad`), SUM(dv.`cantidad` * dv.`precio_unitario`)
+FROM (
+    SELECT `id_detalle`, `fecha_venta`, `id_producto`, `cantidad`, `precio_unitario` FROM `Detalle_Ventas`
+    UNION ALL
+    SELECT `id_detalle`, `fecha_venta`, `id_producto`, `cantidad`, `precio_unitario` FROM `Detalle_Ventas_Archivo`
+) dv
+LEFT JOIN `Movimientos_Stock` m ON m.`tipo` = 'venta' AND m.`referencia` = dv.`id_detalle`
+WHERE dv.`id_producto` IS NOT NULL
+GROUP BY dv.`fecha_venta`, COALESCE(HOUR(m.`fecha`), 0), dv.`id_producto`;
@@ -0,0 +1,20 @@
+-- Versión de los datos en la base (la incrementan la API y mantenimiento.py).
+--
+-- Ejecutar una sola vez:
+--
+--   mariadb -u api_user -p inventario < migrate_version_datos.sql
+--
+-- La API cachea reportes y ETag de listados por versión de datos. Incrementa esta fila tras cada
+-- escritura y la lee en la misma conexión (réplica o primaria) que sirve los datos.
+-- mantenimiento.py (archivar, snapshots, pronostico, valoracion --corregir) la incrementa al
+-- terminar. Cualquier otro proceso que escriba directamente en la base debe hacer lo mismo:
+--
+--   UPDATE Version_Datos SET version = version + 1 WHERE id = 1;
+
+CREATE TABLE IF NOT EXISTS `Version_Datos` (
+  `id` tinyint(4) NOT NULL,
+  `version` bigint(20) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT IGNORE INTO `Version_Datos` (`id`, `version`) VALUES (1, 0);
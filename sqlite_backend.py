@@ -0,0 +1,302 @@
+"""Backend SQLite embebido (DB_BACKEND=sqlite) para instalaciones de una sola caja y pruebas.
+
+La API escribe SQL de MariaDB (parámetros `%s` / `%(nombre)s`, `SELECT ... FOR UPDATE`,
+`INSERT IGNORE`, `CONCAT`...). Este módulo ofrece conexiones con la misma interfaz DB-API
+que usa `app_compacto` (cursor, commit, rollback, ping, close) y traduce ese SQL al vuelo;
+el esquema se crea a partir de `db_schema.sql`, sin particiones ni opciones de InnoDB, y una
+base creada por una versión anterior se pone al día al abrirla (tablas, índices y columnas nuevas).
+
+La base se abre en modo WAL: las lecturas no bloquean a la escritura ni al revés, y con
+synchronous=NORMAL cada commit no espera a un fsync (sólo los checkpoints).
+"""
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+Error = sqlite3.Error
+IntegrityError = sqlite3.IntegrityError
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_schema.sql')
+
+# Se aplican en cada conexión (journal_mode queda guardado en el archivo)
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('busy_timeout', 5000),
+    ('cache_size', -16000),        # 16 MB de caché de páginas por conexión
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+# --- Traducción del SQL de la API ---
+
+_NAMED_PARAM = re.compile(r'%\((\w+)\)s')
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def translate(sql: str):
+    """Traduce una sentencia de la API a SQLite.
+
+    Retorna (sql, bloquear): `bloquear` es True si la sentencia era SELECT ... FOR UPDATE,
+    que en SQLite se emula tomando el bloqueo de escritura (BEGIN IMMEDIATE) antes de leer.
+    """
+    lock = bool(_FOR_UPDATE.search(sql))
+    if lock:
+        sql = _FOR_UPDATE.sub('', sql)
+    sql = _NAMED_PARAM.sub(r':\1', sql)
+    sql = sql.replace('%s', '?').replace('%%', '%')
+    sql = re.sub(r'^\s*INSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.IGNORECASE)
+    sql = sql.replace('LAST_INSERT_ID()', 'last_insert_rowid()')
+    return sql, lock
+
+
+def _concat(*args):
+    # Igual que en MariaDB: NULL si algún argumento es NULL
+    if any(a is None for a in args):
+        return None
+    return ''.join(str(a) for a in args)
+
+
+# --- Esquema ---
+
+_AUTO_INCREMENT = re.compile(r'^(`\w+`)\s+int\(\d+\)\s+NOT NULL\s+AUTO_INCREMENT', re.IGNORECASE)
+_ENUM = re.compile(r'^(`\w+`)\s+enum\(([^)]*)\)', re.IGNORECASE)
+_KEY = re.compile(r'^(UNIQUE\s+)?KEY\s+`(\w+)`\s*(\(.*\))$', re.IGNORECASE)
+
+
+def _strip_comments(script: str) -> str:
+    script = re.sub(r'/\*!.*?\*/\s*;?', '', script, flags=re.DOTALL)
+    return '\n'.join(line for line in script.splitlines() if not line.lstrip().startswith('--'))
+
+
+def _translate_create_table(statement: str):
+    """CREATE TABLE de MariaDB -> [CREATE TABLE, CREATE INDEX...] de SQLite."""
+    header, _, rest = statement.partition('(\n')
+    table = re.search(r'`(\w+)`', header).group(1)
+    # El cuerpo termina en la línea que empieza por ')': después van ENGINE, PARTITION BY...
+    body = re.split(r'\n\)', rest, maxsplit=1)[0]
+    lines = [line.strip().rstrip(',') for line in body.splitlines() if line.strip()]
+
+    columns, constraints, indexes = [], [], []
+    autoincrement = False
+    for line in lines:
+        m = _AUTO_INCREMENT.match(line)
+        if m:
+            columns.append(f'{m.group(1)} INTEGER PRIMARY KEY AUTOINCREMENT')
+            autoincrement = True
+            continue
+        m = _KEY.match(line)
+        if m:
+            unique = 'UNIQUE ' if m.group(1) else ''
+            indexes.append(f'CREATE {unique}INDEX IF NOT EXISTS `{table}_{m.group(2)}` ON `{table}` {m.group(3)}')
+            continue
+        if line.upper().startswith('PRIMARY KEY'):
+            # Con AUTOINCREMENT la PK es la columna id (SQLite no admite PK compuestas con rowid automático)
+            if not autoincrement:
+                constraints.append(line)
+            continue
+        if line.upper().startswith('CONSTRAINT'):
+            constraints.append(line)
+            continue
+        m = _ENUM.match(line)
+        if m:
+            line = f"{m.group(1)} TEXT{line[m.end():]} CHECK ({m.group(1)} IN ({m.group(2)}))"
+        columns.append(line)
+    create = f'CREATE TABLE IF NOT EXISTS `{table}` (\n  ' + ',\n  '.join(columns + constraints) + '\n)'
+    return [create] + indexes
+
+
+def translate_schema(script: str):
+    """Sentencias SQLite equivalentes a un volcado de MariaDB como `db_schema.sql`."""
+    statements = []
+    for statement in _strip_comments(script).split(';\n'):
+        statement = statement.strip()
+        if statement.upper().startswith('CREATE TABLE'):
+            statements.extend(_translate_create_table(statement))
+    return statements
+
+
+# Datos iniciales de lo que se agrega a una base existente: lo mismo que hacen los migrate_*.sql de
+# MariaDB. Clave: tabla nueva, o (tabla, columna) nueva; se ejecuta después de crear todo el esquema.
+SCHEMA_BACKFILL = {
+    # migrate_kardex.sql: el stock actual como movimiento de apertura y primer snapshot
+    'Movimientos_Stock': (
+        "INSERT INTO Movimientos_Stock (id_producto, fecha, tipo, cantidad) "
+        "SELECT id_producto, datetime('now', 'localtime'), 'ajuste', stock FROM Productos WHERE stock <> 0",
+        "INSERT INTO Snapshots_Stock (id_producto, fecha, stock, id_movimiento) "
+        "SELECT p.id_producto, datetime('now', 'localtime'), p.stock, COALESCE(MAX(m.id_movimiento), 0) "
+        "FROM Productos p LEFT JOIN Movimientos_Stock m ON m.id_producto = p.id_producto "
+        "GROUP BY p.id_producto, p.stock",
+    ),
+    # migrate_valoracion.sql
+    'Valoracion_Inventario': (
+        "INSERT OR REPLACE INTO Valoracion_Inventario (id_proveedor, unidades, valor) "
+        "SELECT COALESCE(id_proveedor, 0), SUM(stock), SUM(stock * precio_compra) "
+        "FROM Productos GROUP BY COALESCE(id_proveedor, 0)",
+    ),
+    # migrate_ventas_por_hora.sql
+    'Ventas_Por_Hora': (
+        "INSERT OR REPLACE INTO Ventas_Por_Hora (fecha, hora, id_producto, unidades, importe) "
+        "SELECT dv.fecha_venta, COALESCE(CAST(strftime('%H', m.fecha) AS INTEGER), 0), dv.id_producto, "
+        "SUM(dv.cantidad), SUM(dv.cantidad * dv.precio_unitario) "
+        "FROM (SELECT id_detalle, fecha_venta, id_producto, cantidad, precio_unitario FROM Detalle_Ventas "
+        "UNION ALL SELECT id_detalle, fecha_venta, id_producto, cantidad, precio_unitario FROM Detalle_Ventas_Archivo) dv "
+        "LEFT JOIN Movimientos_Stock m ON m.tipo = 'venta' AND m.referencia = dv.id_detalle "
+        "WHERE dv.id_producto IS NOT NULL "
+        "GROUP BY dv.fecha_venta, COALESCE(CAST(strftime('%H', m.fecha) AS INTEGER), 0), dv.id_producto",
+    ),
+}
+# migrate_costo_unitario.sql: el último precio de compra anterior a la venta, o el actual del producto
+for _table in ('Detalle_Ventas', 'Detalle_Ventas_Archivo'):
+    SCHEMA_BACKFILL[(_table, 'costo_unitario')] = (
+        f"UPDATE {_table} SET costo_unitario = COALESCE(("
+        f"SELECT dc.precio_compra FROM Detalle_Compras dc JOIN Compras c ON c.id_compra = dc.id_compra "
+        f"WHERE dc.id_producto = {_table}.id_producto AND c.fecha_compra <= {_table}.fecha_venta "
+        f"ORDER BY c.fecha_compra DESC, dc.id_detalle_compra DESC LIMIT 1), "
+        f"(SELECT p.precio_compra FROM Productos p WHERE p.id_producto = {_table}.id_producto), 0)",
+    )
+
+_COLUMN = re.compile(r'^`(\w+)`\s')
+
+
+def _table_columns(create: str):
+    """(tabla, [(columna, definición)]) de un CREATE TABLE ya traducido."""
+    table = re.search(r'`(\w+)`', create).group(1)
+    body = create.split('(\n  ', 1)[1].rsplit('\n)', 1)[0]
+    columns = []
+    for line in body.split(',\n  '):
+        m = _COLUMN.match(line)
+        if m:
+            columns.append((m.group(1), line))
+    return table, columns
+
+
+def _add_column_definition(definition: str) -> str:
+    # ALTER TABLE ... ADD COLUMN no admite NOT NULL sin DEFAULT: las filas existentes quedan en NULL
+    if re.search(r'\bNOT NULL\b', definition, re.IGNORECASE) and not re.search(r'\bDEFAULT\b', definition, re.IGNORECASE):
+        definition = re.sub(r'\s+NOT NULL\b', '', definition, flags=re.IGNORECASE)
+    return definition
+
+
+def ensure_schema(conn, schema_path: str = SCHEMA_PATH):
+    """Crea las tablas e índices que falten y agrega a las tablas existentes las columnas nuevas.
+
+    Todo es idempotente (IF NOT EXISTS, PRAGMA table_info), así que se ejecuta al abrir la base:
+    una base creada por una versión anterior queda al día sin los migrate_*.sql de MariaDB.
+    """
+    with open(schema_path, encoding='utf-8') as fh:
+        statements = translate_schema(fh.read())
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        upgrade = bool(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'Productos'").fetchone()[0])
+        backfill = []
+        for statement in statements:
+            if statement.startswith('CREATE TABLE'):
+                table, columns = _table_columns(statement)
+                existing = {row[1] for row in conn.execute(f'PRAGMA table_info(`{table}`)')}
+                if not existing:
+                    conn.execute(statement)
+                    backfill.append(table)
+                    continue
+                for name, definition in columns:
+                    if name not in existing:
+                        conn.execute(f'ALTER TABLE `{table}` ADD COLUMN {_add_column_definition(definition)}')
+                        backfill.append((table, name))
+            else:
+                conn.execute(statement)
+        if upgrade:
+            for key in backfill:
+                for statement in SCHEMA_BACKFILL.get(key, ()):
+                    conn.execute(statement)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+# --- Conexión ---
+
+class SQLiteCursor:
+    """Cursor con la interfaz que usa la API; traduce el SQL antes de ejecutarlo."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn._raw.cursor()
+
+    def execute(self, sql, params=None):
+        sql, lock = translate(sql)
+        if lock and not self._conn._raw.in_transaction:
+            self._cursor.execute('BEGIN IMMEDIATE')
+        if params is None:
+            self._cursor.execute(sql)
+        else:
+            self._cursor.execute(sql, params if isinstance(params, dict) else tuple(params))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        sql, _ = translate(sql)
+        self._cursor.executemany(sql, [p if isinstance(p, dict) else tuple(p) for p in seq_of_params])
+        return self
+
+    def __getattr__(self, name):
+        # description, rowcount, lastrowid, fetchone, fetchall, fetchmany...
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Conexión SQLite con la interfaz de las de mariadb/pymysql que usa el pool."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, *args, **kwargs):
+        # prepared=True / buffered=False no aplican: sqlite3 ya reutiliza las sentencias
+        # compiladas (cached_statements) y recorre los resultados sin cargarlos en memoria
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self):
+        self._raw.execute('SELECT 1').fetchone()
+
+    def close(self):
+        self._raw.close()
+
+
+def connect(path: str, timeout: float = 5, schema_path: str = SCHEMA_PATH) -> SQLiteConnection:
+    """Abre (y si hace falta crea) la base SQLite en `path`."""
+    if path != ':memory:':
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+    # check_same_thread=False: el pool presta la conexión a distintos hilos, nunca a dos a la vez
+    raw = sqlite3.connect(path, timeout=timeout, check_same_thread=False, cached_statements=256)
+    for name, value in PRAGMAS:
+        raw.execute(f'PRAGMA {name} = {value}')
+    raw.create_function('CONCAT', -1, _concat, deterministic=True)
+    key = os.path.abspath(path) if path != ':memory:' else None
+    if key is None or key not in _schema_ready:
+        with _schema_lock:
+            ensure_schema(raw, schema_path)
+            if key is not None:
+                _schema_ready.add(key)
+    return SQLiteConnection(raw)
@@ -0,0 +1,96 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import analitica
+
+pd = pytest.importorskip('pandas')
+
+
+def lineas(filas):
+    return pd.DataFrame(filas, columns=analitica.COLUMNAS_LINEAS)
+
+
+def productos(filas):
+    return pd.DataFrame(filas, columns=analitica.COLUMNAS_PRODUCTOS)
+
+
+def test_abc_cover_and_reorder():
+    prods = productos([
+        (1, 'Pan', 10, 0, 1.0),
+        (2, 'Leche', 100, 0, 2.0),
+        (3, 'Sal', 5, 0, 1.0),
+        (4, 'Sin ventas', 3, 0, 1.0),
+    ])
+    ventas = lineas([
+        (1, '2024-01-01', 40, 2.0, 1.0),   # 80 de ingresos, 40 u. en 10 días
+        (1, '2024-01-02', 40, 2.0, 1.0),   # -> 160 (80 %)
+        (2, '2024-01-01', 15, 2.0, 2.0),   # 30 (15 %)
+        (3, '2024-01-05', 10, 1.0, 1.0),   # 10 (5 %)
+    ])
+    df = analitica.calcular(ventas, prods, dias=10, lead_time=5, dias_revision=10, z=0).set_index('id_producto')
+
+    assert list(df.index) == [1, 2, 3, 4]
+    assert list(df['clase']) == ['A', 'B', 'C', 'C']
+    assert df.loc[1, 'participacion'] == pytest.approx(0.8)
+    assert df.loc[1, 'demanda_diaria'] == pytest.approx(8.0)
+    assert df.loc[1, 'dias_cobertura'] == pytest.approx(10 / 8)
+    # Rotación anualizada: costo de lo vendido / valor del stock actual
+    assert df.loc[1, 'rotacion_anual'] == pytest.approx(80 * 36.5 / 10)
+    # Pan: 10 <= 8*5 -> pide hasta 8*5 + 8*10 = 120
+    assert df.loc[1, 'punto_reorden'] == pytest.approx(40)
+    assert df.loc[1, 'cantidad_sugerida'] == 110
+    # Leche cubre de sobra; sin ventas no hay cobertura ni reposición
+    assert df.loc[2, 'cantidad_sugerida'] == 0
+    assert pd.isna(df.loc[4, 'dias_cobertura']) and df.loc[4, 'cantidad_sugerida'] == 0
+
+
+def test_safety_stock_uses_daily_variability():
+    prods = productos([(1, 'Pan', 0, 0, 1.0), (2, 'Leche', 0, 0, 1.0)])
+    # Misma demanda total (20 u. en 4 días), una constante y otra concentrada en un día
+    ventas = lineas([(1, f'2024-01-0{d}', 5, 1.0, 1.0) for d in range(1, 5)] + [(2, '2024-01-01', 20, 1.0, 1.0)])
+    df = analitica.calcular(ventas, prods, dias=4, lead_time=4, z=1).set_index('id_producto')
+    assert df.loc[1, 'punto_reorden'] == pytest.approx(20)
+    # sigma = sqrt(400/4 - 25) = sqrt(75)
+    assert df.loc[2, 'punto_reorden'] == pytest.approx(20 + 75 ** 0.5 * 2)
+
+
+def test_table_has_native_types_and_no_nan():
+    prods = productos([(1, 'Pan', 2, 0, 1.0)])
+    tabla = analitica.a_tabla(analitica.calcular(lineas([]), prods, dias=30))
+    assert tabla['columns'][:3] == ['id_producto', 'producto', 'clase']
+    fila = dict(zip(tabla['columns'], tabla['rows'][0]))
+    assert fila['clase'] == 'C' and fila['dias_cobertura'] is None and fila['rotacion_anual'] == 0
+    assert type(fila['id_producto']) is int and type(fila['ingresos']) is float
+
+
+def test_exponential_smoothing_tracks_level_and_error():
+    np = analitica.np
+    constante = np.full(30, 4.0)
+    alterna = np.tile([0.0, 8.0], 15)
+    nivel, mad = analitica.suavizar(np.vstack([constante, alterna, np.zeros(30)]), alpha=0.3)
+    assert nivel[0] == pytest.approx(4.0) and mad[0] == pytest.approx(0.0)
+    assert nivel[1] == pytest.approx(4.0, abs=1.5) and mad[1] > 2
+    assert nivel[2] == 0 and mad[2] == 0
+
+    demanda, desviacion, sugerido = analitica.pronosticar(np.vstack([constante, alterna]), alpha=0.3, lead_time=4, z=1)
+    assert sugerido[0] == 16 and sugerido[1] > 16
+    assert desviacion[1] == pytest.approx(analitica.FACTOR_MAD * mad[1])
+
+
+def test_daily_matrix_and_process_pool_match_serial():
+    np = analitica.np
+    ventas = pd.DataFrame([(7, '2024-01-01', 2), (7, '2024-01-01', 3), (9, '2024-01-03', 1), (99, '2024-01-02', 5)],
+                          columns=['id_producto', 'fecha_venta', 'cantidad'])
+    matriz = analitica.matriz_diaria(ventas, [7, 8, 9], '2024-01-01', 3)
+    # Tabla viva + archivo se suman; productos fuera del catálogo se descartan
+    assert matriz.tolist() == [[5, 0, 0], [0, 0, 0], [0, 0, 1]]
+
+    grande = np.random.default_rng(1).poisson(3, (50, 60)).astype(float)
+    serie = analitica.suavizar(grande, 0.2)
+    paralelo = analitica.suavizar_en_paralelo(grande, 0.2, procesos=2, bloque=20)
+    assert np.allclose(serie[0], paralelo[0]) and np.allclose(serie[1], paralelo[1])
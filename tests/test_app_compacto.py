@@ -0,0 +1,596 @@
+import os
+import sys
+import pytest
+
+# Asegurar que el directorio del proyecto esté en sys.path para poder importar módulos locales
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import app_compacto
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+        self.rowcount = 0
+        self.description = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+        result = self.conn.handler(sql, params) if self.conn.handler else None
+        result = result or {}
+        self._result = list(result.get('rows', []))
+        self.description = [(c,) for c in result.get('columns', [])]
+        self.rowcount = result.get('rowcount', len(self._result))
+        self.lastrowid = result.get('lastrowid', self.conn.next_id)
+
+    def fetchall(self):
+        rows, self._result = self._result, []
+        return rows
+
+    def fetchone(self):
+        return self._result.pop(0) if self._result else None
+
+    def fetchmany(self, size=1):
+        rows, self._result = self._result[:size], self._result[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    """Conexión falsa que registra el SQL ejecutado.
+
+    handler(sql, params) puede devolver un dict con rows/columns/rowcount/lastrowid.
+    """
+
+    def __init__(self, handler=None, next_id=1):
+        self.handler = handler
+        self.next_id = next_id
+        self.executed = []
+        self.commits = 0
+        self.prepared_cursors = 0
+
+    def cursor(self, prepared=False):
+        self.prepared_cursors += bool(prepared)
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_conn(monkeypatch):
+    conn = FakeConn(next_id=7)
+    monkeypatch.setattr(app_compacto, 'get_connection', lambda *a, **k: conn)
+    return conn
+
+
+@pytest.fixture
+def client(fake_conn):
+    app = app_compacto.create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def inserts(conn, table):
+    return [sql for sql, _ in conn.executed if sql.startswith(f'INSERT INTO {table} ')]
+
+
+def test_idempotency_key_replays_first_response(client, fake_conn):
+    headers = {'Idempotency-Key': 'venta-1'}
+    payload = {'fecha_venta': '2024-01-01', 'id_cliente': 1, 'total': 10}
+    r1 = client.post('/ventas', json=payload, headers=headers)
+    fake_conn.next_id = 8
+    r2 = client.post('/ventas', json=payload, headers=headers)
+    assert r1.status_code == r2.status_code == 201
+    assert r2.get_json() == r1.get_json() == {'id': 7}
+    assert r2.headers.get('Idempotent-Replayed') == 'true'
+    assert len(inserts(fake_conn, 'Ventas')) == 1
+
+
+def test_idempotency_key_reused_with_other_body(client):
+    headers = {'Idempotency-Key': 'venta-2'}
+    client.post('/ventas', json={'total': 10}, headers=headers)
+    r = client.post('/ventas', json={'total': 99}, headers=headers)
+    assert r.status_code == 422
+
+
+def test_post_without_idempotency_key_is_not_deduplicated(client, fake_conn):
+    client.post('/ventas', json={'total': 10})
+    client.post('/ventas', json={'total': 10})
+    assert len(inserts(fake_conn, 'Ventas')) == 2
+
+
+def test_idempotency_store_releases_failed_requests():
+    store = app_compacto.IdempotencyStore(ttl=60)
+    assert store.begin('k', 'h')[0] == 'nuevo'
+    assert store.begin('k', 'h')[0] == 'en_curso'
+    store.release('k')
+    assert store.begin('k', 'h')[0] == 'nuevo'
+    store.complete('k', 201, b'{}', 'application/json')
+    assert store.begin('k', 'h') == ('repetido', (201, b'{}', 'application/json'))
+
+
+def make_stock_handler(productos):
+    """Handler que simula Productos (id -> [nombre, stock, stock_minimo, codigo opcional]) para los índices en memoria."""
+    def handler(sql, params):
+        if sql.startswith('SELECT id_producto, nombre, stock, stock_minimo FROM Productos'):
+            return {'rows': [(i, p[0], p[1], p[2]) for i, p in productos.items() if p[1] <= p[2]]}
+        if sql.startswith('SELECT id_producto, codigo, nombre, precio_venta, stock FROM Productos'):
+            return {'rows': [(i, p[3], p[0], 2.0, p[1]) for i, p in productos.items() if len(p) > 3]}
+        if sql.startswith('SELECT nombre, stock, stock_minimo, codigo, precio_venta FROM Productos WHERE id_producto'):
+            p = productos.get(params[0])
+            return {'rows': [(p[0], p[1], p[2], p[3] if len(p) > 3 else None, 2.0)] if p else []}
+        if sql.startswith('SELECT stock, precio_compra, id_proveedor FROM Productos WHERE id_producto'):
+            return {'rows': [(productos[params[0]][1], 0.5, None)]}
+        if sql.startswith('SELECT fecha_venta FROM Ventas WHERE id_venta'):
+            return {'rows': [('2024-01-01',)]}
+        if sql.startswith('UPDATE Productos SET stock = stock - %s'):
+            productos[params[1]][1] -= params[0]
+            return {'rowcount': 1}
+        if sql.startswith('INSERT INTO Detalle_Ventas'):
+            return {'rowcount': 1}
+        return None
+    return handler
+
+
+def test_existencias_minimas_served_from_index(client, fake_conn):
+    productos = {1: ['Pan', 3, 5], 2: ['Leche', 10, 2]}
+    fake_conn.handler = make_stock_handler(productos)
+
+    r = client.get('/reportes/existencias_minimas')
+    assert r.get_json() == [{'nombre': 'Pan', 'stock': 3, 'stock_minimo': 5}]
+
+    # Una venta deja 'Leche' bajo mínimo; el índice se actualiza sin otro recorrido completo
+    r = client.post('/detalle_ventas', json={'id_venta': 1, 'id_producto': 2, 'cantidad': 9, 'precio_unitario': 1})
+    assert r.status_code == 201
+    r = client.get('/reportes/existencias_minimas')
+    assert [p['nombre'] for p in r.get_json()] == ['Pan', 'Leche']
+    full_scans = [sql for sql, _ in fake_conn.executed if sql.startswith('SELECT id_producto, nombre, stock, stock_minimo')]
+    assert len(full_scans) == 1
+
+
+def test_existencias_minimas_available_while_report_slots_are_taken(monkeypatch, fake_conn):
+    fake_conn.handler = make_stock_handler({1: ['Pan', 3, 5]})
+    monkeypatch.setenv('REPORT_MAX_CONCURRENT', '0')
+    monkeypatch.setenv('RATE_LIMIT_REPORTES', '1,1')
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        assert client.get('/reportes/existencias').status_code == 503
+        # Sin cupo de reportes ni presupuesto por cliente, la consulta de mínimos (en memoria) sigue respondiendo
+        for _ in range(3):
+            r = client.get('/reportes/existencias_minimas')
+            assert r.status_code == 200 and r.get_json() == [{'nombre': 'Pan', 'stock': 3, 'stock_minimo': 5}]
+        r = client.get('/reportes/existencias_minimas?format=csv')
+        assert r.status_code == 200 and 'Pan' in r.get_data(as_text=True)
+
+
+def test_sale_line_stores_cost_and_profit_report_skips_productos(client, fake_conn):
+    fake_conn.handler = make_stock_handler({2: ['Leche', 10, 2]})
+    r = client.post('/detalle_ventas', json={'id_venta': 1, 'id_producto': 2, 'cantidad': 3, 'precio_unitario': 1})
+    assert r.status_code == 201
+    insert = [params for sql, params in fake_conn.executed if sql.startswith('INSERT INTO Detalle_Ventas')]
+    assert insert == [(2, 3, 1.0, 0.5, 1)]
+
+    fake_conn.handler = lambda sql, params: {'rows': [(0,)]} if sql.startswith('SELECT SUM(') else None
+    fake_conn.executed.clear()
+    assert client.get('/reportes/ganancias?desde=2024-01-01&hasta=2024-12-31').status_code == 200
+    detalle, total = [sql for sql, _ in fake_conn.executed if 'costo_unitario' in sql]
+    # Productos sólo se consulta tras agrupar (un nombre por producto) y el total no lo toca
+    assert detalle.index('GROUP BY dv.id_producto') < detalle.index('JOIN Productos')
+    assert 'Productos' not in total and 'precio_compra' not in detalle
+
+
+def test_product_by_code_served_from_memory(client, fake_conn):
+    productos = {1: ['Pan', 3, 5, '7501'], 2: ['Leche', 10, 2, '7502']}
+    fake_conn.handler = make_stock_handler(productos)
+
+    r = client.get('/productos/by-code/7502')
+    assert r.get_json() == {'id': 2, 'codigo': '7502', 'nombre': 'Leche', 'precio_venta': 2.0, 'stock': 10}
+    assert client.get('/productos/by-code/0000').status_code == 404
+
+    # Una venta actualiza el stock del mapa releyendo sólo ese producto
+    client.post('/detalle_ventas', json={'id_venta': 1, 'id_producto': 2, 'cantidad': 4, 'precio_unitario': 2})
+    assert client.get('/productos/by-code/7502').get_json()['stock'] == 6
+    scans = [sql for sql, _ in fake_conn.executed if 'WHERE codigo IS NOT NULL' in sql]
+    assert len(scans) == 1
+
+
+def test_batch_get_chunks_ids_and_reports_missing(monkeypatch, fake_conn):
+    monkeypatch.setenv('BATCH_GET_CHUNK', '2')
+    clientes = {1: 'Ana', 3: 'Luis', 4: 'Eva'}
+
+    def handler(sql, params):
+        if 'WHERE id_cliente IN' in sql:
+            return {'columns': ['id', 'nombre', 'direccion', 'telefono', 'email'],
+                    'rows': [(i, clientes[i], None, None, None) for i in params if i in clientes]}
+        return None
+    fake_conn.handler = handler
+    app = app_compacto.create_app()
+    client = app.test_client()
+
+    r = client.get('/clientes?ids=4,1,2,4,3')
+    body = r.get_json()
+    assert [c['nombre'] for c in body['resultados']] == ['Eva', 'Ana', 'Luis']
+    assert body['faltantes'] == [2]
+    assert len([sql for sql, _ in fake_conn.executed if 'IN (' in sql]) == 2
+
+    etag = client.get('/clientes').headers.get('ETag')
+    r = client.post('/clientes/batch-get', json={'ids': [3, 9]})
+    assert r.get_json()['faltantes'] == [9]
+    # Es una lectura: no cambia la versión de datos ni invalida cachés
+    assert client.get('/clientes').headers.get('ETag') == etag
+    assert client.post('/productos/batch-get', json={'ids': 'x'}).status_code == 400
+
+
+def test_low_stock_index_publishes_events():
+    index = app_compacto.LowStockIndex()
+    index.load([(1, 'Pan', 3, 5)])
+    q = index.subscribe()
+    index.update(2, 'Leche', 1, 2)
+    index.update(1, 'Pan', 8, 5)
+    assert q.get_nowait() == ('alerta', {'id': 2, 'nombre': 'Leche', 'stock': 1, 'stock_minimo': 2})
+    assert q.get_nowait()[0] == 'normalizado'
+    assert [p['id'] for p in index.snapshot()] == [2]
+
+
+def test_low_stock_reload_keeps_concurrent_updates_and_publishes_diff():
+    index = app_compacto.LowStockIndex()
+    index.load([(1, 'Pan', 3, 5), (2, 'Leche', 1, 2)])
+    q = index.subscribe()
+    index.begin_load()
+    # Escritura confirmada mientras se leen las filas: Pan se repone
+    index.update(1, 'Pan', 9, 5)
+    assert q.get_nowait()[0] == 'normalizado'
+    # Filas leídas antes de esa escritura; además Leche ya no está bajo mínimo y entra Arroz
+    index.load([(1, 'Pan', 3, 5), (3, 'Arroz', 0, 4)])
+    assert [p['id'] for p in index.snapshot()] == [3]
+    assert q.get_nowait() == ('alerta', {'id': 3, 'nombre': 'Arroz', 'stock': 0, 'stock_minimo': 4})
+    assert q.get_nowait() == ('normalizado', {'id': 2, 'nombre': 'Leche', 'stock': 1, 'stock_minimo': 2})
+    assert q.empty() and index.loaded
+    # Si el índice se invalida durante la carga, el resultado no cuenta como carga completa
+    index.begin_load()
+    index.invalidate()
+    index.load([])
+    assert not index.loaded
+
+
+def test_ttl_cache_computes_once_per_key_until_expiry(monkeypatch):
+    import threading
+    import time
+    cache = app_compacto.TTLCache(ttl=5)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return len(calls)
+
+    threads = [threading.Thread(target=cache.get_or_compute, args=('k', slow)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Las peticiones simultáneas esperan el único cálculo en curso
+    assert calls == [1] and cache.get_or_compute('k', slow) == 1
+    now = time.monotonic()
+    monkeypatch.setattr(app_compacto.time, 'monotonic', lambda: now + 6)
+    assert cache.get_or_compute('k', slow) == 2
+
+
+def test_existencias_minimas_stream_starts_with_snapshot(client, fake_conn):
+    fake_conn.handler = make_stock_handler({1: ['Pan', 3, 5]})
+    r = client.get('/reportes/existencias_minimas/stream', buffered=False)
+    assert r.mimetype == 'text/event-stream'
+    first = next(r.response)
+    first = first.decode() if isinstance(first, bytes) else first
+    assert first.startswith('event: snapshot\n')
+    assert '"Pan"' in first
+    r.close()
+
+
+def ventas_report_handler(sql, params):
+    if sql.startswith('SELECT v.id_venta'):
+        return {'columns': ['id', 'fecha_venta', 'total', 'id_cliente', 'cliente'], 'rows': [(1, '2024-01-02', 10.0, 1, 'Ana')]}
+    if sql.startswith('SELECT COALESCE(SUM(total)'):
+        return {'rows': [(10.0,)]}
+    return None
+
+
+def report_queries(conn):
+    return [sql for sql, _ in conn.executed if sql.startswith('SELECT') and sql != app_compacto.SQL_VERSION_DATOS]
+
+
+def test_report_job_runs_in_background_and_is_cached(client, fake_conn):
+    fake_conn.handler = ventas_report_handler
+    body = {'reporte': 'ventas', 'desde': '2020-01-01', 'hasta': '2024-12-31'}
+    r = client.post('/reportes/jobs', json=body)
+    assert r.status_code in (200, 202)
+    job = client.get(f"/reportes/jobs/{r.get_json()['id']}?wait=5").get_json()
+    assert job['estado'] == 'completado'
+    assert job['resultado']['suma_total'] == 10.0
+    queries = len(report_queries(fake_conn))
+
+    # Mismo reporte y mismos datos: se responde desde la caché leyendo sólo la versión de datos
+    r = client.post('/reportes/jobs', json=body)
+    assert r.status_code == 200 and r.get_json()['estado'] == 'completado'
+    assert client.get('/reportes/ventas?desde=2020-01-01&hasta=2024-12-31').status_code == 200
+    assert len(report_queries(fake_conn)) == queries
+
+    # Una escritura cambia la versión de datos e invalida el resultado
+    client.post('/ventas', json={'total': 5})
+    client.get('/reportes/ventas?desde=2020-01-01&hasta=2024-12-31')
+    assert len(report_queries(fake_conn)) > queries
+
+
+def test_report_job_validates_dates_and_name(client):
+    assert client.post('/reportes/jobs', json={'reporte': 'ventas', 'desde': '2024-01-01'}).status_code == 400
+    assert client.post('/reportes/jobs', json={'reporte': 'ventas', 'desde': '01/01/2024', 'hasta': '2024-02-01'}).status_code == 400
+    assert client.post('/reportes/jobs', json={'reporte': 'nada'}).status_code == 400
+    assert client.get('/reportes/jobs/desconocido').status_code == 404
+
+
+def test_report_export_csv_streams_rows(client, fake_conn):
+    fake_conn.handler = ventas_report_handler
+    r = client.get('/reportes/ventas?desde=2024-01-01&hasta=2024-12-31&format=csv')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/csv'
+    assert 'attachment' in r.headers['Content-Disposition']
+    lines = r.get_data(as_text=True).splitlines()
+    assert lines == ['id,fecha_venta,total,id_cliente,cliente', '1,2024-01-02,10.0,1,Ana']
+
+
+def test_report_export_xlsx_keeps_types(client, fake_conn):
+    openpyxl = pytest.importorskip('openpyxl')
+    import io
+    fake_conn.handler = ventas_report_handler
+    r = client.get('/reportes/ventas?desde=2024-01-01&hasta=2024-12-31&format=xlsx')
+    assert r.status_code == 200
+    ws = openpyxl.load_workbook(io.BytesIO(r.get_data())).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0] == ('id', 'fecha_venta', 'total', 'id_cliente', 'cliente')
+    assert rows[1] == (1, '2024-01-02', 10.0, 1, 'Ana')
+
+
+def test_report_export_rejects_unknown_format(client):
+    assert client.get('/reportes/existencias?format=pdf').status_code == 400
+
+
+def test_report_columnar_format(client, fake_conn):
+    fake_conn.handler = ventas_report_handler
+    legacy = client.get('/reportes/ventas?desde=2024-01-01&hasta=2024-12-31').get_json()
+    columnar = client.get('/reportes/ventas?desde=2024-01-01&hasta=2024-12-31&format=columnar').get_json()
+    assert legacy['ventas'] == [{'id': 1, 'fecha_venta': '2024-01-02', 'total': 10.0, 'id_cliente': 1, 'cliente': 'Ana'}]
+    assert columnar['ventas'] == {'columns': ['id', 'fecha_venta', 'total', 'id_cliente', 'cliente'],
+                                  'rows': [[1, '2024-01-02', 10.0, 1, 'Ana']]}
+    assert columnar['suma_total'] == legacy['suma_total']
+
+
+def test_report_msgpack_format(client, fake_conn):
+    msgpack = pytest.importorskip('msgpack')
+    fake_conn.handler = ventas_report_handler
+    r = client.get('/reportes/ventas?desde=2024-01-01&hasta=2024-12-31&format=msgpack')
+    assert r.mimetype == 'application/x-msgpack'
+    data = msgpack.unpackb(r.get_data(), raw=False)
+    assert data['ventas']['rows'] == [[1, '2024-01-02', 10.0, 1, 'Ana']]
+
+
+def test_connection_pool_reuses_and_bounds_connections():
+    created = []
+
+    def factory():
+        created.append(FakeConn())
+        return created[-1]
+
+    pool = app_compacto.ConnectionPool(factory, max_size=2, timeout=0.05)
+    c1 = pool.acquire()
+    c2 = pool.acquire()
+    with pytest.raises(app_compacto.PoolExhaustedError):
+        pool.acquire()
+    assert pool.stats() == {'max': 2, 'en_uso': 2, 'libres': 0, 'esperando': 0}
+    c1.close()
+    c1.close()  # cerrar dos veces no devuelve la conexión dos veces
+    c3 = pool.acquire()
+    assert len(created) == 2
+    c2.close()
+    c3.close()
+    assert pool.stats()['libres'] == 2
+
+
+def test_ready_checks_database(monkeypatch):
+    monkeypatch.setattr(app_compacto, '_pool', app_compacto.ConnectionPool(lambda: FakeConn(), max_size=3))
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        r = client.get('/ready')
+        assert r.status_code == 200
+        body = r.get_json()
+        assert body['status'] == 'ready'
+        assert body['pool']['max'] == 3 and 'db_latency_ms' in body
+
+
+def test_ready_reports_unreachable_database(monkeypatch):
+    def factory():
+        raise app_compacto.DatabaseConnectionError('Can\'t connect to server')
+
+    monkeypatch.setattr(app_compacto, '_pool', app_compacto.ConnectionPool(factory, max_size=3))
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        assert client.get('/health').status_code == 200
+        r = client.get('/ready')
+        assert r.status_code == 503
+        assert r.get_json()['db'] == 'error'
+
+
+def test_list_etag_revalidation(client, fake_conn):
+    r = client.get('/clientes')
+    etag = r.headers['ETag']
+    queries = len(report_queries(fake_conn))
+    r = client.get('/clientes', headers={'If-None-Match': etag})
+    # Sólo se lee la versión de datos, no el listado
+    assert r.status_code == 304
+    assert len(report_queries(fake_conn)) == queries
+
+    client.post('/clientes', json={'nombre': 'Ana'})
+    r = client.get('/clientes', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+
+
+def test_rate_limit_per_client_and_route(monkeypatch, fake_conn):
+    monkeypatch.setenv('RATE_LIMIT_ROUTE', '1,2')
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        assert [client.get('/clientes').status_code for _ in range(2)] == [200, 200]
+        r = client.get('/clientes')
+        assert r.status_code == 429
+        assert int(r.headers['Retry-After']) >= 1
+        # Otras rutas y el health check tienen su propio presupuesto
+        assert client.get('/proveedores').status_code == 200
+        assert client.get('/health').status_code == 200
+        # Otro cliente no se ve afectado
+        assert client.get('/clientes', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+
+def test_report_concurrency_cap_rejects_early(monkeypatch, fake_conn):
+    monkeypatch.setenv('REPORT_MAX_CONCURRENT', '0')
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        r = client.get('/reportes/existencias')
+        assert r.status_code == 503 and 'Retry-After' in r.headers
+        assert fake_conn.executed == []
+
+
+def replica_handler(lag):
+    def handler(sql, params):
+        if sql == 'SHOW SLAVE STATUS':
+            return {'columns': ['Seconds_Behind_Master'], 'rows': [(lag,)]}
+        return None
+    return handler
+
+
+def test_replica_set_skips_lagging_and_down_replicas():
+    def down():
+        raise app_compacto.DatabaseConnectionError('Can\'t connect to server')
+
+    conns = {'r1': FakeConn(replica_handler(30)), 'r2': FakeConn(replica_handler(0))}
+    factories = {'r1': lambda: conns['r1'], 'r2': lambda: conns['r2'], 'r3': down}
+    replicas = app_compacto.ReplicaSet(['r1', 'r2', 'r3'], lambda h: app_compacto.ConnectionPool(factories[h], max_size=2), max_lag=5)
+    for _ in range(3):
+        conn = replicas.acquire()
+        assert conn._raw is conns['r2']
+        conn.close()
+    status = {s['host']: s for s in replicas.status()}
+    assert status['r1']['lag'] == 30 and not status['r1']['ok']
+    assert not status['r3']['ok'] and status['r3']['error']
+
+
+def test_reads_go_to_replica_until_client_writes(monkeypatch):
+    primary, replica = FakeConn(next_id=3), FakeConn(replica_handler(0))
+    monkeypatch.setattr(app_compacto, '_pool', app_compacto.ConnectionPool(lambda: primary, max_size=2))
+    monkeypatch.setattr(app_compacto, '_replicas', app_compacto.ReplicaSet(
+        ['r1'], lambda h: app_compacto.ConnectionPool(lambda: replica, max_size=2)))
+    app = app_compacto.create_app()
+    with app.test_client() as client:
+        client.get('/clientes')
+        assert any(sql.startswith('SELECT') and 'Clientes' in sql for sql, _ in replica.executed)
+        # La versión de datos del ETag también se lee en la réplica
+        assert primary.executed == []
+
+        client.post('/clientes', json={'nombre': 'Ana'})
+        replica.executed.clear()
+        client.get('/clientes')
+        assert replica.executed == []
+        assert any(sql.startswith('SELECT') and 'Clientes' in sql for sql, _ in primary.executed)
+
+
+def test_registered_statements_are_prepared_once_per_connection():
+    raw = FakeConn(handler=lambda sql, params: {'columns': ['stock'], 'rows': [(5,)]})
+    pool = app_compacto.ConnectionPool(lambda: raw, max_size=1, prepared=True)
+    for _ in range(3):
+        conn = pool.acquire()
+        cur = app_compacto.execute_registered(conn, 'producto_bloquear_stock', (1,))
+        assert cur.fetchone() == (5,)
+        cur.close()
+        conn.close()
+    assert raw.prepared_cursors == 1
+    conn = pool.acquire()
+    app_compacto.execute_registered(conn, 'producto_descontar_stock', (1, 1)).close()
+    conn.close()
+    assert raw.prepared_cursors == 2
+    assert raw.executed[0] == (app_compacto.QUERY_REGISTRY['producto_bloquear_stock'], (1,))
+
+    # Sin pool (o con pymysql) se usa un cursor normal
+    plain = FakeConn()
+    app_compacto.execute_registered(plain, 'cliente_por_id', (1,))
+    assert plain.prepared_cursors == 0 and len(plain.executed) == 1
+
+
+def test_request_profiler_is_opt_in(monkeypatch, fake_conn, tmp_path):
+    app = app_compacto.create_app()
+    assert not isinstance(app.wsgi_app, app_compacto.RequestProfiler)
+
+    monkeypatch.setenv('PROFILE_TOKEN', 'secreto')
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path))
+    app = app_compacto.create_app()
+    with app.test_client() as c:
+        assert 'X-Profile-Id' not in c.get('/productos').headers
+        assert 'X-Profile-Id' not in c.get('/productos', headers={'X-Profile': 'otro'}).headers
+        r = c.get('/productos', headers={'X-Profile': 'secreto'})
+        assert r.status_code == 200
+        profile_id = r.headers['X-Profile-Id']
+        assert c.get('/productos?profile=secreto').headers['X-Profile-Id'] != profile_id
+
+    import pstats
+    assert pstats.Stats(str(tmp_path / f'{profile_id}.prof')).total_calls > 0
+    lines = (tmp_path / f'{profile_id}.folded').read_text(encoding='utf-8').splitlines()
+    assert lines[0] == '# GET /productos'
+    stack, micros = lines[1].rsplit(' ', 1)
+    assert int(micros) > 0 and stack
+    assert any('productos_list (app_compacto.py' in line for line in lines[1:])
+
+
+def test_other_clients_writes_keep_reads_on_replica(monkeypatch):
+    version = [3]
+
+    def replica_rows(sql, params):
+        if sql == app_compacto.SQL_VERSION_DATOS:
+            return {'rows': [(version[0],)]}
+        return ventas_report_handler(sql, params) or replica_handler(0)(sql, params)
+
+    primary, replica = FakeConn(next_id=3), FakeConn(replica_rows)
+    monkeypatch.setattr(app_compacto, '_pool', app_compacto.ConnectionPool(lambda: primary, max_size=2))
+    monkeypatch.setattr(app_compacto, '_replicas', app_compacto.ReplicaSet(
+        ['r1'], lambda h: app_compacto.ConnectionPool(lambda: replica, max_size=2)))
+    app = app_compacto.create_app()
+    reporte = '/reportes/ventas?desde=2020-01-01&hasta=2024-12-31'
+    otro = {'REMOTE_ADDR': '10.0.0.2'}
+    with app.test_client() as client:
+        client.post('/ventas', json={'total': 5}, environ_base=otro)
+        assert any(sql.startswith('UPDATE Version_Datos') for sql, _ in primary.executed)
+        primary.executed.clear()
+        # Justo después de la escritura de otro cliente, listados y reportes siguen en la réplica
+        etag = client.get('/clientes').headers['ETag']
+        assert client.get(reporte).get_json()['suma_total'] == 10.0
+        assert client.get('/clientes', headers={'If-None-Match': etag}).status_code == 304
+        assert primary.executed == []
+        # La caché y el ETag siguen la versión de la réplica: cambian cuando la réplica la aplica
+        queries = len(report_queries(replica))
+        client.get(reporte)
+        assert len(report_queries(replica)) == queries
+        version[0] = 4
+        client.get(reporte)
+        assert len(report_queries(replica)) > queries
+        assert client.get('/clientes', headers={'If-None-Match': etag}).status_code == 200
+        assert primary.executed == []
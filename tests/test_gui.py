@@ -0,0 +1,118 @@
+import builtins
+import os
+import symtable
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def test_gui_module_globals_are_defined():
+    """Todo nombre global que usan las funciones de gui.py está definido en el módulo (sin importar Tk)."""
+    with open(os.path.join(ROOT, 'gui.py'), encoding='utf-8') as fh:
+        module = symtable.symtable(fh.read(), 'gui.py', 'exec')
+    defined = {s.get_name() for s in module.get_symbols() if s.is_assigned() or s.is_imported()}
+    defined |= set(dir(builtins))
+    missing = set()
+    pending = list(module.get_children())
+    while pending:
+        table = pending.pop()
+        pending.extend(table.get_children())
+        for s in table.get_symbols():
+            if s.is_referenced() and s.is_global() and s.get_name() not in defined:
+                missing.add(f"{table.get_name()}: {s.get_name()}")
+    assert not missing, sorted(missing)
+
+
+def test_gui_helpers_use_shared_session(monkeypatch):
+    pytest.importorskip('customtkinter')
+    import gui
+
+    class Respuesta:
+        status_code = 200
+
+    llamadas = []
+    monkeypatch.setattr(gui.SESSION, 'get', lambda url, **kw: llamadas.append(url) or Respuesta())
+    assert gui._health_ok('http://api') is True
+    assert gui.api_is_up('http://api') == (True, None)
+    assert llamadas == ['http://api/health', 'http://api/health']
+    assert isinstance(gui.SESSION, gui.ApiSession) and gui.SESSION.budget is not None
+
+
+def test_exit_api_unreachable_shows_fatal_message_and_exits(monkeypatch):
+    pytest.importorskip('customtkinter')
+    import gui
+
+    avisos, limpiezas = [], []
+    monkeypatch.setattr(gui.messagebox, 'showerror', lambda titulo, mensaje: avisos.append(mensaje))
+    with pytest.raises(SystemExit) as salida:
+        gui.exit_api_unreachable(lambda: limpiezas.append(True))
+    assert salida.value.code == 1 and limpiezas == [True]
+    assert avisos == ["No se pudo conectar a la API. La aplicación se cerrará."]
+
+
+def test_submit_sale_marks_client_errors_as_final(monkeypatch, tmp_path):
+    pytest.importorskip('customtkinter')
+    import gui
+
+    class Respuesta:
+        def __init__(self, status_code, body):
+            self.status_code, self._body, self.text = status_code, body, str(body)
+
+        def json(self):
+            return self._body
+
+    enviados = []
+    respuestas = [Respuesta(201, {'id': 1, 'total': 4.0}), Respuesta(400, {'error': 'Stock insuficiente'}),
+                  Respuesta(503, {'error': 'Servidor saturado'})]
+    monkeypatch.setattr(gui.SESSION, 'post', lambda url, json=None, **kw: enviados.append((url, json)) or respuestas.pop(0))
+    items = [{'id_producto': '3', 'cantidad': '2', 'precio_unitario': 2}]
+    assert gui.submit_sale('k1', None, '2024-01-01', items) == (True, 'Venta registrada (total: 4.00)', False)
+    assert enviados[0] == (f'{gui.API_URL}/ventas/completa', {'clave': 'k1', 'fecha_venta': '2024-01-01', 'id_cliente': None,
+                                                              'items': [{'id_producto': 3, 'cantidad': 2, 'precio_unitario': 2.0}]})
+    assert gui.submit_sale('k2', None, '2024-01-01', items)[2] is False
+    assert gui.submit_sale('k3', None, '2024-01-01', items)[2] is True
+
+    cache = gui.LocalCache(str(tmp_path / 'cache.sqlite3'))
+    cache.enqueue_sale('k2', None, '2024-01-01', items)
+    cache.sale_rejected(cache.pending_sales()[0]['id'], 'Stock insuficiente')
+    assert cache.count_pending() == 0
+
+
+def test_login_runs_on_shared_executor_and_reports_through_its_queue(monkeypatch):
+    pytest.importorskip('customtkinter')
+    import types
+    import gui
+
+    class Boton:
+        def configure(self, **kw):
+            pass
+
+    class Respuesta:
+        status_code = 401
+        headers = {'content-type': 'application/json'}
+
+        def json(self):
+            return {'error': 'Credenciales inválidas'}
+
+    enviados, encolados, errores = [], [], []
+    monkeypatch.setattr(gui.GUI_EXECUTOR, 'submit', lambda fn, *a, **kw: enviados.append(fn))
+    monkeypatch.setattr(gui.GUI_EXECUTOR, 'call_soon', encolados.append)
+    monkeypatch.setattr(gui.threading, 'Thread', lambda *a, **kw: pytest.fail('hilo propio en el login'))
+    monkeypatch.setattr(gui.SESSION, 'post', lambda url, **kw: Respuesta())
+    monkeypatch.setattr(gui.messagebox, 'showerror', lambda titulo, mensaje: errores.append(mensaje))
+    ventana = types.SimpleNamespace(
+        username_entry=types.SimpleNamespace(get=lambda: 'ana'), password_entry=types.SimpleNamespace(get=lambda: 'x'),
+        login_button=Boton(), create_user_button=Boton(), enable_buttons=lambda: None,
+        login=None, _wait_for_api=lambda retry: True)
+
+    gui.LoginWindow.login(ventana)
+    assert len(enviados) == 1 and encolados == []
+    enviados[0]()
+    # El resultado se entrega en el hilo de Tk a través de la cola del pool compartido
+    assert len(encolados) == 1 and errores == []
+    encolados[0]()
+    assert errores == ['Credenciales inválidas']
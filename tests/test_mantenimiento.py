@@ -0,0 +1,45 @@
+import os
+import sys
+from datetime import date
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import mantenimiento
+
+
+PARTICIONES = [
+    ('p_antiguo', date(2025, 1, 1)),
+    ('p202501', date(2025, 2, 1)),
+    ('p202502', date(2025, 3, 1)),
+    ('p_futuro', None),
+]
+
+
+def test_parse_bound():
+    assert mantenimiento.parse_bound("'2025-02-01'") == date(2025, 2, 1)
+    assert mantenimiento.parse_bound('MAXVALUE') is None
+
+
+def test_plan_new_partitions_fills_until_months_ahead():
+    plan = mantenimiento.plan_new_partitions(PARTICIONES, date(2025, 3, 15), 2)
+    assert plan == [('p202503', date(2025, 4, 1)), ('p202504', date(2025, 5, 1)), ('p202505', date(2025, 6, 1))]
+    assert mantenimiento.plan_new_partitions(PARTICIONES, date(2025, 1, 10), 1) == []
+
+
+def test_closed_partitions_keep_open_months():
+    cutoff = mantenimiento.add_months(date(2025, 3, 10), -1)
+    assert cutoff == date(2025, 2, 1)
+    assert [n for n, _ in mantenimiento.closed_partitions(PARTICIONES, cutoff)] == ['p_antiguo', 'p202501']
+    assert mantenimiento.add_months(date(2025, 1, 31), -1) == date(2024, 12, 1)
+
+
+def test_valuation_differences_ignore_rounding():
+    reales = {0: (3, 7.5), 1: (10, 20.0), 2: (1, 1.0)}
+    guardados = {0: (3, 7.501), 1: (9, 18.0), 3: (2, 4.0)}
+    assert mantenimiento.valuation_differences(reales, guardados) == [
+        (1, (9, 18.0), (10, 20.0)),
+        (2, (0, 0.0), (1, 1.0)),
+        (3, (2, 4.0), (0, 0.0)),
+    ]
@@ -0,0 +1,382 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import app_compacto
+import sqlite_backend
+
+
+@pytest.fixture
+def sqlite_client(monkeypatch, tmp_path):
+    """App real sobre una base SQLite nueva (esquema de db_schema.sql)."""
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('DB_SQLITE_PATH', str(tmp_path / 'inventario.sqlite3'))
+    monkeypatch.setenv('RATE_LIMIT_REPORTES', '0')
+    monkeypatch.setattr(app_compacto, '_pool', None)
+    app = app_compacto.create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def test_translate_mariadb_sql():
+    assert sqlite_backend.translate('SELECT stock FROM Productos WHERE id_producto = %s FOR UPDATE') == \
+        ('SELECT stock FROM Productos WHERE id_producto = ?', True)
+    sql, lock = sqlite_backend.translate('SELECT 1 FROM Ventas WHERE fecha_venta BETWEEN %(desde)s AND %(hasta)s')
+    assert sql == 'SELECT 1 FROM Ventas WHERE fecha_venta BETWEEN :desde AND :hasta' and not lock
+    assert sqlite_backend.translate('INSERT IGNORE INTO T (a) VALUES (%s)')[0] == 'INSERT OR IGNORE INTO T (a) VALUES (?)'
+
+
+def test_schema_and_pragmas(tmp_path):
+    conn = sqlite_backend.connect(str(tmp_path / 'db.sqlite3'))
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cur.fetchall()}
+    assert {'Productos', 'Ventas', 'Detalle_Ventas', 'Detalle_Ventas_Archivo', 'Usuarios'} <= tables
+    cur.execute('PRAGMA journal_mode')
+    assert cur.fetchone()[0] == 'wal'
+    with pytest.raises(sqlite_backend.IntegrityError):
+        cur.execute('INSERT INTO Usuarios (username, password, rol) VALUES (%s, %s, %s)', ('x', 'y', 'otro'))
+    conn.close()
+
+
+def test_existing_database_is_upgraded_on_open(tmp_path):
+    import sqlite3
+    path = str(tmp_path / 'antigua.sqlite3')
+    # Base de una versión anterior: sin Version_Datos ni Valoracion_Inventario, sin Productos.codigo
+    # y sin Detalle_Ventas.costo_unitario
+    raw = sqlite3.connect(path)
+    for statement in sqlite_backend.translate_schema(open(sqlite_backend.SCHEMA_PATH, encoding='utf-8').read()):
+        if statement.startswith('CREATE TABLE IF NOT EXISTS `Detalle_Ventas` '):
+            statement = statement.replace(',\n  `costo_unitario` decimal(10,2) NOT NULL DEFAULT 0.00', '')
+        if not any(name in statement for name in ('Version_Datos', 'Valoracion_Inventario', 'uq_productos_codigo',
+                                                  'idx_detalle_ganancias')):
+            raw.execute(statement.replace('`codigo` varchar(64) DEFAULT NULL,\n  ', ''))
+    raw.execute("INSERT INTO Productos (nombre, precio_compra, porcentaje_ganancia, stock, stock_minimo) "
+                "VALUES ('Pan', 2, 0, 5, 0)")
+    raw.execute("INSERT INTO Detalle_Ventas (fecha_venta, id_producto, cantidad, precio_unitario) VALUES ('2024-01-01', 1, 1, 3)")
+    raw.commit()
+    raw.close()
+
+    conn = sqlite_backend.connect(path)
+    cur = conn.cursor()
+    cur.execute('PRAGMA table_info(Productos)')
+    assert 'codigo' in {row[1] for row in cur.fetchall()}
+    cur.execute("SELECT name FROM sqlite_master WHERE name = 'Productos_uq_productos_codigo'")
+    assert cur.fetchone() is not None
+    cur.execute('SELECT unidades, valor FROM Valoracion_Inventario')
+    assert cur.fetchall() == [(5, 10)]
+    cur.execute('SELECT costo_unitario FROM Detalle_Ventas')
+    assert cur.fetchone()[0] == 2
+    app_compacto.bump_db_version(conn)
+    cur.execute(app_compacto.SQL_VERSION_DATOS)
+    assert cur.fetchone()[0] == 1
+    conn.close()
+
+
+def test_sale_flow_and_reports_on_sqlite(sqlite_client):
+    c = sqlite_client
+    prov = c.post('/proveedores', json={'nombre': 'Proveedor'}).get_json()['id']
+    prod = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 50,
+                                      'stock': 10, 'stock_minimo': 3, 'id_proveedor': prov}).get_json()['id']
+    venta = c.post('/ventas', json={'fecha_venta': '2024-03-01', 'total': 12}).get_json()['id']
+
+    r = c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': prod, 'cantidad': 8, 'precio_unitario': 1.5})
+    assert r.status_code == 201
+    assert c.get(f'/productos/{prod}').get_json()['stock'] == 2
+    # Sin stock suficiente no se inserta nada; venta inexistente -> 404
+    assert c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': prod, 'cantidad': 5, 'precio_unitario': 1.5}).status_code == 400
+    assert c.post('/detalle_ventas', json={'id_venta': 999, 'id_producto': prod, 'cantidad': 1, 'precio_unitario': 1.5}).status_code == 404
+
+    ganancias = c.get('/reportes/ganancias?desde=2024-01-01&hasta=2024-12-31').get_json()
+    assert ganancias['ganancia_total'] == pytest.approx(4.0)
+    assert ganancias['ganancias_por_producto'][0]['producto'] == 'Pan'
+    assert [p['nombre'] for p in c.get('/reportes/existencias_minimas').get_json()] == ['Pan']
+    assert c.delete(f'/productos/{prod}').status_code == 409
+
+
+def test_product_codes_are_unique_and_follow_updates(sqlite_client):
+    c = sqlite_client
+    prod = c.post('/productos', json={'codigo': ' 7501 ', 'nombre': 'Pan', 'precio_compra': 1,
+                                      'porcentaje_ganancia': 0, 'stock': 4, 'stock_minimo': 1}).get_json()['id']
+    assert c.get('/productos/by-code/7501').get_json()['id'] == prod
+    assert c.post('/productos', json={'codigo': '7501', 'nombre': 'Otro', 'precio_compra': 1,
+                                      'porcentaje_ganancia': 0, 'stock': 1, 'stock_minimo': 0}).status_code == 409
+
+    # Otras restricciones (proveedor inexistente) no se confunden con un código repetido
+    r = c.post('/productos', json={'codigo': '7600', 'nombre': 'Otro', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                   'stock': 1, 'stock_minimo': 0, 'id_proveedor': 9999})
+    assert r.status_code == 400 and 'código' not in r.get_json()['error']
+    assert c.put(f'/productos/{prod}', json={'id_proveedor': 9999}).status_code == 400
+    # El rollback libera el bloqueo de la fila: la siguiente edición no espera
+    assert c.put(f'/productos/{prod}', json={'codigo': '7509'}).status_code == 200
+    assert c.get('/productos/by-code/7501').status_code == 404
+    assert c.get('/productos/by-code/7509').get_json()['nombre'] == 'Pan'
+    assert c.delete(f'/productos/{prod}').status_code == 200
+    assert c.get('/productos/by-code/7509').status_code == 404
+
+    # Los productos borrados en cascada con su proveedor también salen de los índices
+    prov = c.post('/proveedores', json={'nombre': 'Proveedor'}).get_json()['id']
+    prod = c.post('/productos', json={'codigo': 'ABC', 'nombre': 'Sal', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                      'stock': 0, 'stock_minimo': 2, 'id_proveedor': prov}).get_json()['id']
+    assert c.get('/productos/by-code/ABC').get_json()['id'] == prod
+    assert [p['nombre'] for p in c.get('/reportes/existencias_minimas').get_json()] == ['Sal']
+    assert c.delete(f'/proveedores/{prov}').status_code == 200
+    assert c.get('/productos/by-code/ABC').status_code == 404
+    assert c.get('/reportes/existencias_minimas').get_json() == []
+
+
+def test_kardex_uses_nearest_snapshot_plus_movements(sqlite_client, capsys):
+    import argparse
+    from datetime import date, timedelta
+    import mantenimiento
+
+    c = sqlite_client
+    hoy = date.today().isoformat()
+    manana = (date.today() + timedelta(days=1)).isoformat()
+    prod = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                      'stock': 10, 'stock_minimo': 0}).get_json()['id']
+    compra = c.post('/compras', json={'fecha_compra': hoy, 'total': 5}).get_json()['id']
+    assert c.post('/detalle_compras', json={'id_compra': compra, 'id_producto': prod, 'cantidad': 5, 'precio_compra': 1}).status_code == 201
+    venta = c.post('/ventas', json={'fecha_venta': hoy, 'total': 3}).get_json()['id']
+    c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': prod, 'cantidad': 3, 'precio_unitario': 1})
+
+    fila = c.get(f'/reportes/kardex?desde={hoy}&hasta={hoy}').get_json()['productos'][0]
+    assert (fila['stock_inicial'], fila['entradas'], fila['salidas'], fila['stock_final']) == (0, 15, 3, 12)
+
+    conn = app_compacto.create_connection()
+    mantenimiento.cmd_snapshots(conn, argparse.Namespace(dry_run=False))
+    conn.close()
+    assert '1 productos' in capsys.readouterr().out
+    # Ajuste manual: queda en el kardex con la diferencia
+    assert c.put(f'/productos/{prod}', json={'stock': 11}).status_code == 200
+
+    # Desde mañana: foto de hoy (12) + movimientos posteriores (-1)
+    fila = c.get(f'/reportes/kardex?desde={manana}&hasta={manana}').get_json()['productos'][0]
+    assert (fila['stock_inicial'], fila['stock_final']) == (11, 11)
+    fila = c.get(f'/reportes/kardex?desde={hoy}&hasta={hoy}').get_json()['productos'][0]
+    assert (fila['entradas'], fila['salidas'], fila['stock_final']) == (15, 4, 11)
+    assert c.get(f'/productos/{prod}').get_json()['stock'] == 11
+
+
+def test_inventory_analytics_report(sqlite_client):
+    pytest.importorskip('pandas')
+    c = sqlite_client
+    pan = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 100,
+                                     'stock': 100, 'stock_minimo': 0}).get_json()['id']
+    c.post('/productos', json={'nombre': 'Sal', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                               'stock': 5, 'stock_minimo': 0})
+    venta = c.post('/ventas', json={'fecha_venta': '2024-03-01', 'total': 40}).get_json()['id']
+    c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': pan, 'cantidad': 20, 'precio_unitario': 2})
+
+    url = '/reportes/analitica?desde=2024-03-01&hasta=2024-03-10'
+    filas = c.get(url).get_json()['productos']
+    assert [(f['producto'], f['clase']) for f in filas] == [('Pan', 'A'), ('Sal', 'C')]
+    assert filas[0]['demanda_diaria'] == pytest.approx(2.0) and filas[0]['dias_cobertura'] == pytest.approx(40.0)
+    assert filas[1]['dias_cobertura'] is None
+    csv = c.get(url + '&format=csv').get_data(as_text=True)
+    assert csv.splitlines()[0].startswith('id_producto,producto,clase')
+    assert c.get('/reportes/analitica').status_code == 400
+
+
+def test_demand_forecast_job_and_apply(sqlite_client, capsys):
+    pytest.importorskip('pandas')
+    import argparse
+    from datetime import date, timedelta
+    import mantenimiento
+
+    c = sqlite_client
+    pan = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 100, 'stock_minimo': 1}).get_json()['id']
+    sal = c.post('/productos', json={'nombre': 'Sal', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 0, 'stock_minimo': 0}).get_json()['id']
+    for dias_atras in range(1, 11):
+        fecha = (date.today() - timedelta(days=dias_atras)).isoformat()
+        venta = c.post('/ventas', json={'fecha_venta': fecha, 'total': 3}).get_json()['id']
+        c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': pan, 'cantidad': 3, 'precio_unitario': 1})
+
+    conn = app_compacto.create_connection()
+    args = argparse.Namespace(dias=10, alpha=0.3, lead_time=2, z=1.65, procesos=1, dry_run=False)
+    mantenimiento.cmd_pronostico(conn, args)
+    conn.close()
+    assert '2 pronósticos guardados' in capsys.readouterr().out
+
+    filas = {f['producto']: f for f in c.get('/reportes/pronostico').get_json()}
+    assert float(filas['Pan']['demanda_diaria']) == pytest.approx(3.0)
+    assert filas['Pan']['stock_minimo_sugerido'] == 6 and filas['Sal']['stock_minimo_sugerido'] == 0
+
+    assert c.post('/pronosticos/aplicar').get_json()['actualizados'] == 2
+    assert c.get(f'/productos/{pan}').get_json()['stock_minimo'] == 6
+    assert [p['nombre'] for p in c.get('/reportes/existencias_minimas').get_json()] == ['Sal']
+    assert c.delete(f'/productos/{sal}').status_code == 200
+    assert [f['producto'] for f in c.get('/reportes/pronostico').get_json()] == ['Pan']
+
+
+def test_inventory_valuation_follows_every_change(sqlite_client, capsys):
+    import argparse
+    import mantenimiento
+
+    c = sqlite_client
+    a = c.post('/proveedores', json={'nombre': 'A'}).get_json()['id']
+    b = c.post('/proveedores', json={'nombre': 'B'}).get_json()['id']
+    pan = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 2, 'porcentaje_ganancia': 0,
+                                     'stock': 10, 'stock_minimo': 0, 'id_proveedor': a}).get_json()['id']
+    sal = c.post('/productos', json={'nombre': 'Sal', 'precio_compra': 1.5, 'porcentaje_ganancia': 0,
+                                     'stock': 4, 'stock_minimo': 0}).get_json()['id']
+    venta = c.post('/ventas', json={'fecha_venta': '2024-03-01', 'total': 3}).get_json()['id']
+    c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': pan, 'cantidad': 3, 'precio_unitario': 1})
+    compra = c.post('/compras', json={'fecha_compra': '2024-03-02', 'total': 5}).get_json()['id']
+    c.post('/detalle_compras', json={'id_compra': compra, 'id_producto': sal, 'cantidad': 2, 'precio_compra': 1.5})
+
+    def valoracion():
+        r = c.get('/reportes/valoracion').get_json()
+        return r['valor_total'], r['unidades_total'], {p['proveedor']: p['valor'] for p in r['por_proveedor']}
+
+    assert valoracion() == (23.0, 13, {'A': 14.0, 'Sin proveedor': 9.0})
+    # Cambio de precio y de proveedor: sale del total de A y entra en el de B
+    assert c.put(f'/productos/{pan}', json={'precio_compra': 3, 'id_proveedor': b}).status_code == 200
+    assert valoracion() == (30.0, 13, {'B': 21.0, 'Sin proveedor': 9.0})
+    te = c.post('/productos', json={'nombre': 'Té', 'precio_compra': 0.25, 'porcentaje_ganancia': 0,
+                                    'stock': 4, 'stock_minimo': 0, 'id_proveedor': b}).get_json()['id']
+    assert valoracion() == (31.0, 17, {'B': 22.0, 'Sin proveedor': 9.0})
+    assert c.delete(f'/productos/{te}').status_code == 200
+    assert valoracion() == (30.0, 13, {'B': 21.0, 'Sin proveedor': 9.0})
+
+    conn = app_compacto.create_connection()
+    mantenimiento.cmd_valoracion(conn, argparse.Namespace(corregir=False))
+    assert 'Valoración al día' in capsys.readouterr().out
+    # Un total desajustado se detecta y se repara
+    cur = conn.cursor()
+    cur.execute('UPDATE Valoracion_Inventario SET valor = 1 WHERE id_proveedor = %s', (b,))
+    conn.commit()
+    mantenimiento.cmd_valoracion(conn, argparse.Namespace(corregir=True))
+    conn.close()
+    assert '1 totales corregidos' in capsys.readouterr().out
+    assert valoracion()[0] == 30.0
+    # Un proveedor con productos vendidos no se borra: la cascada dejaría líneas de venta huérfanas
+    assert c.delete(f'/proveedores/{b}').status_code == 409
+    assert c.get(f'/productos/{pan}').status_code == 200
+    # Sin ventas, borrar el proveedor borra sus productos en cascada y su total
+    c.post('/productos', json={'nombre': 'Té', 'precio_compra': 0.25, 'porcentaje_ganancia': 0,
+                               'stock': 4, 'stock_minimo': 0, 'id_proveedor': a})
+    assert valoracion() == (31.0, 17, {'A': 1.0, 'B': 21.0, 'Sin proveedor': 9.0})
+    assert c.delete(f'/proveedores/{a}').status_code == 200
+    assert valoracion() == (30.0, 13, {'B': 21.0, 'Sin proveedor': 9.0})
+
+
+def test_client_and_supplier_history_pages(sqlite_client):
+    c = sqlite_client
+    cli = c.post('/clientes', json={'nombre': 'Ana'}).get_json()['id']
+    otro = c.post('/clientes', json={'nombre': 'Otro'}).get_json()['id']
+    for dia, total in ((1, 10), (2, 20), (2, 30), (5, 40)):
+        c.post('/ventas', json={'fecha_venta': f'2024-03-0{dia}', 'total': total, 'id_cliente': cli})
+    c.post('/ventas', json={'fecha_venta': '2024-03-03', 'total': 99, 'id_cliente': otro})
+
+    r = c.get(f'/clientes/{cli}/ventas?limit=2').get_json()
+    assert (r['nombre'], r['cantidad'], r['monto_total']) == ('Ana', 4, 100.0)
+    assert [(v['fecha_venta'], v['total']) for v in r['ventas']] == [('2024-03-05', 40.0), ('2024-03-02', 30.0)]
+    r = c.get(f"/clientes/{cli}/ventas?limit=2&cursor={r['siguiente']}").get_json()
+    assert [v['total'] for v in r['ventas']] == [20.0, 10.0]
+    r = c.get(f"/clientes/{cli}/ventas?limit=2&cursor={r['siguiente']}").get_json()
+    assert r['ventas'] == [] and r['siguiente'] is None
+
+    r = c.get(f'/clientes/{cli}/ventas?desde=2024-03-02&hasta=2024-03-04').get_json()
+    assert (r['cantidad'], r['monto_total'], r['siguiente']) == (2, 50.0, None)
+    assert c.get('/clientes/999/ventas').status_code == 404
+    assert c.get(f'/clientes/{cli}/ventas?cursor=ayer').status_code == 400
+
+    prov = c.post('/proveedores', json={'nombre': 'P'}).get_json()['id']
+    c.post('/compras', json={'fecha_compra': '2024-01-10', 'total': 5, 'id_proveedor': prov})
+    r = c.get(f'/proveedores/{prov}/compras').get_json()
+    assert (r['cantidad'], r['monto_total'], r['compras'][0]['fecha_compra']) == (1, 5.0, '2024-01-10')
+
+
+def test_dashboard_from_hourly_rollup(sqlite_client):
+    from datetime import date, datetime, timedelta
+
+    c = sqlite_client
+    hoy = date.today()
+    pan = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 100, 'stock_minimo': 0}).get_json()['id']
+    sal = c.post('/productos', json={'nombre': 'Sal', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 100, 'stock_minimo': 0}).get_json()['id']
+    for dias_atras, producto, cantidad in ((0, pan, 2), (0, sal, 1), (0, pan, 3), (2, pan, 4)):
+        fecha = (hoy - timedelta(days=dias_atras)).isoformat()
+        venta = c.post('/ventas', json={'fecha_venta': fecha, 'total': cantidad}).get_json()['id']
+        c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': producto, 'cantidad': cantidad, 'precio_unitario': 10})
+
+    url = f'/dashboard?desde={(hoy - timedelta(days=2)).isoformat()}&hasta={hoy.isoformat()}&ventana=3'
+    r = c.get(url).get_json()
+    assert r['totales'] == {'unidades': 10, 'importe': 100.0}
+    assert [(p['producto'], p['unidades']) for p in r['top_productos']] == [('Pan', 9), ('Sal', 1)]
+    assert [(d['importe'], d['media_movil']) for d in r['por_dia']] == [(40.0, 13.33), (0.0, 13.33), (60.0, 33.33)]
+    hora = datetime.now().hour
+    assert r['perfil_horario'][hora]['unidades'] == 10 and len(r['perfil_horario']) == 24
+    assert sum(s['importe'] for s in r['por_semana']) >= 100.0
+
+    # Dentro del TTL se reutiliza el resultado sin volver a consultar
+    venta = c.post('/ventas', json={'fecha_venta': hoy.isoformat(), 'total': 1}).get_json()['id']
+    c.post('/detalle_ventas', json={'id_venta': venta, 'id_producto': sal, 'cantidad': 1, 'precio_unitario': 10})
+    assert c.get(url).get_json()['totales']['unidades'] == 10
+    assert c.get('/dashboard?desde=2024-02-01&hasta=2024-01-01').status_code == 400
+
+
+def test_complete_sale_is_atomic_and_deduplicated_across_restarts(sqlite_client):
+    c = sqlite_client
+    pan = c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 10, 'stock_minimo': 0}).get_json()['id']
+    sal = c.post('/productos', json={'nombre': 'Sal', 'precio_compra': 1, 'porcentaje_ganancia': 0,
+                                     'stock': 1, 'stock_minimo': 0}).get_json()['id']
+    venta = {'clave': 'caja1-0001', 'fecha_venta': '2024-05-02', 'items': [
+        {'id_producto': sal, 'cantidad': 1, 'precio_unitario': 3}, {'id_producto': pan, 'cantidad': 2, 'precio_unitario': 2}]}
+    r = c.post('/ventas/completa', json=venta)
+    assert r.status_code == 201 and r.get_json()['total'] == 7.0 and len(r.get_json()['detalles']) == 2
+    id_venta = r.get_json()['id']
+
+    # Reenvío tras reiniciar la API: la clave está en la base, no en memoria
+    app = app_compacto.create_app()
+    with app.test_client() as reiniciada:
+        r = reiniciada.post('/ventas/completa', json=venta)
+    assert r.status_code == 200 and r.get_json() == {'id': id_venta, 'repetida': True}
+
+    # Una línea sin stock deshace la venta entera (cabecera, líneas y descuentos)
+    r = c.post('/ventas/completa', json={'clave': 'caja1-0002', 'items': [
+        {'id_producto': pan, 'cantidad': 1, 'precio_unitario': 2}, {'id_producto': sal, 'cantidad': 5, 'precio_unitario': 3}]})
+    assert r.status_code == 400 and f'Producto {sal}' in r.get_json()['error']
+    assert c.get(f'/productos/{pan}').get_json()['stock'] == 8
+    conn = sqlite_backend.connect(os.environ['DB_SQLITE_PATH'])
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM Ventas')
+    ventas = cur.fetchone()[0]
+    cur.execute('SELECT COUNT(*) FROM Detalle_Ventas')
+    assert (ventas, cur.fetchone()[0]) == (1, 2)
+    conn.close()
+    assert c.post('/ventas/completa', json={'items': venta['items']}).status_code == 400
+
+
+def test_external_writers_invalidate_cached_reports_and_etags(sqlite_client, capsys):
+    import mantenimiento
+
+    c = sqlite_client
+    c.post('/productos', json={'nombre': 'Pan', 'precio_compra': 2, 'porcentaje_ganancia': 0, 'stock': 5, 'stock_minimo': 0})
+    assert c.get('/reportes/valoracion').get_json()['valor_total'] == 10.0
+    etag = c.get('/productos').headers['ETag']
+
+    conn = app_compacto.create_connection()
+    cur = conn.cursor()
+    cur.execute('UPDATE Valoracion_Inventario SET valor = 1')
+    conn.commit()
+    # Sin avisar, la API sigue sirviendo lo cacheado; con Version_Datos lo descarta
+    assert c.get('/reportes/valoracion').get_json()['valor_total'] == 10.0
+    mantenimiento.notify_api(conn)
+    conn.close()
+    assert c.get('/reportes/valoracion').get_json()['valor_total'] == 1.0
+    assert c.get('/productos', headers={'If-None-Match': etag}).status_code == 200
+
+    mantenimiento.main(['valoracion', '--corregir'])
+    assert '1 totales corregidos' in capsys.readouterr().out
+    assert c.get('/reportes/valoracion').get_json()['valor_total'] == 10.0